@@ -0,0 +1,201 @@
+"""
+Answer Cache
+Cache câu trả lời cho câu hỏi KHÔNG dùng thông tin cá nhân, để câu hỏi du lịch/quà tặng
+lặp lại không tốn thêm 1 lần gọi Gemini (12 RPM mỗi key).
+
+- Key = câu hỏi đã chuẩn hóa + context (version prompt + generation index + doc ids đã retrieve)
+- Câu hỏi gần giống (khác dấu câu, thêm/bớt 1-2 từ) tìm bằng MinHash + LSH, chỉ trong cùng context
+- Giới hạn số entries (LRU) + TTL
+- Stats: hit rate, thời gian generate tiết kiệm được
+"""
+import re
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from retrieval.vietnameseTokenizer import fold_diacritics, normalize_text, split_syllables
+
+# MinHash: NUM_PERM hàm hash, LSH chia thành LSH_BANDS band x (NUM_PERM / LSH_BANDS) dòng
+# → 2 câu có Jaccard ~0.5 trở lên thường rơi chung ít nhất 1 bucket
+NUM_PERM = 64
+LSH_BANDS = 16
+# Jaccard (ước lượng) tối thiểu để coi là cùng câu hỏi
+SIMILARITY_THRESHOLD = 0.8
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Câu hỏi phụ thuộc thời điểm hỏi (prompt có THỜI GIAN HIỆN TẠI) thì không cache
+TIME_SENSITIVE_KEYWORDS = (
+    "hom nay", "ngay mai", "hom qua", "bay gio", "tuan nay", "tuan sau", "thang nay",
+    "cuoi tuan", "may gio", "thu may", "ngay may",
+)
+
+_rng = np.random.default_rng(1)
+_PERM_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize_question(question: str) -> str:
+    """'Hà Nội có gì ngon?' -> 'ha noi co gi ngon' (bỏ dấu, bỏ dấu câu, lowercase)"""
+    return " ".join(split_syllables(fold_diacritics(normalize_text(question))))
+
+
+def _shingles(normalized: str) -> Set[str]:
+    """Âm tiết + cặp âm tiết liền nhau"""
+    words = normalized.split()
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def minhash_signature(normalized: str) -> np.ndarray:
+    """Chữ ký MinHash (NUM_PERM giá trị uint64) của tập shingles"""
+    shingles = _shingles(normalized)
+    if not shingles:
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64)
+    # (a * x + b) mod p: a < 2^31, x < 2^32 nên không tràn uint64
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return (permuted & _MAX_HASH).min(axis=1)
+
+
+def _band_keys(signature: np.ndarray) -> List[Tuple[int, bytes]]:
+    rows = NUM_PERM // LSH_BANDS
+    return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+
+
+class _Entry:
+    __slots__ = ("answer", "signature", "context_key", "created_at", "generation_ms", "hits")
+
+    def __init__(self, answer: str, signature: np.ndarray, context_key: str, generation_ms: float):
+        self.answer = answer
+        self.signature = signature
+        self.context_key = context_key
+        self.created_at = time.time()
+        self.generation_ms = generation_ms
+        self.hits = 0
+
+
+class AnswerCache:
+    """Cache câu trả lời LRU + TTL, tra cứu chính xác rồi gần đúng (MinHash LSH)"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: int = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        # (context_key, band, band hash) -> các key entries
+        self.buckets: Dict[Tuple[str, int, bytes], Set[Tuple[str, str]]] = {}
+        self.lock = Lock()
+        self.stats = {
+            "exact_hits": 0,
+            "near_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "latency_saved_ms": 0.0,
+        }
+
+    @staticmethod
+    def is_cacheable(question: str) -> bool:
+        """Câu hỏi không phụ thuộc thời điểm hỏi"""
+        normalized = f" {normalize_question(question)} "
+        return not any(f" {keyword} " in normalized for keyword in TIME_SENSITIVE_KEYWORDS)
+
+    def get(self, question: str, context_key: str) -> Optional[str]:
+        """Câu trả lời đã cache cho câu hỏi (hoặc câu gần giống) với cùng context; None nếu miss"""
+        normalized = normalize_question(question)
+        with self.lock:
+            key = (normalized, context_key)
+            entry = self._live_entry(key)
+            if entry is not None:
+                self._record_hit(key, entry, "exact_hits")
+                print(f"✅ Answer cache HIT: {question[:50]}")
+                return entry.answer
+
+            signature = minhash_signature(normalized)
+            best_key, best_similarity = None, SIMILARITY_THRESHOLD
+            for band, band_hash in _band_keys(signature):
+                for candidate in self.buckets.get((context_key, band, band_hash), ()):
+                    similarity = float(np.mean(self.entries[candidate].signature == signature))
+                    if similarity >= best_similarity:
+                        best_key, best_similarity = candidate, similarity
+            if best_key is not None and self._live_entry(best_key) is not None:
+                entry = self.entries[best_key]
+                self._record_hit(best_key, entry, "near_hits")
+                print(f"✅ Answer cache HIT (gần giống {best_similarity:.2f}): {question[:50]}")
+                return entry.answer
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, question: str, context_key: str, answer: str, generation_ms: float):
+        """Lưu câu trả lời (generation_ms: thời gian gọi LLM, để tính thời gian tiết kiệm khi hit)"""
+        if not answer:
+            return
+        normalized = normalize_question(question)
+        key = (normalized, context_key)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            entry = _Entry(answer, minhash_signature(normalized), context_key, generation_ms)
+            self.entries[key] = entry
+            for band, band_hash in _band_keys(entry.signature):
+                self.buckets.setdefault((context_key, band, band_hash), set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+            print("🗑️ Answer cache cleared")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            hits = self.stats["exact_hits"] + self.stats["near_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "latency_saved_ms": round(self.stats["latency_saved_ms"], 1),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    # --- Nội bộ (gọi khi đang giữ lock) ---
+
+    def _live_entry(self, key: Tuple[str, str]) -> Optional[_Entry]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created_at >= self.ttl_seconds:
+            self._remove(key)
+            self.stats["expired"] += 1
+            return None
+        return entry
+
+    def _record_hit(self, key: Tuple[str, str], entry: _Entry, kind: str):
+        self.entries.move_to_end(key)
+        entry.hits += 1
+        self.stats[kind] += 1
+        self.stats["latency_saved_ms"] += entry.generation_ms
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self.entries.pop(key)
+        for band, band_hash in _band_keys(entry.signature):
+            bucket = self.buckets.get((entry.context_key, band, band_hash))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[(entry.context_key, band, band_hash)]
+
+
+def replay_chunks(answer: str, words_per_chunk: int = 3) -> Iterator[str]:
+    """Chia câu trả lời đã cache thành các mảnh (giữ nguyên khoảng trắng) để phát lại như token SSE"""
+    pieces = re.findall(r"\S+\s*|\s+", answer)
+    for start in range(0, len(pieces), words_per_chunk):
+        yield "".join(pieces[start:start + words_per_chunk])
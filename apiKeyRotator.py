@@ -0,0 +1,605 @@
+"""
+API Key Rotator
+Admission layer cho các Gemini API keys (free tier):
+- Token bucket cho mỗi key: RPM, TPM (giới hạn an toàn thấp hơn limit thật). TPM trừ theo số token
+  ước lượng trước khi gọi, sau khi gọi điều chỉnh theo số token Gemini trả về nếu có. SDK đang pin
+  (google-generativeai 0.3.2 / google-ai-generativelanguage 0.4.0) không có usage_metadata: prompt tokens
+  luôn là ước lượng, output tokens lấy từ Candidate.token_count khi API điền (generate_content);
+  get_stats()["token_accounting"] cho biết bao nhiêu lần gọi dùng số thật
+- Ngân sách ngày (RPD) mỗi key, reset lúc nửa đêm giờ Pacific như Gemini, kèm dự báo thời điểm hết
+- Prompt lớn được chuyển sang key còn nhiều TPM nhất thay vì xoay vòng
+- Hàng đợi FIFO có giới hạn + deadline: mọi key đều hết lượt thì request chờ ngắn
+  thay vì gọi vượt limit rồi nhận lỗi 429
+- Circuit breaker mỗi key: lỗi 429/quota → key nghỉ với cooldown tăng gấp đôi mỗi lần
+  (exponential backoff), hết cooldown cho đúng 1 request thử (half-open)
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, time as dtime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+# Rate limits Free tier Gemini Flash Lite
+RPM_LIMIT = 15
+TPM_LIMIT = 1_000_000
+RPD_LIMIT = 1000
+# Giới hạn an toàn dùng cho token buckets
+SAFE_RPM = 12
+SAFE_TPM = 800_000
+SAFE_RPD = 950
+
+# Gemini reset quota ngày (RPD) lúc nửa đêm giờ Pacific
+QUOTA_TIMEZONE = pytz.timezone("America/Los_Angeles")
+# Prompt từ mức này (token ước lượng) → chọn key còn nhiều TPM nhất
+LARGE_PROMPT_TOKENS = 3000
+# Dự báo hết quota ngày tính tốc độ trên ít nhất chừng này giây (tránh dự báo ảo ngay sau khi khởi động)
+PROJECTION_MIN_WINDOW = 600.0
+
+# Hàng đợi khi mọi key đều hết lượt
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))  # giây chờ tối đa
+
+# Circuit breaker
+BASE_COOLDOWN = 5.0    # giây nghỉ sau lỗi quota đầu tiên, gấp đôi mỗi lần tiếp theo
+MAX_COOLDOWN = 300.0
+FAILURE_THRESHOLD = 3  # lỗi khác (không phải quota) liên tiếp trước khi mở breaker
+
+
+class RateLimitExceeded(Exception):
+    """Không có key nào dùng được trước deadline (hoặc hàng đợi đầy) → trả 429 cho client"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QuotaExceededError(Exception):
+    """
+    Gemini trả 429 / RESOURCE_EXHAUSTED.
+    Không kế thừa GoogleAPIError để retry (tenacity) bên trong langchain-google-genai
+    không thử lại trên cùng key, rotator sẽ chuyển key.
+    """
+
+
+def is_quota_error(error: Exception) -> bool:
+    if isinstance(error, QuotaExceededError):
+        return True
+    try:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+        if isinstance(error, (ResourceExhausted, TooManyRequests)):
+            return True
+    except ImportError:
+        pass
+    text = str(error).lower()
+    return "429" in text or "quota" in text or "resource_exhausted" in text or "resource exhausted" in text
+
+
+# Usage (prompt_tokens, output_tokens) của lần gọi Gemini gần nhất trong thread hiện tại,
+# None ở vị trí API không trả về
+_usage = threading.local()
+
+
+def start_usage_capture():
+    """Gọi trước khi invoke/stream chain; sau đó đọc captured_usage() trong cùng thread"""
+    _usage.value = None
+
+
+def captured_usage() -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """(prompt_tokens, output_tokens) Gemini trả về, None ở phần không có; None nếu không có gì"""
+    return getattr(_usage, "value", None)
+
+
+def _record_usage(response, stream: bool = False):
+    # SDK mới (generativelanguage >= 0.6): usage_metadata, stream thì chunk cuối mang tổng cộng dồn
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is not None and metadata.total_token_count:
+        _usage.value = (metadata.prompt_token_count, metadata.candidates_token_count)
+        return
+    if stream:
+        # Candidate.token_count của từng chunk không rõ là cộng dồn hay riêng chunk → không dùng
+        return
+    # SDK đang pin: chỉ có số token output của candidate (0 nếu API không điền)
+    output_tokens = sum(getattr(candidate, "token_count", 0) for candidate in getattr(response, "candidates", ()))
+    if output_tokens:
+        _usage.value = (None, output_tokens)
+
+
+class QuotaAwareClient:
+    """
+    Bọc GenerativeServiceClient: lỗi quota → QuotaExceededError (kể cả lỗi giữa stream),
+    ghi lại số token response mang theo cho captured_usage()
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, *args, **kwargs):
+        try:
+            response = self._client.generate_content(*args, **kwargs)
+        except Exception as e:
+            if is_quota_error(e):
+                raise QuotaExceededError(str(e)) from e
+            raise
+        _record_usage(response)
+        return response
+
+    def stream_generate_content(self, *args, **kwargs):
+        try:
+            iterator = self._client.stream_generate_content(*args, **kwargs)
+        except Exception as e:
+            if is_quota_error(e):
+                raise QuotaExceededError(str(e)) from e
+            raise
+        return self._iterate(iterator)
+
+    @staticmethod
+    def _iterate(iterator):
+        try:
+            for response in iterator:
+                _record_usage(response, stream=True)
+                yield response
+        except Exception as e:
+            if is_quota_error(e):
+                raise QuotaExceededError(str(e)) from e
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class TokenBucket:
+    """Bucket đầy capacity, nạp lại đều capacity / period_seconds mỗi giây"""
+
+    def __init__(self, capacity: float, period_seconds: float):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Số giây cần chờ để đủ amount (request lớn hơn capacity chỉ cần bucket đầy)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def next_quota_reset(now: float) -> float:
+    """Epoch giây của nửa đêm Pacific kế tiếp"""
+    tomorrow = datetime.fromtimestamp(now, QUOTA_TIMEZONE).date() + timedelta(days=1)
+    return QUOTA_TIMEZONE.localize(datetime.combine(tomorrow, dtime.min)).timestamp()
+
+
+class DailyBudget:
+    """Số requests/tokens đã dùng trong ngày quota hiện tại (tính trong process này)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._start(time.time())
+
+    def _start(self, now: float):
+        self.requests = 0
+        self.tokens = 0
+        self.window_start = now
+        self.reset_at = next_quota_reset(now)
+
+    def _roll(self, now: float):
+        if now >= self.reset_at:
+            self._start(now)
+
+    def remaining(self, now: float) -> int:
+        self._roll(now)
+        return max(0, self.limit - self.requests)
+
+    def wait_time(self, now: float) -> float:
+        """0 nếu còn lượt, không thì số giây tới lúc reset"""
+        return 0.0 if self.remaining(now) > 0 else self.reset_at - now
+
+    def consume(self, now: float):
+        self._roll(now)
+        self.requests += 1
+
+    def projected_exhaustion(self, now: float) -> Optional[float]:
+        """Thời điểm (epoch) hết lượt nếu giữ tốc độ hiện tại; None nếu không hết trước khi reset"""
+        remaining = self.remaining(now)
+        if self.requests == 0:
+            return None
+        rate = self.requests / max(now - self.window_start, PROJECTION_MIN_WINDOW)
+        eta = now + remaining / rate
+        return eta if eta < self.reset_at else None
+
+
+class CircuitBreaker:
+    """closed → open (cooldown) → half_open (1 request thử) → closed / open lại"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.open_until = 0.0
+        self.consecutive_failures = 0
+        self.consecutive_opens = 0
+        self.trial_in_flight = False
+
+    def wait_time(self, now: float) -> float:
+        """0 nếu key nhận request được ngay"""
+        if self.state == self.OPEN:
+            if now < self.open_until:
+                return self.open_until - now
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.HALF_OPEN and self.trial_in_flight:
+            return BASE_COOLDOWN
+        return 0.0
+
+    def remaining(self, now: float) -> float:
+        """Cooldown còn lại, chỉ đọc (không chuyển open → half_open như wait_time)"""
+        return max(0.0, self.open_until - now) if self.state == self.OPEN else 0.0
+
+    def on_acquire(self):
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = True
+
+    def release_trial(self):
+        """Request thử bị hủy giữa chừng (client ngắt stream): không tính thành công hay lỗi"""
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.consecutive_opens = 0
+        self.trial_in_flight = False
+
+    def record_failure(self, now: float, quota: bool) -> Optional[float]:
+        """Ghi nhận lỗi; trả về cooldown (giây) nếu breaker mở"""
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if not quota and self.state == self.CLOSED and self.consecutive_failures < FAILURE_THRESHOLD:
+            return None
+        cooldown = min(BASE_COOLDOWN * (2 ** self.consecutive_opens), MAX_COOLDOWN)
+        self.consecutive_opens += 1
+        self.state = self.OPEN
+        self.open_until = now + cooldown
+        return cooldown
+
+
+class KeyState:
+    """Buckets + breaker + thống kê của 1 key"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.rpm = TokenBucket(SAFE_RPM, 60)
+        self.tpm = TokenBucket(SAFE_TPM, 60)
+        self.daily = DailyBudget(SAFE_RPD)
+        self.breaker = CircuitBreaker()
+        self.total_requests = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.estimated_tokens = 0
+        # Lần gọi thành công / có prompt tokens thật / có output tokens thật (còn lại là ước lượng)
+        self.usage_calls = 0
+        self.reported_prompt_calls = 0
+        self.reported_output_calls = 0
+        # Chỉ các lần có prompt tokens thật: so với ước lượng tương ứng để đo estimate_ratio
+        self.reported_prompt_tokens = 0
+        self.reported_prompt_estimates = 0
+        self.quota_errors = 0
+        self.other_errors = 0
+        self.last_error = None
+        self.last_used = 0.0
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        return max(
+            self.breaker.wait_time(now),
+            self.rpm.wait_time(1, now),
+            self.tpm.wait_time(tokens, now),
+            self.daily.wait_time(time.time()),
+        )
+
+    @property
+    def masked(self) -> str:
+        return f"{self.key[:10]}...{self.key[-4:]}"
+
+
+class APIKeyRotator:
+    """
+    Quản lý luân phiên nhiều API keys với rate limiting thông minh
+
+    Rate Limits (Free tier Gemini 2.0 Flash Lite):
+    - 15 RPM (Requests Per Minute)
+    - 1,000,000 TPM (Tokens Per Minute)
+    - 1000 RPD (Requests Per Day, reset nửa đêm giờ Pacific)
+    """
+
+    # Giữ tên cũ cho code đang dùng APIKeyRotator.SAFE_RPM
+    RPM_LIMIT = RPM_LIMIT
+    SAFE_RPM = SAFE_RPM
+
+    def __init__(self, max_queue: int = MAX_QUEUE, queue_timeout: float = QUEUE_TIMEOUT):
+        self.api_keys = self._load_api_keys()
+        if not self.api_keys:
+            raise ValueError("Không tìm thấy API keys. Vui lòng cấu hình GOOGLE_API_KEY_1, GOOGLE_API_KEY_2, GOOGLE_API_KEY_3")
+
+        self.states = {key: KeyState(key) for key in self.api_keys}
+        self.current_index = 0
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.waiting = deque()
+        self.queue_stats = {"queued": 0, "rejected": 0, "timed_out": 0, "total_wait_ms": 0.0}
+
+        print(f"✅ API Key Rotator initialized với {len(self.api_keys)} keys")
+        print(f"   Rate limit: {SAFE_RPM} RPM per key (safe limit)")
+        print(f"   Total capacity: ~{SAFE_RPM * len(self.api_keys)} RPM")
+
+    def _load_api_keys(self) -> List[str]:
+        """Load tất cả API keys từ environment variables"""
+        keys = []
+
+        # Thử load từ GOOGLE_API_KEY_1, GOOGLE_API_KEY_2, GOOGLE_API_KEY_3
+        for i in range(1, 10):  # Hỗ trợ tối đa 9 keys
+            key = os.getenv(f"GOOGLE_API_KEY_{i}")
+            if key:
+                keys.append(key)
+
+        # Fallback: nếu không có key nào, dùng GOOGLE_API_KEY (backward compatible)
+        if not keys:
+            default_key = os.getenv("GOOGLE_API_KEY")
+            if default_key:
+                keys.append(default_key)
+
+        return keys
+
+    # --- Admission ---
+
+    def acquire(self, estimated_tokens: float = 0, timeout: Optional[float] = None) -> str:
+        """
+        Lấy key còn lượt cho 1 lần gọi LLM; chờ trong hàng đợi FIFO nếu mọi key đều hết lượt.
+
+        Args:
+            estimated_tokens: Số token ước lượng của prompt (trừ vào bucket TPM)
+            timeout: Thời gian chờ tối đa (mặc định queue_timeout)
+
+        Raises:
+            RateLimitExceeded: Hàng đợi đầy, hoặc không có key trước deadline
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self.condition:
+            if len(self.waiting) >= self.max_queue:
+                self.queue_stats["rejected"] += 1
+                raise RateLimitExceeded("Hệ thống đang quá tải, vui lòng thử lại sau", self._min_wait(estimated_tokens, start))
+            ticket = object()
+            self.waiting.append(ticket)
+            queued = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self.waiting[0] is ticket:
+                        key, wait = self._pick_key(estimated_tokens, now)
+                        if key is not None:
+                            self._consume(key, estimated_tokens, now)
+                            self.queue_stats["total_wait_ms"] += (now - start) * 1000
+                            return key
+                        if now + wait > deadline:
+                            # Không kịp trước deadline → báo ngay, không bắt client chờ vô ích
+                            self.queue_stats["timed_out"] += 1
+                            raise RateLimitExceeded("Tất cả API keys đang hết lượt, vui lòng thử lại sau", wait)
+                    else:
+                        wait = deadline - now
+                    if not queued:
+                        queued = True
+                        self.queue_stats["queued"] += 1
+                    self.condition.wait(max(min(wait, deadline - now), 0.001))
+            finally:
+                self.waiting.remove(ticket)
+                self.condition.notify_all()
+
+    def get_next_key(self) -> str:
+        """Lấy API key tiếp theo với smart rate limiting"""
+        return self.acquire()
+
+    def _pick_key(self, tokens: float, now: float) -> Tuple[Optional[str], float]:
+        """
+        (key dùng được ngay, 0) hoặc (None, thời gian chờ ngắn nhất).
+        Prompt thường: round-robin. Prompt lớn: key còn nhiều TPM nhất, để các prompt lớn
+        liên tiếp không dồn vào cùng 1 key.
+        """
+        min_wait = float("inf")
+        ready = []
+        for i in range(len(self.api_keys)):
+            idx = (self.current_index + i) % len(self.api_keys)
+            key = self.api_keys[idx]
+            wait = self.states[key].wait_time(tokens, now)
+            if wait <= 0:
+                if tokens < LARGE_PROMPT_TOKENS:
+                    self.current_index = (idx + 1) % len(self.api_keys)
+                    return key, 0.0
+                ready.append(key)
+            else:
+                min_wait = min(min_wait, wait)
+        if ready:
+            return max(ready, key=lambda key: self.states[key].tpm.available(now)), 0.0
+        return None, min_wait
+
+    def _min_wait(self, tokens: float, now: float) -> float:
+        return min(state.wait_time(tokens, now) for state in self.states.values())
+
+    def _consume(self, key: str, tokens: float, now: float):
+        state = self.states[key]
+        state.rpm.consume(1, now)
+        state.tpm.consume(tokens, now)
+        state.daily.consume(time.time())
+        state.breaker.on_acquire()
+        state.total_requests += 1
+        state.last_used = time.time()
+
+    # --- Kết quả gọi LLM ---
+
+    def report_success(
+        self, key: str, estimated_tokens: float = 0, prompt_tokens: int = 0, output_tokens: int = 0,
+        prompt_reported: bool = False, output_reported: bool = False,
+    ):
+        """
+        Ghi nhận lần gọi thành công + usage: bucket TPM được điều chỉnh theo chênh lệch giữa token
+        (prompt + output) và số ước lượng đã trừ lúc acquire. prompt_reported / output_reported:
+        số đó do Gemini trả về hay ước lượng cục bộ (chỉ để thống kê)
+        """
+        with self.condition:
+            state = self.states[key]
+            state.breaker.record_success()
+            state.usage_calls += 1
+            state.reported_prompt_calls += prompt_reported
+            state.reported_output_calls += output_reported
+            if prompt_reported:
+                state.reported_prompt_tokens += prompt_tokens
+                state.reported_prompt_estimates += estimated_tokens
+            actual = prompt_tokens + output_tokens
+            if actual:
+                state.tpm.consume(actual - estimated_tokens, time.monotonic())
+                state.daily.tokens += actual
+                state.prompt_tokens += prompt_tokens
+                state.output_tokens += output_tokens
+                state.estimated_tokens += estimated_tokens
+            self.condition.notify_all()
+
+    def report_failure(self, key: str, error: Exception):
+        """Lỗi quota → mở breaker ngay (cooldown tăng dần); lỗi khác → mở sau FAILURE_THRESHOLD lần liên tiếp"""
+        quota = is_quota_error(error)
+        with self.condition:
+            state = self.states[key]
+            if quota:
+                state.quota_errors += 1
+                # Gemini đã từ chối → coi như hết lượt phút này
+                state.rpm.tokens = min(state.rpm.tokens, 0.0)
+            else:
+                state.other_errors += 1
+            state.last_error = str(error)[:200]
+            cooldown = state.breaker.record_failure(time.monotonic(), quota)
+            self.condition.notify_all()
+        if cooldown is not None:
+            print(f"🔴 Key {state.masked} nghỉ {cooldown:.0f}s ({'quota' if quota else 'lỗi liên tiếp'})")
+
+    def report_aborted(self, key: str):
+        """
+        Lần gọi bị hủy trước khi có kết quả (GeneratorExit khi client ngắt SSE): trả lại lượt thử
+        half_open để key không bị kẹt ở trạng thái 'đang thử' mãi
+        """
+        with self.condition:
+            self.states[key].breaker.release_trial()
+            self.condition.notify_all()
+
+    # --- Thống kê ---
+
+    @staticmethod
+    def _iso(timestamp: Optional[float]) -> Optional[str]:
+        return datetime.fromtimestamp(timestamp, QUOTA_TIMEZONE).isoformat() if timestamp else None
+
+    def _token_accounting(self) -> Dict:
+        """Nguồn số token trong TPM / tokens_used: bao nhiêu lần gọi dùng số Gemini trả về"""
+        calls = sum(state.usage_calls for state in self.states.values())
+        prompt_reported = sum(state.reported_prompt_calls for state in self.states.values())
+        output_reported = sum(state.reported_output_calls for state in self.states.values())
+        accounting = {"calls": calls, "prompt_reported": prompt_reported, "output_reported": output_reported}
+        if prompt_reported < calls or output_reported < calls:
+            accounting["note"] = (
+                "Phần còn lại là ước lượng cục bộ (estimate_tokens): SDK đang dùng không trả usage_metadata, "
+                "output tokens chỉ có khi Candidate.token_count được điền (không stream)"
+            )
+        return accounting
+
+    def get_stats(self) -> Dict:
+        """Lấy thống kê sử dụng + health các API keys"""
+        with self.lock:
+            now = time.monotonic()
+            wall_now = time.time()
+            key_stats = []
+            for key in self.api_keys:
+                state = self.states[key]
+                rpm = max(0, round(SAFE_RPM - state.rpm.available(now)))
+                cooldown = state.breaker.remaining(now)
+                if state.breaker.state != CircuitBreaker.CLOSED:
+                    status = "🔴 COOLDOWN" if cooldown > 0 else "🟡 PROBING"
+                else:
+                    status = "🟢 OK" if rpm < SAFE_RPM * 0.8 else "🟡 BUSY" if rpm < SAFE_RPM else "🔴 LIMIT"
+                key_stats.append({
+                    "key_masked": state.masked,
+                    "total_requests": state.total_requests,
+                    "current_rpm": rpm,
+                    "rpm_limit": SAFE_RPM,
+                    "usage_percent": round(rpm / SAFE_RPM * 100, 1),
+                    "tpm_available": int(state.tpm.available(now)),
+                    "daily": {
+                        "requests_used": state.daily.requests,
+                        "limit": SAFE_RPD,
+                        "remaining": state.daily.remaining(wall_now),
+                        "tokens_used": state.daily.tokens,
+                        "projected_exhaustion": self._iso(state.daily.projected_exhaustion(wall_now)),
+                    },
+                    "prompt_tokens": state.prompt_tokens,
+                    "output_tokens": state.output_tokens,
+                    # prompt tokens thật / ước lượng: lệch xa 1.0 thì chỉnh TOKENS_PER_UNIT
+                    # (None khi API chưa trả prompt tokens lần nào, vd SDK đang pin)
+                    "estimate_ratio": (
+                        round(state.reported_prompt_tokens / state.reported_prompt_estimates, 3)
+                        if state.reported_prompt_estimates else None
+                    ),
+                    "circuit": state.breaker.state,
+                    "cooldown_remaining": round(cooldown, 1),
+                    "consecutive_failures": state.breaker.consecutive_failures,
+                    "quota_errors": state.quota_errors,
+                    "other_errors": state.other_errors,
+                    "last_error": state.last_error,
+                    "status": status
+                })
+
+            served = sum(state.total_requests for state in self.states.values())
+            daily_remaining = sum(stats["daily"]["remaining"] for stats in key_stats)
+            daily_used = sum(state.daily.requests for state in self.states.values())
+            window_start = min(state.daily.window_start for state in self.states.values())
+            reset_at = next_quota_reset(wall_now)
+            projected = None
+            if daily_used:
+                # Tốc độ chung của cả pool (round-robin nên các key hết gần như cùng lúc)
+                rate = daily_used / max(wall_now - window_start, PROJECTION_MIN_WINDOW)
+                eta = wall_now + daily_remaining / rate
+                projected = eta if eta < reset_at else None
+            return {
+                "total_keys": len(self.api_keys),
+                "total_capacity_rpm": SAFE_RPM * len(self.api_keys),
+                "daily": {
+                    "limit": SAFE_RPD * len(self.api_keys),
+                    "used": daily_used,
+                    "remaining": daily_remaining,
+                    "reset_at": self._iso(reset_at),
+                    "projected_exhaustion": self._iso(projected),
+                },
+                "keys": key_stats,
+                "token_accounting": self._token_accounting(),
+                "queue": {
+                    "waiting": len(self.waiting),
+                    "max_queue": self.max_queue,
+                    "timeout_seconds": self.queue_timeout,
+                    **self.queue_stats,
+                    "total_wait_ms": round(self.queue_stats["total_wait_ms"], 1),
+                    "avg_wait_ms": round(self.queue_stats["total_wait_ms"] / served, 2) if served else 0.0,
+                },
+            }
@@ -0,0 +1,100 @@
+"""
+Benchmark nhận diện câu hỏi cá nhân: vòng lặp substring cũ vs PersonalMatcher
+Mỗi câu bị nhận nhầm là cá nhân = thêm Firestore reads + token prompt không cần thiết.
+
+Dữ liệu: personal_testdata.csv (message,is_personal,source) gồm các câu trong chat_messages.csv,
+test_personal.json và các câu bổ sung (nhiều câu chứa "em", "ny"... giữa chữ: "xem", "kem", "sunny").
+
+Cách chạy:
+    python benchmark_personal.py
+    python benchmark_personal.py --threshold 1.0 --repeat 200
+"""
+
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from personalMatcher import PERSONAL_THRESHOLD, PersonalMatcher
+
+TEST_DATA_FILE = "personal_testdata.csv"
+
+# Danh sách từ khóa của is_personal_question() trước đây (so khớp `keyword in message.lower()`)
+LEGACY_KEYWORDS = [
+    'tôi', 'mình', 'em', 'của tôi', 'của mình', 'của em',
+    'sinh nhật', 'ngày sinh', 'tuổi', 'bao nhiêu tuổi',
+    'tên tôi', 'tên mình', 'tên em',
+    'người yêu', 'bạn trai', 'bạn gái', 'ny', 'crush',
+    'của anh ấy', 'của cô ấy', 'của bạn ấy',
+    'hẹn hò', 'yêu nhau', 'bắt đầu yêu', 'kỷ niệm',
+    'chúng tôi', 'hai đứa', 'hai người', 'cả hai',
+    'kế hoạch của tôi', 'kế hoạch của mình', 'kế hoạch của em',
+    'kế hoạch chúng tôi', 'định làm gì', 'sắp đi đâu',
+    'dự định', 'có kế hoạch nào',
+]
+
+
+def legacy_is_personal(message):
+    message_lower = message.lower()
+    for keyword in LEGACY_KEYWORDS:
+        if keyword in message_lower:
+            return True
+    return False
+
+
+def load_examples():
+    with open(TEST_DATA_FILE, "r", encoding="utf-8") as f:
+        return [(row["message"], row["is_personal"] == "1") for row in csv.DictReader(f)]
+
+
+def evaluate(fn, examples):
+    """(precision, recall, các câu nhận nhầm là cá nhân, các câu bỏ sót)"""
+    false_positives = [message for message, label in examples if fn(message) and not label]
+    false_negatives = [message for message, label in examples if not fn(message) and label]
+    positives = sum(label for _, label in examples)
+    true_positives = positives - len(false_negatives)
+    predicted = true_positives + len(false_positives)
+    precision = true_positives / predicted if predicted else 1.0
+    recall = true_positives / positives if positives else 1.0
+    return precision, recall, false_positives, false_negatives
+
+
+def measure(fn, messages, repeat):
+    """Latency (µs) trung bình mỗi câu của từng lượt chạy cả bộ"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            fn(message)
+        latencies.append((time.perf_counter() - start) * 1e6 / len(messages))
+    return np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nhận diện câu hỏi cá nhân")
+    parser.add_argument("--threshold", type=float, default=PERSONAL_THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=100, help="Số lần lặp lại bộ câu khi đo latency")
+    args = parser.parse_args()
+
+    examples = load_examples()
+    messages = [message for message, _ in examples]
+    matcher = PersonalMatcher(threshold=args.threshold)
+    print(f"📚 {len(examples)} câu ({sum(label for _, label in examples)} cá nhân), ngưỡng {args.threshold}")
+
+    for name, fn in [("substring (cũ)", legacy_is_personal), ("PersonalMatcher", matcher.is_personal)]:
+        precision, recall, false_positives, false_negatives = evaluate(fn, examples)
+        latencies = measure(fn, messages, args.repeat)
+        print(f"\n{name}:")
+        print(f"  precision {precision:.2%} | recall {recall:.2%}")
+        print(f"  latency p50 {np.median(latencies):.1f} µs / p95 {np.percentile(latencies, 95):.1f} µs mỗi câu")
+        print(f"  Nhận nhầm là cá nhân (Firestore reads thừa): {len(false_positives)}")
+        for message in false_positives:
+            print(f"    ⚠️ '{message}'")
+        print(f"  Bỏ sót: {len(false_negatives)}")
+        for message in false_negatives:
+            print(f"    ⚠️ '{message}' (score {matcher.score(message):.2f})")
+
+
+if __name__ == "__main__":
+    main()
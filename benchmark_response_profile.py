@@ -0,0 +1,53 @@
+"""
+Benchmark phân loại độ dài câu trả lời (responseProfile.QuestionClassifier)
+Câu xin gợi ý bị xếp factual chỉ nhận 320 token "1-3 câu" → câu trả lời thiếu lựa chọn;
+câu tra cứu bị xếp recommendation tốn thêm thời gian generate.
+
+Dữ liệu: response_profile_testdata.csv (message,profile,source)
+
+Cách chạy:
+    python benchmark_response_profile.py
+"""
+
+import argparse
+import csv
+from collections import Counter
+
+from responseProfile import QuestionClassifier
+
+TEST_DATA_FILE = "response_profile_testdata.csv"
+
+
+def load_examples(path=TEST_DATA_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        return [(row["message"], row["profile"]) for row in csv.DictReader(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark phân loại độ dài câu trả lời")
+    parser.add_argument("--data", default=TEST_DATA_FILE)
+    args = parser.parse_args()
+
+    examples = load_examples(args.data)
+    classifier = QuestionClassifier()
+    predictions = [classifier.classify(message).name for message, _ in examples]
+    print(f"📚 {len(examples)} câu")
+
+    totals, hits = Counter(), Counter()
+    mistakes = []
+    for (message, label), predicted in zip(examples, predictions):
+        totals[label] += 1
+        if predicted == label:
+            hits[label] += 1
+        else:
+            mistakes.append((message, label, predicted))
+    for label in sorted(totals):
+        print(f"  {label:<15} accuracy {hits[label] / totals[label]:.2%} ({hits[label]}/{totals[label]})")
+    print(f"  Tổng: {sum(hits.values()) / len(examples):.2%}")
+    print(f"  Phân loại sai: {len(mistakes)}")
+    for message, label, predicted in mistakes:
+        print(f"    ⚠️ '{message}' ({label}) -> {predicted}")
+
+
+if __name__ == "__main__":
+    main()
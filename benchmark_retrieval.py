@@ -0,0 +1,154 @@
+"""
+Benchmark retrieval BM25: độ trễ query theo kích thước corpus
+So sánh chấm điểm toàn bộ (exhaustive) với MaxScore (BM25Index.top_k), kiểm tra kết quả giống nhau
+trên bộ query thật và trên các tổ hợp term ngẫu nhiên (ép MaxScore chạy cả với postings ngắn).
+
+Corpus tổng hợp được ghép ngẫu nhiên từ các câu trong dulieu.csv, Hanoi.md và notes/*.txt
+để phân bố term giống dữ liệu thật (nhiều term rất phổ biến như "hà nội", "du lịch").
+Query lấy từ hanoi_testdata.csv.
+
+Cách chạy:
+    python benchmark_retrieval.py
+    python benchmark_retrieval.py --sizes 1000,10000,100000,300000 --k 3
+"""
+
+import argparse
+import csv
+import glob
+import re
+import time
+
+import numpy as np
+
+from retrieval import bm25Index
+from retrieval.bm25Index import BM25Index, select_top_k
+
+DATA_FILE = "dulieu.csv"
+HANOI_FILE = "Hanoi.md"
+NOTES_PATTERN = "notes/*.txt"
+TEST_DATA_FILE = "hanoi_testdata.csv"
+DEFAULT_SIZES = "1000,10000,50000,100000"
+CHECK_KS = (1, 3, 10)
+
+
+def load_sentences():
+    """Gom các câu trong dữ liệu thật làm nguyên liệu ghép corpus"""
+    texts = []
+    with open(DATA_FILE, "r", encoding="utf-8") as f:
+        texts.extend(" ".join(row.values()) for row in csv.DictReader(f))
+    for path in [HANOI_FILE] + sorted(glob.glob(NOTES_PATTERN)):
+        with open(path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    sentences = []
+    for text in texts:
+        sentences.extend(s.strip() for s in re.split(r"[.\n!?]+", text) if len(s.split()) >= 3)
+    return sentences
+
+
+def load_queries():
+    with open(TEST_DATA_FILE, "r", encoding="utf-8") as f:
+        return [row["Question"] for row in csv.DictReader(f)]
+
+
+def synthetic_corpus(sentences, n_docs, rng):
+    """Mỗi document = 3-8 câu chọn ngẫu nhiên"""
+    lengths = rng.integers(3, 9, size=n_docs)
+    picks = rng.integers(0, len(sentences), size=int(lengths.sum()))
+    docs, start = [], 0
+    for length in lengths:
+        docs.append(". ".join(sentences[i] for i in picks[start:start + length]))
+        start += length
+    return docs
+
+
+def exhaustive_top_k(index, query, k):
+    return select_top_k(index.score(query), k)
+
+
+def same_results(expected, actual):
+    """Cùng số kết quả và cùng điểm (doc id có thể khác khi điểm bằng nhau)"""
+    if len(expected) != len(actual):
+        return False
+    return np.allclose([score for _, score in expected], [score for _, score in actual], rtol=1e-5)
+
+
+def check_pruning(index, queries, k, rng, n_random):
+    """
+    Danh sách (mô tả, exhaustive, maxscore) khác nhau: queries thật với k, sau đó n_random tổ hợp
+    2-4 term ngẫu nhiên với từng k trong CHECK_KS (PRUNING_MIN_POSTINGS = 0 để luôn đi MaxScore)
+    """
+    mismatches = []
+    for query in queries:
+        expected, actual = exhaustive_top_k(index, query, k), index.top_k(query, k)
+        if not same_results(expected, actual):
+            mismatches.append((f"'{query}' k={k}", expected, actual))
+
+    n_terms = len(index.indptr) - 1
+    min_postings = bm25Index.PRUNING_MIN_POSTINGS
+    bm25Index.PRUNING_MIN_POSTINGS = 0
+    try:
+        for _ in range(n_random):
+            term_ids = np.unique(rng.integers(0, n_terms, size=rng.integers(2, 5)))
+            weights = index.idf[term_ids]
+            scores = index.score_terms(term_ids, weights)
+            for check_k in CHECK_KS:
+                expected = select_top_k(scores, check_k)
+                actual = index.top_k_terms(term_ids, weights, check_k)
+                if not same_results(expected, actual):
+                    mismatches.append((f"terms {term_ids.tolist()} k={check_k}", expected, actual))
+    finally:
+        bm25Index.PRUNING_MIN_POSTINGS = min_postings
+    return mismatches
+
+
+def measure(fn, queries, repeat):
+    """Latency (ms) của từng lần gọi fn(query)"""
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ retrieval BM25 theo kích thước corpus")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Các kích thước corpus, cách nhau bởi dấu phẩy")
+    parser.add_argument("--k", type=int, default=3, help="Số documents trả về")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lần lặp lại bộ query")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--random-checks", type=int, default=500, help="Số tổ hợp term ngẫu nhiên để so kết quả")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sentences = load_sentences()
+    queries = load_queries()
+    print(f"📚 {len(sentences)} câu nguồn, {len(queries)} queries, k={args.k}")
+    print(f"{'docs':>9} | {'build s':>8} | {'exhaustive p50/p95 ms':>22} | {'maxscore p50/p95 ms':>20} | {'speedup':>7}")
+    print("-" * 80)
+
+    for n_docs in [int(size) for size in args.sizes.split(",")]:
+        start = time.perf_counter()
+        index = BM25Index.build(synthetic_corpus(sentences, n_docs, rng))
+        build_seconds = time.perf_counter() - start
+
+        # Kết quả MaxScore phải giống chấm điểm toàn bộ
+        mismatches = check_pruning(index, queries, args.k, rng, args.random_checks)
+        if mismatches:
+            for description, expected, actual in mismatches[:5]:
+                print(f"❌ {description}: exhaustive {expected} vs maxscore {actual}")
+            raise AssertionError(f"{len(mismatches)} kết quả MaxScore khác chấm điểm toàn bộ ({n_docs} docs)")
+
+        exhaustive = measure(lambda q: exhaustive_top_k(index, q, args.k), queries, args.repeat)
+        pruned = measure(lambda q: index.top_k(q, args.k), queries, args.repeat)
+        print(
+            f"{n_docs:>9} | {build_seconds:>8.1f} | "
+            f"{np.median(exhaustive):>10.3f} / {np.percentile(exhaustive, 95):>9.3f} | "
+            f"{np.median(pruned):>8.3f} / {np.percentile(pruned, 95):>9.3f} | "
+            f"{np.median(exhaustive) / np.median(pruned):>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,20 @@
 # File: chatbot_rag_bm25.py (Phiên bản TẢI DỮ LIỆU SẴN)
 
 import os
-import pickle
+import sys
 from dotenv import load_dotenv
 
 # Import các thư viện
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.document_loaders import CSVLoader # Vẫn cần để import Document
-from langchain.retrievers import BM25Retriever
 from langchain.prompts import PromptTemplate
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval.nativeBM25Retriever import NativeBM25Retriever
+
 # --- Cấu hình ---
-DOCUMENTS_PICKLE_FILE = "bm25_documents.pkl"
+RETRIEVAL_INDEX_DIR = "retrieval_index"
 
 # --- 1. Tải API Key ---
 load_dotenv()
@@ -22,25 +23,18 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
     raise ValueError("Google API Key không được tìm thấy. Vui lòng thiết lập trong file .env.")
 
-# --- 2. TẢI Documents đã lưu trữ và Tạo BM25 Retriever ---
-if not os.path.exists(DOCUMENTS_PICKLE_FILE):
-    raise FileNotFoundError(f"Không tìm thấy file Documents tại '{DOCUMENTS_PICKLE_FILE}'. Vui lòng chạy prepare_bm25_data.py trước!")
-
-print(f"Đang tải Documents từ file '{DOCUMENTS_PICKLE_FILE}'...")
-
-# Tải danh sách Documents từ file pickle
-with open(DOCUMENTS_PICKLE_FILE, 'rb') as f:
-    documents = pickle.load(f)
+# --- 2. MỞ Index đã build sẵn và Tạo BM25 Retriever ---
+if not os.path.exists(RETRIEVAL_INDEX_DIR):
+    raise FileNotFoundError(f"Không tìm thấy index tại '{RETRIEVAL_INDEX_DIR}'. Vui lòng chạy prepare_data.py trước!")
 
-print(f"-> Đã tải {len(documents)} documents thành công.")
+print(f"Đang mở index từ thư mục '{RETRIEVAL_INDEX_DIR}'...")
 
-# Tạo BM25 Retriever ngay lập tức từ danh sách documents trong bộ nhớ
-print("Đang tạo BM25 retriever...")
-retriever = BM25Retriever.from_documents(
-    documents,
+# Index được mmap trực tiếp, không cần unpickle hay tính lại thống kê term
+retriever = NativeBM25Retriever.from_index_dir(
+    RETRIEVAL_INDEX_DIR,
     k=3 # Lấy top 3 kết quả liên quan nhất
 )
-print("BM25 retriever đã sẵn sàng.")
+print(f"-> BM25 retriever đã sẵn sàng với {retriever.index.n_docs} documents.")
 
 # --- 3. Khởi tạo mô hình Gemini Flash (giữ nguyên) ---
 llm = ChatGoogleGenerativeAI(
@@ -9,6 +9,7 @@ import json
 import time
 from datetime import datetime
 import os
+import sys
 
 # === CẤU HÌNH ===
 TEST_DATA_FILE = "hanoi_testdata.csv"
@@ -16,6 +17,12 @@ API_ENDPOINT = "http://localhost:8080/chat"  # Thay bằng URL production nếu
 RESULT_FILE = f"evaluation_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
 DELAY_BETWEEN_REQUESTS = 1  # giây (để tránh rate limit)
 
+# Chế độ chỉ đánh giá retrieval (không gọi LLM, không tốn quota Gemini)
+RETRIEVE_BATCH_ENDPOINT = API_ENDPOINT.replace('/chat', '/retrieve/batch')
+RETRIEVAL_RESULT_FILE = f"retrieval_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_BATCH_SIZE = 256
+
 # Session ID để tách biệt test với chat thật
 TEST_SESSION_ID = "evaluation_test_session"
 
@@ -206,7 +213,74 @@ def run_evaluation():
     
     print("="*80)
 
+def run_retrieval_evaluation():
+    """Chỉ chạy retrieval cho toàn bộ test cases qua /retrieve/batch và lưu top documents"""
+    print("="*80)
+    print("  ĐÁNH GIÁ RETRIEVAL (KHÔNG GỌI LLM)")
+    print("="*80)
+    print(f"API Endpoint: {RETRIEVE_BATCH_ENDPOINT}")
+    print(f"Top-k: {RETRIEVAL_TOP_K}")
+    print("="*80)
+
+    test_cases = load_test_data(TEST_DATA_FILE)
+    if not test_cases:
+        print("❌ Không có test cases để chạy!")
+        return
+
+    rows = []
+    server_latency_ms = 0.0
+    start_time = time.perf_counter()
+    for start in range(0, len(test_cases), RETRIEVAL_BATCH_SIZE):
+        batch = test_cases[start:start + RETRIEVAL_BATCH_SIZE]
+        try:
+            response = requests.post(
+                RETRIEVE_BATCH_ENDPOINT,
+                json={"queries": [case['question'] for case in batch], "k": RETRIEVAL_TOP_K},
+                timeout=30
+            )
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            print(f"❌ Lỗi khi gọi {RETRIEVE_BATCH_ENDPOINT}: {e}")
+            return
+
+        server_latency_ms += data.get('latency_ms', 0)
+        for case, result in zip(batch, data['results']):
+            documents = result['documents']
+            rows.append({
+                'ID': case['id'],
+                'Question': case['question'],
+                'Ideal_Answer': case['ideal_answer'],
+                'Top_Doc_IDs': " ".join(str(doc['doc_id']) for doc in documents),
+                'Top_Scores': " ".join(str(doc['score']) for doc in documents),
+                'Top_Content': documents[0]['content'] if documents else '',
+                'Result': ''
+            })
+    total_time = time.perf_counter() - start_time
+
+    empty_count = sum(1 for row in rows if not row['Top_Doc_IDs'])
+    print(f"Tổng số câu hỏi: {len(rows)}")
+    print(f"Không tìm thấy document: {empty_count}")
+    print(f"Thời gian retrieval (server): {server_latency_ms:.1f}ms "
+          f"({server_latency_ms / max(len(rows), 1):.3f}ms/query)")
+    print(f"Tổng thời gian (gồm HTTP): {total_time:.2f}s")
+
+    try:
+        with open(RETRIEVAL_RESULT_FILE, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\n✅ Đã lưu kết quả vào: {RETRIEVAL_RESULT_FILE}")
+    except Exception as e:
+        print(f"❌ Lỗi khi lưu file: {e}")
+    print("="*80)
+
 if __name__ == "__main__":
+    # python evaluate_chatbot.py --retrieval-only: chỉ đánh giá retrieval
+    if "--retrieval-only" in sys.argv:
+        run_retrieval_evaluation()
+        sys.exit(0)
+
     # Clear history trước khi test (tránh ảnh hưởng từ chat cũ)
     try:
         print("\n🗑️ Xóa lịch sử chat test session...")
@@ -1,66 +1,288 @@
 """
 Firebase Data Cache
-Caching layer để giảm số lần query Firebase
+Caching layer để giảm số lần query Firebase: 1 cache dữ liệu cá nhân (list text) cho mọi nơi dùng
+(get_user_data_cached trong main.py, get_user_data_from_firebase, /cache/stats, /cache/clear).
+
+- Giới hạn theo bộ nhớ ước lượng (LRU, USER_CACHE_MAX_MB) chứ không theo số user: instance chỉ có 512 MB,
+  1 user nhiều kế hoạch chiếm nhiều hơn user không có người yêu. Entry lớn hơn MAX_ENTRY_BYTES chỉ giữ
+  các documents đầu vừa giới hạn (thông tin user, người yêu, các kế hoạch đầu), log 1 lần mỗi user
+- TTL có jitter ±10%: các user nạp cùng lúc (sau deploy) không hết hạn cùng lúc
+- Stale-while-revalidate: hết hạn chưa quá USER_CACHE_STALE giây → trả bản cũ ngay, thread nền nạp lại
+- Nhiều request cùng miss 1 user → 1 lần query, các request còn lại chờ kết quả
+- invalidate() trong lúc đang nạp → kết quả nạp đó không ghi vào cache (không hồi sinh dữ liệu cũ)
+- Không log mỗi lần hit/miss, xem counters trong get_stats(); log qua logging (invalidate/clear ở DEBUG)
 """
+import logging
+import os
+import random
+import sys
 import time
-from typing import Dict, List, Optional
-from threading import Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Callable, Dict, List, Optional, Set
+
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "240"))  # giây
+USER_CACHE_STALE = int(os.getenv("USER_CACHE_STALE", "120"))  # giây sau khi hết hạn vẫn được trả bản cũ
+USER_CACHE_MAX_MB = float(os.getenv("USER_CACHE_MAX_MB", "32"))
+TTL_JITTER = 0.1
+MAX_ENTRY_BYTES = 256 * 1024
+# Thời gian request chờ 1 lần nạp đang chạy của user đó (giây)
+LOAD_WAIT_TIMEOUT = 30.0
+# OrderedDict node + _Entry + key
+_ENTRY_OVERHEAD = 200
+# Con trỏ của mỗi phần tử trong list
+_ITEM_POINTER_BYTES = 8
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(data: List[str]) -> int:
+    """Số byte ước lượng của 1 entry trong bộ nhớ"""
+    return sys.getsizeof(data) + sum(sys.getsizeof(doc) for doc in data) + _ENTRY_OVERHEAD
+
+
+class _Entry:
+    __slots__ = ("data", "size", "cached_at", "expires_at")
+
+    def __init__(self, data: List[str], size: int, cached_at: float, expires_at: float):
+        self.data = data
+        self.size = size
+        self.cached_at = cached_at
+        self.expires_at = expires_at
+
+
+class _Load:
+    """1 lần nạp đang chạy của 1 user, các request miss cùng lúc chờ kết quả"""
+
+    def __init__(self):
+        self.done = Event()
+        self.data: Optional[List[str]] = None
+        self.error: Optional[BaseException] = None
+
 
 class FirebaseDataCache:
-    """Simple in-memory cache with TTL"""
-    
-    def __init__(self, ttl_seconds: int = 300):  # 5 minutes default
-        self.cache: Dict[str, tuple[List[str], float]] = {}
+    """Cache LRU theo bộ nhớ + TTL (jitter) + stale-while-revalidate, thread-safe"""
+
+    def __init__(
+        self,
+        ttl_seconds: int = USER_CACHE_TTL,
+        max_bytes: int = int(USER_CACHE_MAX_MB * 1024 * 1024),
+        stale_seconds: int = USER_CACHE_STALE,
+        jitter: float = TTL_JITTER,
+        max_entry_bytes: int = MAX_ENTRY_BYTES,
+        refresh_workers: int = 2,
+    ):
         self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self.jitter = jitter
+        self.max_entry_bytes = max_entry_bytes
+        self.cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.total_bytes = 0
+        self.loading: Dict[str, _Load] = {}
+        self.refreshing: Set[str] = set()
+        self.oversized_users: Set[str] = set()
+        self.refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="user-cache-refresh")
         self.lock = Lock()
-    
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "evictions": 0,
+            "expired": 0,
+            "oversized": 0,
+        }
+
+    def _live_entry(self, user_id: str, now: float, stale_ok: bool) -> Optional[_Entry]:
+        """Entry còn hạn (hoặc còn trong cửa sổ stale nếu stale_ok); entry quá hạn bị xóa"""
+        entry = self.cache.get(user_id)
+        if entry is None:
+            return None
+        if now >= entry.expires_at + self.stale_seconds:
+            self._remove(user_id)
+            self.stats["expired"] += 1
+            return None
+        if now >= entry.expires_at and not stale_ok:
+            return None
+        self.cache.move_to_end(user_id)
+        return entry
+
+    def _remove(self, user_id: str) -> Optional[_Entry]:
+        entry = self.cache.pop(user_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+        return entry
+
+    def _truncate(self, user_id: str, data: List[str], size: int) -> List[str]:
+        """Các documents đầu của data vừa max_entry_bytes ([] nếu document đầu tiên đã quá lớn)"""
+        used, count = estimate_size([]), 0
+        for doc in data:
+            used += sys.getsizeof(doc) + _ITEM_POINTER_BYTES
+            if used > self.max_entry_bytes:
+                break
+            count += 1
+        self.stats["oversized"] += 1
+        if user_id not in self.oversized_users:
+            self.oversized_users.add(user_id)
+            logger.warning(
+                "Dữ liệu user %s ~%d bytes > %d, chỉ cache %d/%d documents đầu",
+                user_id, size, self.max_entry_bytes, count, len(data),
+            )
+        return data[:count]
+
+    def _store(self, user_id: str, data: List[str]) -> List[str]:
+        """Cache data (rút gọn nếu quá max_entry_bytes), trả về bản đã cache"""
+        self._remove(user_id)
+        size = estimate_size(data)
+        if size > self.max_entry_bytes:
+            data = self._truncate(user_id, data, size)
+            if not data:
+                return data
+            size = estimate_size(data)
+        now = time.time()
+        ttl = self.ttl_seconds * (1 + random.uniform(-self.jitter, self.jitter))
+        self.cache[user_id] = _Entry(data, size, now, now + ttl)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and self.cache:
+            oldest_id = next(iter(self.cache))
+            self._remove(oldest_id)
+            self.stats["evictions"] += 1
+        return data
+
     def get(self, user_id: str) -> Optional[List[str]]:
         """Get cached data if still valid"""
         with self.lock:
-            if user_id in self.cache:
-                data, timestamp = self.cache[user_id]
-                
-                # Check if cache is still valid
-                if time.time() - timestamp < self.ttl_seconds:
-                    print(f"✅ Cache HIT for user {user_id}")
-                    return data
-                else:
-                    # Cache expired
-                    print(f"⏰ Cache EXPIRED for user {user_id}")
-                    del self.cache[user_id]
-            
-            print(f"❌ Cache MISS for user {user_id}")
-            return None
-    
+            entry = self._live_entry(user_id, time.time(), stale_ok=False)
+            self.stats["hits" if entry else "misses"] += 1
+            return entry.data if entry else None
+
     def set(self, user_id: str, data: List[str]):
         """Store data in cache"""
         with self.lock:
-            self.cache[user_id] = (data, time.time())
-            print(f"💾 Cached data for user {user_id}")
-    
-    def invalidate(self, user_id: str):
-        """Invalidate cache for specific user"""
+            self.loading.pop(user_id, None)
+            self._store(user_id, data)
+
+    def get_or_load(self, user_id: str, loader: Callable[[str], List[str]]) -> List[str]:
+        """
+        Dữ liệu của user: còn hạn → trả ngay; hết hạn trong cửa sổ stale → trả bản cũ + nạp lại ở
+        background; không có → gọi loader(user_id) (1 lần cho mọi request đồng thời) rồi cache
+        """
+        with self.lock:
+            now = time.time()
+            entry = self._live_entry(user_id, now, stale_ok=True)
+            if entry is not None:
+                if now < entry.expires_at:
+                    self.stats["hits"] += 1
+                else:
+                    self.stats["stale_hits"] += 1
+                    if user_id not in self.refreshing:
+                        self.refreshing.add(user_id)
+                        self.refresher.submit(self._refresh, user_id, entry, loader)
+                return entry.data
+
+            self.stats["misses"] += 1
+            load = self.loading.get(user_id)
+            leader = load is None
+            if leader:
+                load = self.loading[user_id] = _Load()
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            if not load.done.wait(LOAD_WAIT_TIMEOUT):
+                raise TimeoutError(f"Hết thời gian chờ nạp dữ liệu user {user_id}")
+            if load.error is not None:
+                raise load.error
+            return load.data
+
+        try:
+            load.data = loader(user_id)
+        except BaseException as e:
+            load.error = e
+            raise
+        finally:
+            with self.lock:
+                # invalidate() trong lúc nạp đã bỏ load này → không cache kết quả
+                if self.loading.get(user_id) is load:
+                    del self.loading[user_id]
+                    if load.error is None:
+                        # Request chờ và request sau (cache hit) thấy cùng 1 bản
+                        load.data = self._store(user_id, load.data) or load.data
+            load.done.set()
+        return load.data
+
+    def _refresh(self, user_id: str, entry: _Entry, loader: Callable[[str], List[str]]):
+        try:
+            data = loader(user_id)
+            with self.lock:
+                # Entry đã bị invalidate / thay thế trong lúc nạp → giữ nguyên
+                if self.cache.get(user_id) is entry:
+                    self._store(user_id, data)
+                    self.stats["refreshes"] += 1
+        except Exception as e:
+            logger.warning("Refresh cache user %s lỗi, giữ bản cũ: %s", user_id, e)
+            with self.lock:
+                self.stats["refresh_errors"] += 1
+        finally:
+            with self.lock:
+                self.refreshing.discard(user_id)
+
+    def invalidate(self, user_id: str) -> bool:
+        """Invalidate cache for specific user (True nếu có entry bị xóa)"""
         with self.lock:
-            if user_id in self.cache:
-                del self.cache[user_id]
-                print(f"🗑️ Cache invalidated for user {user_id}")
-    
-    def clear(self):
-        """Clear all cache"""
+            self.loading.pop(user_id, None)
+            removed = self._remove(user_id) is not None
+        if removed:
+            logger.debug("Cache invalidated for user %s", user_id)
+        return removed
+
+    def clear(self) -> int:
+        """Clear all cache, trả về số entry đã xóa"""
         with self.lock:
+            count = len(self.cache)
             self.cache.clear()
-            print("🗑️ All cache cleared")
-    
+            self.loading.clear()
+            self.oversized_users.clear()
+            self.total_bytes = 0
+        logger.debug("All cache cleared (%d users)", count)
+        return count
+
+    def entries_info(self) -> List[dict]:
+        """Các entry đang cache (user ít dùng gần đây nhất trước)"""
+        now = time.time()
+        with self.lock:
+            return [
+                {
+                    "user_id": user_id,
+                    "documents_count": len(entry.data),
+                    "size_bytes": entry.size,
+                    "age_seconds": int(now - entry.cached_at),
+                    "ttl_remaining": int(entry.expires_at - now),
+                }
+                for user_id, entry in self.cache.items()
+            ]
+
     def get_stats(self) -> dict:
         """Get cache statistics"""
         with self.lock:
+            lookups = self.stats["hits"] + self.stats["stale_hits"] + self.stats["misses"]
             return {
                 "total_cached_users": len(self.cache),
-                "ttl_seconds": self.ttl_seconds
+                "ttl_seconds": self.ttl_seconds,
+                "stale_seconds": self.stale_seconds,
+                "memory_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                **self.stats,
+                "hit_rate": round((self.stats["hits"] + self.stats["stale_hits"]) / lookups, 4) if lookups else 0.0,
+                "loading": len(self.loading),
             }
 
 # Global cache instance
-_firebase_cache = FirebaseDataCache(ttl_seconds=300)  # 5 minutes
+_firebase_cache = FirebaseDataCache()
 
 def get_cache() -> FirebaseDataCache:
     """Get global cache instance"""
@@ -0,0 +1,33 @@
+"""
+CSV Row Document
+Chuyển 1 dòng CSV thành Document giống định dạng CSVLoader, giữ thêm từng cột thành field
+(metadata["fields"]) cho BM25F + facet (retrieval/facets.py)
+"""
+
+from typing import Dict
+
+from langchain.schema import Document
+
+
+def row_to_document(row: Dict[str, str], source: str, row_index: int) -> Document:
+    """
+    Tạo Document từ 1 dòng CSV, cùng định dạng với CSVLoader trong prepare_data.py
+
+    Args:
+        row: Dòng CSV (dict cột -> giá trị)
+        source: Đường dẫn file CSV
+        row_index: Số thứ tự dòng trong file (không tính header)
+
+    Returns:
+        Document với page_content dạng "cột: giá trị" mỗi dòng,
+        metadata gồm source, row và fields (cột -> giá trị)
+    """
+    content = "\n".join(
+        f"{key.strip()}: {value.strip() if value is not None else value}"
+        for key, value in row.items()
+    )
+    fields = {key.strip(): value.strip() for key, value in row.items() if key and value}
+    return Document(
+        page_content=content,
+        metadata={"source": source, "row": row_index, "fields": fields},
+    )
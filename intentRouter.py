@@ -0,0 +1,312 @@
+"""
+Intent Router
+Trả lời tại chỗ (không gọi Gemini) các câu chào hỏi, cảm ơn, tạm biệt, hỏi bot làm được gì,
+hỏi giờ/ngày và câu hỏi ngoài phạm vi (toán, khoa học, thể thao...). Mỗi câu như vậy trước đây
+tốn 1 lần gọi LLM trong quota 12 RPM/key.
+
+- Automaton từ khóa (keywordMatcher.py) gắn nhóm cho câu hỏi: làm feature cho model + chặn an toàn
+  (câu có từ khóa du lịch/quà tặng/cá nhân luôn đi qua LLM)
+- Model tuyến tính nhỏ (softmax regression trên feature hash âm tiết + nhóm từ khóa) train offline
+  bằng train_intent_router.py từ intent_data.csv + hanoi_testdata.csv → intent_model.npz
+- Xác suất intent cao nhất < ngưỡng tin cậy → trả về None, request đi qua chain như bình thường
+- Chào / cảm ơn / tạm biệt chỉ trả lời tại chỗ khi cả câu là xã giao: "cảm ơn, thế còn Vũng Tàu?"
+  còn âm tiết nội dung → đi qua LLM
+"""
+import zlib
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from keywordMatcher import KeywordMatcher
+from retrieval.vietnameseTokenizer import fold_diacritics, normalize_text, split_syllables
+
+MODEL_FILE = "intent_model.npz"
+FEATURE_DIM = 2048
+DEFAULT_CONFIDENCE = 0.8
+# Intent đi qua retrieval + LLM
+RAG_INTENT = "rag"
+INTENTS = (RAG_INTENT, "greeting", "thanks", "goodbye", "help", "time", "out_of_scope")
+
+# Từ khóa theo nhóm (ưu tiên cụm nhiều âm tiết: câu gõ không dấu được khớp sau khi bỏ dấu,
+# âm tiết đơn bỏ dấu dễ trùng nghĩa khác, vd "quà" -> "qua")
+INTENT_KEYWORDS = {
+    "greeting": ["xin chào", "chào bạn", "chào", "hello", "hi", "alo", "hey", "hế lô", "khỏe không"],
+    "thanks": ["cảm ơn", "cám ơn", "thanks", "thank you", "tks", "ok", "oke"],
+    "goodbye": ["tạm biệt", "bye", "hẹn gặp lại", "good bye", "ngủ ngon", "off đây"],
+    # "làm gì" chỉ tính khi hỏi về bot: "cuối tuần nên làm gì?" là câu hỏi du lịch
+    "help": ["là ai", "giúp gì", "bạn làm được gì", "bạn làm gì", "bạn có thể làm gì", "bot làm gì",
+             "bot làm được gì", "bot có thể làm gì", "dùng để làm gì", "hỗ trợ gì", "hỗ trợ những gì",
+             "giới thiệu về bạn", "tên là gì", "hướng dẫn sử dụng", "biết những gì", "hỏi bạn những gì",
+             "cách hoạt động"],
+    "time": ["mấy giờ", "giờ hiện tại", "thời gian hiện tại", "ngày bao nhiêu", "ngày mấy", "thứ mấy",
+             "tháng mấy", "năm bao nhiêu"],
+}
+# Từ khóa chủ đề ngoài phạm vi → điền vào câu từ chối
+OUT_OF_SCOPE_TOPICS = {
+    "toán học": ["phương trình", "đạo hàm", "tích phân", "giải toán", "bài toán", "căn bậc", "định lý",
+                 "ma trận", "lượng giác"],
+    "khoa học": ["vật lý", "hóa học", "sinh học", "nguyên tử", "phân tử", "quang hợp", "lực hấp dẫn",
+                 "tốc độ ánh sáng", "thuyết tương đối", "định luật", "dna"],
+    "thể thao": ["bóng đá", "bóng rổ", "world cup", "cầu thủ", "tỷ số", "ngoại hạng", "vô địch",
+                 "thi đấu", "đội tuyển", "messi", "ronaldo"],
+    "công nghệ": ["lập trình", "python", "javascript", "machine learning", "deep learning", "trí tuệ nhân tạo",
+                  "chatgpt", "api", "firebase", "rag", "chatbot", "code", "phần mềm", "máy tính",
+                  "hỗ trợ kỹ thuật", "retrieval", "windows", "lỗi"],
+    "lịch sử thế giới": ["chiến tranh thế giới", "napoleon", "la mã", "cách mạng pháp", "nước mỹ", "lịch sử của ai"],
+    "nấu ăn": ["cách nấu", "công thức nấu", "công thức làm", "cách luộc", "cách chiên", "cách rán"],
+    "tài chính": ["bitcoin", "cổ phiếu", "chứng khoán", "giá vàng", "lãi suất"],
+    "sức khỏe": ["uống thuốc", "triệu chứng", "bệnh"],
+    "chính trị": ["bầu cử", "tổng thống"],
+}
+# Du lịch / quà tặng / thông tin cá nhân: có các từ này thì không bao giờ trả lời tại chỗ
+IN_SCOPE_KEYWORDS = [
+    "du lịch", "đi đâu", "đi chơi", "chơi gì", "có gì", "ăn gì", "ăn ở đâu", "món quà", "quà tặng", "quà cho",
+    "quà sinh nhật", "quà lưu niệm", "tặng quà", "tặng gì", "nên tặng", "mua quà", "địa điểm", "tham quan", "khách sạn", "nhà hàng", "quán", "món ăn",
+    "đặc sản", "ẩm thực", "lịch trình", "giá vé", "mở cửa", "đóng cửa", "phố cổ", "phố đi bộ", "hồ gươm",
+    "hồ tây", "hoàn kiếm", "văn miếu", "lăng bác", "chùa", "đền", "bảo tàng", "người yêu", "bạn trai",
+    "bạn gái", "hẹn hò", "kế hoạch", "sinh nhật", "kỷ niệm", "yêu nhau", "valentine", "tặng hoa", "mua hoa",
+    "bó hoa", "tiền vé", "vé vào", "lớp học nấu ăn", "đi biển", "leo núi", "homestay", "resort",
+]
+# 63 tỉnh/thành (tên cũ vẫn được dùng hằng ngày, gồm cả tên sau sáp nhập) + tên gọi tắt
+VIETNAM_PROVINCES = [
+    "an giang", "bà rịa", "vũng tàu", "bắc giang", "bắc kạn", "bạc liêu", "bắc ninh", "bến tre", "bình định",
+    "bình dương", "bình phước", "bình thuận", "cà mau", "cần thơ", "cao bằng", "đà nẵng", "đắk lắk", "đắk nông",
+    "điện biên", "đồng nai", "đồng tháp", "gia lai", "hà giang", "hà nam", "hà nội", "hà tĩnh", "hải dương",
+    "hải phòng", "hậu giang", "hòa bình", "hưng yên", "khánh hòa", "kiên giang", "kon tum", "lai châu",
+    "lâm đồng", "lạng sơn", "lào cai", "long an", "nam định", "nghệ an", "ninh bình", "ninh thuận", "phú thọ",
+    "phú yên", "quảng bình", "quảng nam", "quảng ngãi", "quảng ninh", "quảng trị", "sóc trăng", "sơn la",
+    "tây ninh", "thái bình", "thái nguyên", "thanh hóa", "thừa thiên huế", "huế", "tiền giang", "trà vinh",
+    "tuyên quang", "vĩnh long", "vĩnh phúc", "yên bái", "hồ chí minh", "sài gòn", "tp hcm", "hcm",
+]
+# Điểm du lịch không trùng tên tỉnh (dulieu.csv + các điểm hay được hỏi)
+DESTINATIONS = [
+    "hạ long", "hội an", "đà lạt", "sa pa", "sapa", "phú quốc", "nha trang", "mộc châu", "mai châu", "tam đảo",
+    "cát bà", "côn đảo", "mũi né", "phan thiết", "quy nhơn", "phong nha", "kẻ bàng", "tràng an", "tam cốc",
+    "bái đính", "bà nà", "vinpearl", "fansipan", "mù cang chải", "pù luông", "lý sơn", "cô tô", "đồng văn",
+    "yên tử", "cù lao chàm", "miền tây", "tây bắc", "tây nguyên", "buôn ma thuột", "pleiku", "châu đốc",
+    "hà tiên", "mỹ tho", "cửa lò", "sầm sơn", "đồ sơn", "ba vì", "tam chúc", "hồ núi cốc",
+]
+# Âm tiết xã giao đi kèm lời chào/cảm ơn/tạm biệt, không phải nội dung câu hỏi
+SMALL_TALK_INTENTS = ("greeting", "thanks", "goodbye")
+SMALL_TALK_FILLERS = {
+    "bạn", "nhé", "nha", "nhá", "ạ", "à", "ơi", "nhiều", "rất", "lắm", "quá", "thật", "nhỉ", "vậy", "luôn",
+    "em", "anh", "chị", "mình", "tôi", "bot", "cả", "nhà", "mọi", "người", "đã", "giúp", "đỡ", "vui", "và",
+    "chúc", "một", "ngày", "tốt", "lành", "nhất", "hihi", "haha", "hehe", "nhiệt", "tình", "nè",
+    "buổi", "sáng", "trưa", "chiều", "tối", "dạo", "này", "thế", "nào", "hữu", "ích", "tuyệt", "vời", "hay",
+    "được", "rồi", "so", "much", "đi", "đây", "thôi", "sau",
+}
+_SMALL_TALK_FILLERS = SMALL_TALK_FILLERS | {fold_diacritics(word) for word in SMALL_TALK_FILLERS}
+
+_WEEKDAYS = ["Thứ Hai", "Thứ Ba", "Thứ Tư", "Thứ Năm", "Thứ Sáu", "Thứ Bảy", "Chủ Nhật"]
+
+ANSWERS = {
+    "greeting": "Xin chào! 👋 Tôi là trợ lý gợi ý du lịch và quà tặng. Bạn muốn tìm địa điểm đi chơi, "
+                "lịch trình du lịch hay ý tưởng quà tặng cho ai đó?",
+    "thanks": "Rất vui được giúp bạn! 😊 Nếu cần thêm gợi ý du lịch hay quà tặng, cứ hỏi tôi nhé.",
+    "goodbye": "Tạm biệt bạn! Chúc bạn có những chuyến đi và món quà thật ý nghĩa. 👋",
+    "help": "Tôi là trợ lý gợi ý du lịch và quà tặng. Tôi có thể giúp bạn:\n"
+            "- Gợi ý địa điểm tham quan, ăn uống, lịch trình du lịch (đặc biệt là Hà Nội)\n"
+            "- Gợi ý quà tặng cho người yêu, gia đình, bạn bè theo dịp và ngân sách\n"
+            "- Xem thông tin người yêu và kế hoạch của bạn (nếu đã có trong ứng dụng)\n"
+            "- Trả lời về thời gian hiện tại (hôm nay, ngày mai, mấy giờ)",
+    "out_of_scope": "Xin lỗi, tôi chỉ có thể hỗ trợ về gợi ý du lịch và quà tặng. "
+                    "Tôi không thể trả lời câu hỏi về {topic}.",
+}
+
+
+def has_diacritics(text: str) -> bool:
+    normalized = normalize_text(text)
+    return fold_diacritics(normalized) != normalized
+
+
+def _build_matcher(fold: bool) -> KeywordMatcher:
+    keywords = [(phrase, ("intent", intent)) for intent, phrases in INTENT_KEYWORDS.items() for phrase in phrases]
+    keywords += [(phrase, ("topic", topic)) for topic, phrases in OUT_OF_SCOPE_TOPICS.items() for phrase in phrases]
+    keywords += [(phrase, ("in_scope", None)) for phrase in IN_SCOPE_KEYWORDS + VIETNAM_PROVINCES + DESTINATIONS]
+    return KeywordMatcher(keywords, fold=fold)
+
+
+# Câu có dấu: khớp đúng dấu; câu gõ không dấu: khớp sau khi bỏ dấu cả từ khóa
+_MATCHERS = {False: _build_matcher(fold=False), True: _build_matcher(fold=True)}
+
+
+def keyword_groups(message: str) -> List[Tuple[str, Optional[str]]]:
+    """Các nhóm từ khóa khớp trong câu: ("intent", "greeting"), ("topic", "toán học"), ("in_scope", None)"""
+    return _MATCHERS[not has_diacritics(message)].values(message)
+
+
+def has_content_beyond_small_talk(message: str) -> bool:
+    """Còn âm tiết ngoài cụm chào/cảm ơn/tạm biệt và từ đệm ("cảm ơn, thế còn Vũng Tàu?" → True)"""
+    matcher = _MATCHERS[not has_diacritics(message)]
+    syllables = matcher.tokens(message)
+    covered = set()
+    for match in matcher.find_all(message):
+        if match.value[0] == "intent" and match.value[1] in SMALL_TALK_INTENTS:
+            covered.update(range(match.start, match.end))
+    return any(
+        i not in covered and syllable not in _SMALL_TALK_FILLERS for i, syllable in enumerate(syllables)
+    )
+
+
+def local_answer_blocker(message: str, intent: str, groups: Sequence[Tuple[str, Optional[str]]]) -> Optional[str]:
+    """Lý do không được trả lời tại chỗ dù model tự tin (tên counter trong stats), None nếu không có"""
+    if any(kind == "in_scope" for kind, _ in groups):
+        return "fallback_in_scope"
+    if intent in SMALL_TALK_INTENTS and has_content_beyond_small_talk(message):
+        return "fallback_content"
+    return None
+
+
+def _bucket(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % FEATURE_DIM
+
+
+def extract_features(message: str, groups: Optional[Sequence[Tuple[str, Optional[str]]]] = None) -> np.ndarray:
+    """Vector feature (FEATURE_DIM): âm tiết + bigram (đã bỏ dấu), nhóm từ khóa, độ dài câu"""
+    syllables = split_syllables(fold_diacritics(normalize_text(message)))
+    if groups is None:
+        groups = keyword_groups(message)
+    features = {f"w:{s}" for s in syllables}
+    features.update(f"b:{a}_{b}" for a, b in zip(syllables, syllables[1:]))
+    features.update(f"kw:{kind}:{value}" for kind, value in groups)
+    features.update(f"kwkind:{kind}" for kind, _ in groups)
+    if syllables:
+        features.add(f"first:{syllables[0]}")
+    length = len(syllables)
+    features.add(f"len:{'1' if length <= 1 else '2-3' if length <= 3 else '4-6' if length <= 6 else '7-10' if length <= 10 else '11+'}")
+    vector = np.zeros(FEATURE_DIM, dtype=np.float32)
+    for feature in features:
+        vector[_bucket(feature)] = 1.0
+    return vector / np.sqrt(max(len(features), 1))
+
+
+class IntentModel:
+    """Softmax regression: P(intent | câu) = softmax(W x + b)"""
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classes: Sequence[str]):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.classes = list(classes)
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        logits = features @ self.weights.T + self.bias
+        logits -= logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    @classmethod
+    def train(
+        cls,
+        features: np.ndarray,
+        labels: Sequence[str],
+        classes: Sequence[str] = INTENTS,
+        epochs: int = 1000,
+        learning_rate: float = 4.0,
+        l2: float = 1e-4,
+    ) -> "IntentModel":
+        """Gradient descent toàn batch, cân bằng trọng số theo tần suất từng intent"""
+        classes = list(classes)
+        y = np.array([classes.index(label) for label in labels])
+        onehot = np.eye(len(classes), dtype=np.float32)[y]
+        counts = np.bincount(y, minlength=len(classes)).astype(np.float32)
+        sample_weights = (len(y) / (len(classes) * np.maximum(counts, 1)))[y][:, None]
+        model = cls(np.zeros((len(classes), features.shape[1])), np.zeros(len(classes)), classes)
+        for _ in range(epochs):
+            gradient = (model.predict_proba(features) - onehot) * sample_weights / len(y)
+            model.weights -= learning_rate * (gradient.T @ features + l2 * model.weights)
+            model.bias -= learning_rate * gradient.sum(axis=0)
+        return model
+
+    def save(self, path: str):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, classes=np.array(self.classes),
+                            feature_dim=FEATURE_DIM)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentModel":
+        with np.load(path) as data:
+            if int(data["feature_dim"]) != FEATURE_DIM:
+                raise ValueError(f"{path}: feature_dim {int(data['feature_dim'])} khác FEATURE_DIM {FEATURE_DIM}, cần train lại")
+            return cls(data["weights"], data["bias"], [str(c) for c in data["classes"]])
+
+
+class IntentRouter:
+    """Phân loại câu hỏi, trả lời tại chỗ nếu đủ tin cậy và không thuộc phạm vi RAG"""
+
+    def __init__(self, model: IntentModel, confidence: float = DEFAULT_CONFIDENCE):
+        self.model = model
+        self.confidence = confidence
+        self.lock = Lock()
+        self.stats = {"routed": {intent: 0 for intent in model.classes if intent != RAG_INTENT},
+                      "fallback_low_confidence": 0, "fallback_in_scope": 0, "fallback_content": 0, "rag": 0}
+
+    @classmethod
+    def from_file(cls, path: str = MODEL_FILE, confidence: float = DEFAULT_CONFIDENCE) -> "IntentRouter":
+        return cls(IntentModel.load(path), confidence)
+
+    def classify(self, message: str) -> Tuple[str, float, List[Tuple[str, Optional[str]]]]:
+        """(intent, xác suất, các nhóm từ khóa khớp)"""
+        groups = keyword_groups(message)
+        probabilities = self.model.predict_proba(extract_features(message, groups))
+        best = int(np.argmax(probabilities))
+        return self.model.classes[best], float(probabilities[best]), groups
+
+    def route(self, message: str, current_time: Dict[str, str]) -> Optional[Dict]:
+        """
+        {"intent", "confidence", "answer"} nếu trả lời được tại chỗ; None → đi qua retrieval + LLM
+
+        Args:
+            current_time: get_current_time_info() (dùng vn_iso cho câu hỏi giờ/ngày)
+        """
+        intent, confidence, groups = self.classify(message)
+        if intent == RAG_INTENT:
+            outcome = "rag"
+        else:
+            outcome = local_answer_blocker(message, intent, groups)
+            if outcome is None and confidence < self.confidence:
+                outcome = "fallback_low_confidence"
+        with self.lock:
+            if outcome is None:
+                self.stats["routed"][intent] += 1
+            else:
+                self.stats[outcome] += 1
+        if outcome is not None:
+            return None
+
+        if intent == "time":
+            answer = time_answer(message, current_time)
+        elif intent == "out_of_scope":
+            topics = [value for kind, value in groups if kind == "topic"]
+            answer = ANSWERS["out_of_scope"].format(topic=topics[0] if topics else "chủ đề này")
+        else:
+            answer = ANSWERS[intent]
+        print(f"🧭 Intent router: {intent} ({confidence:.2f}) - trả lời không cần Gemini")
+        return {"intent": intent, "confidence": round(confidence, 4), "answer": answer}
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            routed = sum(self.stats["routed"].values())
+            total = routed + sum(
+                self.stats[name] for name in ("rag", "fallback_low_confidence", "fallback_in_scope", "fallback_content")
+            )
+            return {
+                **self.stats,
+                "routed": dict(self.stats["routed"]),
+                "llm_calls_avoided": routed,
+                "routed_rate": round(routed / total, 4) if total else 0.0,
+                "confidence_threshold": self.confidence,
+            }
+
+
+def time_answer(message: str, current_time: Dict[str, str]) -> str:
+    """Trả lời giờ/ngày theo giờ Việt Nam; 'ngày mai'/'hôm qua' tính lệch 1 ngày"""
+    now = datetime.fromisoformat(current_time["vn_iso"])
+    folded = f" {' '.join(split_syllables(fold_diacritics(normalize_text(message))))} "
+    if " ngay mai " in folded:
+        day = now + timedelta(days=1)
+        return f"Ngày mai là {_WEEKDAYS[day.weekday()]}, ngày {day:%d/%m/%Y}."
+    if " hom qua " in folded:
+        day = now - timedelta(days=1)
+        return f"Hôm qua là {_WEEKDAYS[day.weekday()]}, ngày {day:%d/%m/%Y}."
+    return f"Bây giờ là {now:%H:%M}, {_WEEKDAYS[now.weekday()]}, ngày {now:%d/%m/%Y} (giờ Việt Nam)."
@@ -0,0 +1,88 @@
+"""
+Keyword Matcher
+Automaton Aho-Corasick trên chuỗi âm tiết: tìm tất cả cụm từ khóa trong câu với 1 lần duyệt,
+thay cho vòng lặp `keyword in message` (chậm dần theo số từ khóa và khớp nhầm giữa chữ:
+"em" trong "xem", "ny" trong "nyc").
+
+- Chuẩn hóa giống retrieval (NFC, lowercase, tách âm tiết, bỏ dấu câu)
+- fold=True: bỏ dấu cả từ khóa lẫn câu (người dùng gõ không dấu vẫn khớp)
+- Mỗi cụm từ khóa gắn 1 giá trị (nhóm, trọng số...) trả về khi khớp
+"""
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from retrieval.vietnameseTokenizer import fold_diacritics, normalize_text, split_syllables
+
+
+class KeywordMatch(NamedTuple):
+    start: int   # vị trí âm tiết đầu
+    end: int     # vị trí sau âm tiết cuối
+    phrase: str
+    value: Any
+
+
+class KeywordMatcher:
+    """Aho-Corasick với mỗi cạnh là 1 âm tiết → chỉ khớp trọn âm tiết"""
+
+    def __init__(self, keywords: Iterable[Tuple[str, Any]], fold: bool = False):
+        self.fold = fold
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # Các (số âm tiết, cụm từ, value) kết thúc tại mỗi state (đã gộp theo fail link)
+        self.outputs: List[List[Tuple[int, str, Any]]] = [[]]
+        for phrase, value in keywords:
+            self._add(phrase, value)
+        self._build_failure_links()
+
+    def tokens(self, text: str) -> List[str]:
+        text = normalize_text(text)
+        if self.fold:
+            text = fold_diacritics(text)
+        return split_syllables(text)
+
+    def _add(self, phrase: str, value: Any):
+        syllables = self.tokens(phrase)
+        if not syllables:
+            return
+        state = 0
+        for syllable in syllables:
+            next_state = self.goto[state].get(syllable)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][syllable] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append((len(syllables), phrase, value))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for syllable, child in self.goto[state].items():
+                queue.append(child)
+                if state:
+                    fallback = self.fail[state]
+                    while fallback and syllable not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(syllable, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """Mọi lần khớp (kể cả chồng lên nhau), theo vị trí kết thúc"""
+        matches = []
+        state = 0
+        for position, syllable in enumerate(self.tokens(text)):
+            while state and syllable not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(syllable, 0)
+            for length, phrase, value in self.outputs[state]:
+                matches.append(KeywordMatch(position + 1 - length, position + 1, phrase, value))
+        return matches
+
+    def values(self, text: str) -> List[Any]:
+        return [match.value for match in self.find_all(text)]
+
+    def contains_any(self, text: str) -> bool:
+        return bool(self.find_all(text))
@@ -1,8 +1,11 @@
 # Backend Chatbot API cho Firebase Functions
 # Version: Firebase Functions compatible
 
+import atexit
+import hashlib
+import math
 import os
-import pickle
+import signal
 from typing import Dict, List
 from datetime import datetime
 import pytz
@@ -22,9 +25,8 @@ from flask_cors import CORS
 import json
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.retrievers import BM25Retriever
+import google.ai.generativelanguage as glm
 from langchain.prompts import PromptTemplate
-from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 
 # User personalization imports
@@ -35,6 +37,21 @@ from manageDataFirebase.updateCollectionExists import update_collection_exists
 from manageDataFirebase.deleteDataColletionExists import delete_data_collection_exists
 from manageDataFirebase.checkCollectionExists import check_collection_exists
 from firebaseCache import get_cache as get_firebase_cache
+from answerCache import AnswerCache, replay_chunks
+from singleFlight import SingleFlight, flight_key
+from sessionHistory import SessionHistoryCache, summarize_turns
+from intentRouter import DEFAULT_CONFIDENCE, MODEL_FILE as INTENT_MODEL_FILE, IntentRouter
+from personalMatcher import PERSONAL_THRESHOLD, PersonalMatcher
+from responseProfile import DEFAULT_PROFILE, RESPONSE_PROFILES, QuestionClassifier
+from apiKeyRotator import (
+    APIKeyRotator, QuotaAwareClient, RateLimitExceeded, captured_usage, is_quota_error, start_usage_capture,
+)
+from retrieval.contextCompressor import ContextCompressor
+from retrieval.contextPacker import ContextPacker, estimate_tokens
+from retrieval.hybrid import hybrid_top_k
+from retrieval.nativeBM25Retriever import NativeBM25Retriever
+from retrieval.segmentedIndex import SegmentedIndex, read_generation
+from storage.chatStorage import create_storage
 
 # Initialize Firebase Admin (only if not already initialized by firebaseClient)
 try:
@@ -49,150 +66,46 @@ except Exception as e:
     print(f"⚠️ Cảnh báo Firebase initialization: {e}")
 
 # --- Cấu hình ---
-DOCUMENTS_PICKLE_FILE = "bm25_documents.pkl"
+RETRIEVAL_INDEX_DIR = "retrieval_index"
 MAX_HISTORY_SIZE = 5
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "10000"))  # số session giữ trong bộ nhớ
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", "300"))  # giây, đọc lại storage sau TTL
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))  # giây giữa 2 lần ghi batch
+# "summary": giữ HISTORY_RECENT_TURNS lượt gần nhất nguyên văn, lượt cũ hơn gộp vào tóm tắt
+# "full": MAX_HISTORY_SIZE lượt nguyên văn như cũ
+HISTORY_MODE = os.getenv("HISTORY_MODE", "summary")
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "2"))
+# Gộp BM25 + dense retrieval (RRF); cần index build với dense (prepare_data.py)
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "0") == "1"
+# Ngân sách token cho context (ước lượng cục bộ) và số ứng viên retrieval đưa vào packer
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "6"))
+# Rút gọn document dài còn các câu liên quan tới query (chấm điểm bằng thống kê BM25 của index)
+COMPRESS_CONTEXT = os.getenv("COMPRESS_CONTEXT", "1") == "1"
+# Tăng PROMPT_VERSION mỗi khi sửa prompt_template / tham số LLM để bỏ các câu trả lời đã cache
+PROMPT_VERSION = "3"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))  # giây
+# Trả lời tại chỗ chào hỏi / hỏi giờ / câu hỏi ngoài phạm vi (intent_model.npz, train_intent_router.py)
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "1") == "1"
+INTENT_CONFIDENCE = float(os.getenv("INTENT_CONFIDENCE", str(DEFAULT_CONFIDENCE)))
+# max_output_tokens + hướng dẫn độ dài theo loại câu hỏi (responseProfile.py); tắt = 800 token cho mọi câu
+ADAPTIVE_OUTPUT = os.getenv("ADAPTIVE_OUTPUT", "1") == "1"
 
 # Khởi tạo Flask app
 app = Flask(__name__)
 CORS(app)
 
-# Firestore client (for production history storage)
-db = firestore.client()
+# Lịch sử + dữ liệu user: Firestore (production) hoặc SQLite / in-memory khi chạy local (storage/)
+storage = create_storage()
 
 # --- API Key Rotation System ---
 import threading
 import time
-from functools import lru_cache
-from datetime import timedelta
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-class APIKeyRotator:
-    """
-    Quản lý luân phiên nhiều API keys với rate limiting thông minh
-    
-    Rate Limits (Free tier Gemini 2.0 Flash Lite):
-    - 15 RPM (Requests Per Minute)
-    - 1,000,000 TPM (Tokens Per Minute)
-    - 1000 RPD (Requests Per Day)
-    """
-    
-    # Rate limit constants cho Free tier
-    RPM_LIMIT = 15  # requests per minute
-    SAFE_RPM = 12   # giới hạn an toàn (80% của limit)
-    
-    def __init__(self):
-        self.api_keys = self._load_api_keys()
-        self.current_index = 0
-        self.lock = threading.Lock()
-        
-        # Tracking cho mỗi key
-        self.key_usage_count = {key: 0 for key in self.api_keys}
-        self.key_last_used = {key: 0 for key in self.api_keys}
-        
-        # Rate limiting: track requests trong 1 phút gần nhất cho mỗi key
-        self.key_request_times = {key: deque(maxlen=100) for key in self.api_keys}
-        
-        if not self.api_keys:
-            raise ValueError("Không tìm thấy API keys. Vui lòng cấu hình GOOGLE_API_KEY_1, GOOGLE_API_KEY_2, GOOGLE_API_KEY_3")
-        
-        print(f"✅ API Key Rotator initialized với {len(self.api_keys)} keys")
-        print(f"   Rate limit: {self.SAFE_RPM} RPM per key (safe limit)")
-        print(f"   Total capacity: ~{self.SAFE_RPM * len(self.api_keys)} RPM")
-    
-    def _load_api_keys(self) -> List[str]:
-        """Load tất cả API keys từ environment variables"""
-        keys = []
-        
-        # Thử load từ GOOGLE_API_KEY_1, GOOGLE_API_KEY_2, GOOGLE_API_KEY_3
-        for i in range(1, 10):  # Hỗ trợ tối đa 9 keys
-            key = os.getenv(f"GOOGLE_API_KEY_{i}")
-            if key:
-                keys.append(key)
-        
-        # Fallback: nếu không có key nào, dùng GOOGLE_API_KEY (backward compatible)
-        if not keys:
-            default_key = os.getenv("GOOGLE_API_KEY")
-            if default_key:
-                keys.append(default_key)
-        
-        return keys
-    
-    def _get_rpm_for_key(self, key: str) -> int:
-        """Tính số requests trong 1 phút gần nhất cho key"""
-        current_time = time.time()
-        request_times = self.key_request_times[key]
-        
-        # Đếm số requests trong 60 giây gần nhất
-        recent_requests = sum(1 for t in request_times if current_time - t < 60)
-        return recent_requests
-    
-    def _find_available_key(self) -> str:
-        """Tìm key có thể dùng được (chưa vượt rate limit)"""
-        current_time = time.time()
-        
-        # Thử tất cả keys, bắt đầu từ current_index
-        for i in range(len(self.api_keys)):
-            idx = (self.current_index + i) % len(self.api_keys)
-            key = self.api_keys[idx]
-            
-            rpm = self._get_rpm_for_key(key)
-            
-            # Nếu key này chưa đạt safe limit, dùng nó
-            if rpm < self.SAFE_RPM:
-                self.current_index = (idx + 1) % len(self.api_keys)
-                return key
-        
-        # Nếu tất cả keys đều đạt limit, chọn key có RPM thấp nhất
-        min_key = min(self.api_keys, key=lambda k: self._get_rpm_for_key(k))
-        
-        # Cảnh báo nếu vượt limit
-        min_rpm = self._get_rpm_for_key(min_key)
-        if min_rpm >= self.SAFE_RPM:
-            print(f"⚠️ WARNING: Tất cả keys đang gần limit! Best key có {min_rpm} RPM")
-        
-        return min_key
-    
-    def get_next_key(self) -> str:
-        """Lấy API key tiếp theo với smart rate limiting"""
-        with self.lock:
-            if not self.api_keys:
-                raise ValueError("Không có API keys khả dụng")
-            
-            # Tìm key phù hợp
-            key = self._find_available_key()
-            
-            # Cập nhật thống kê
-            current_time = time.time()
-            self.key_usage_count[key] += 1
-            self.key_last_used[key] = current_time
-            self.key_request_times[key].append(current_time)
-            
-            return key
-    
-    def get_stats(self) -> Dict:
-        """Lấy thống kê sử dụng các API keys"""
-        with self.lock:
-            current_time = time.time()
-            
-            key_stats = []
-            for key in self.api_keys:
-                rpm = self._get_rpm_for_key(key)
-                usage_percent = (rpm / self.SAFE_RPM) * 100
-                
-                key_stats.append({
-                    "key_masked": f"{key[:10]}...{key[-4:]}",
-                    "total_requests": self.key_usage_count[key],
-                    "current_rpm": rpm,
-                    "rpm_limit": self.SAFE_RPM,
-                    "usage_percent": round(usage_percent, 1),
-                    "status": "🟢 OK" if rpm < self.SAFE_RPM * 0.8 else "🟡 BUSY" if rpm < self.SAFE_RPM else "🔴 LIMIT"
-                })
-            
-            return {
-                "total_keys": len(self.api_keys),
-                "total_capacity_rpm": self.SAFE_RPM * len(self.api_keys),
-                "keys": key_stats
-            }
+# Số lần thử (mỗi lần 1 key khác) khi Gemini trả lỗi quota
+MAX_LLM_ATTEMPTS = 3
 
 # Khởi tạo API Key Rotator global
 api_key_rotator = APIKeyRotator()
@@ -202,6 +115,101 @@ def get_google_api_key():
     """Lấy Google API Key với rotation system"""
     return api_key_rotator.get_next_key()
 
+class LLMClientPool:
+    """
+    Pool LLM clients: mỗi API key 1 ChatGoogleGenerativeAI + document chain dựng sẵn lúc khởi động
+    (giữ kết nối gRPC riêng của key đó). Mỗi lần invoke/stream xin key qua api_key_rotator
+    (token bucket RPM/TPM/RPD, chờ trong hàng đợi nếu mọi key hết lượt); lỗi quota → key nghỉ,
+    thử lại trên key khác.
+    Mỗi key có 1 chain cho mỗi ResponseProfile: LLM với max_output_tokens riêng, dùng chung
+    client gRPC của key (không tạo kết nối mới). Không dùng llm.copy(update=...): bản copy
+    của pydantic bỏ mất các field exclude như callbacks.
+    """
+
+    def __init__(self, rotator: APIKeyRotator, build_llm, prompt, profiles=RESPONSE_PROFILES):
+        self.rotator = rotator
+        self.prompt_tokens = estimate_tokens(prompt.template)
+        self.llms = {key: build_llm(key) for key in rotator.api_keys}
+        self.chains = {
+            key: {
+                name: create_stuff_documents_chain(
+                    build_llm(key, profile.max_output_tokens, client=llm.client), prompt
+                )
+                for name, profile in profiles.items()
+            }
+            for key, llm in self.llms.items()
+        }
+        print(f"✅ LLM client pool: {len(self.chains)} clients x {len(profiles)} response profiles")
+
+    def estimate_input_tokens(self, inputs: Dict) -> int:
+        """Ước lượng token của prompt (template + lịch sử + câu hỏi + context) cho bucket TPM"""
+        tokens = self.prompt_tokens
+        for name, value in inputs.items():
+            if name == "context":
+                tokens += sum(estimate_tokens(doc.page_content) for doc in value)
+            elif isinstance(value, str):
+                tokens += estimate_tokens(value)
+        return tokens
+
+    def acquire(self, estimated_tokens: int, profile: str = DEFAULT_PROFILE):
+        """(key, document chain) cho 1 lần gọi LLM; RateLimitExceeded nếu không có key kịp deadline"""
+        key = self.rotator.acquire(estimated_tokens)
+        start_usage_capture()
+        return key, self.chains[key][profile]
+
+    def report_success(self, key: str, estimated_tokens: int, answer: str):
+        """Số token Gemini trả về; phần không có (SDK đang pin không có prompt tokens) dùng số ước lượng"""
+        prompt_tokens, output_tokens = captured_usage() or (None, None)
+        self.rotator.report_success(
+            key,
+            estimated_tokens,
+            estimated_tokens if prompt_tokens is None else prompt_tokens,
+            estimate_tokens(answer) if output_tokens is None else output_tokens,
+            prompt_reported=prompt_tokens is not None,
+            output_reported=output_tokens is not None,
+        )
+
+    def invoke(self, inputs: Dict, profile: str = DEFAULT_PROFILE) -> str:
+        estimated_tokens = self.estimate_input_tokens(inputs)
+        for attempt in range(1, MAX_LLM_ATTEMPTS + 1):
+            key, chain = self.acquire(estimated_tokens, profile)
+            try:
+                answer = chain.invoke(inputs)
+            except Exception as e:
+                self.rotator.report_failure(key, e)
+                if is_quota_error(e) and attempt < MAX_LLM_ATTEMPTS:
+                    print(f"⚠️ Quota error, thử lại với key khác ({attempt}/{MAX_LLM_ATTEMPTS})")
+                    continue
+                raise
+            except BaseException:
+                self.rotator.report_aborted(key)
+                raise
+            self.report_success(key, estimated_tokens, answer)
+            return answer
+
+    def stream(self, inputs: Dict, profile: str = DEFAULT_PROFILE):
+        estimated_tokens = self.estimate_input_tokens(inputs)
+        for attempt in range(1, MAX_LLM_ATTEMPTS + 1):
+            key, chain = self.acquire(estimated_tokens, profile)
+            answer = ""
+            try:
+                for chunk in chain.stream(inputs):
+                    answer += chunk
+                    yield chunk
+            except Exception as e:
+                self.rotator.report_failure(key, e)
+                # Đã gửi token cho client thì không thử lại (tránh lặp nội dung)
+                if is_quota_error(e) and not answer and attempt < MAX_LLM_ATTEMPTS:
+                    print(f"⚠️ Quota error, thử lại với key khác ({attempt}/{MAX_LLM_ATTEMPTS})")
+                    continue
+                raise
+            except BaseException:
+                # GeneratorExit: client ngắt stream → không phải lỗi của key, chỉ trả lại lượt thử half_open
+                self.rotator.report_aborted(key)
+                raise
+            self.report_success(key, estimated_tokens, answer)
+            return
+
 
 def get_current_time_info() -> Dict[str, str]:
     """Return current time information in UTC and Vietnam timezone.
@@ -224,32 +232,52 @@ def get_current_time_info() -> Dict[str, str]:
     }
 
 # --- Khởi tạo Chatbot ---
-def initialize_chatbot():
-    """Khởi tạo BM25 Retriever và LLM"""
-    if not os.path.exists(DOCUMENTS_PICKLE_FILE):
-        raise FileNotFoundError(f"Không tìm thấy file {DOCUMENTS_PICKLE_FILE}")
-    
-    print(f"Loading documents from {DOCUMENTS_PICKLE_FILE}...")
-    with open(DOCUMENTS_PICKLE_FILE, 'rb') as f:
-        documents = pickle.load(f)
-    print(f"Loaded {len(documents)} documents")
-    
-    # BM25 Retriever - Giảm k từ 3 xuống 1 để tăng tốc độ đáng kể
-    retriever = BM25Retriever.from_documents(documents, k=1)
+def load_retriever() -> NativeBM25Retriever:
+    """Mở retrieval index hiện tại trên đĩa"""
+    if not os.path.exists(RETRIEVAL_INDEX_DIR):
+        raise FileNotFoundError(f"Không tìm thấy index {RETRIEVAL_INDEX_DIR}. Chạy prepare_data.py trước!")
     
+    # BM25 Retriever - lấy RETRIEVAL_CANDIDATES ứng viên rồi ghép context theo ngân sách token
+    # (thay cho k=1 cố định: prompt vẫn nhỏ và ổn định, câu hỏi cần nhiều dòng dữ liệu không bị thiếu)
+    # Index build sẵn lúc build image, chỉ cần mmap (không unpickle, không re-index)
+    print(f"Loading index from {RETRIEVAL_INDEX_DIR}...")
+    index = SegmentedIndex.open(RETRIEVAL_INDEX_DIR)
+    compressor = ContextCompressor(index) if COMPRESS_CONTEXT else None
+    retriever = NativeBM25Retriever(
+        index=index,
+        k=RETRIEVAL_CANDIDATES,
+        hybrid=HYBRID_RETRIEVAL,
+        packer=ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET, compressor=compressor),
+    )
+    print(f"Loaded {retriever.index.n_docs} documents (index generation {retriever.index.generation})")
+    if HYBRID_RETRIEVAL and not retriever.index.has_dense:
+        print("⚠️ HYBRID_RETRIEVAL bật nhưng index không có dense vectors, chỉ dùng BM25")
+    return retriever
+
+def build_llm(api_key: str, max_output_tokens: int = 800, client=None) -> ChatGoogleGenerativeAI:
+    """Gemini LLM dùng riêng 1 API key (client: dùng chung client đã tạo của cùng key)"""
     # Gemini LLM - Tối ưu cho streaming
-    api_key = get_google_api_key()
     llm = ChatGoogleGenerativeAI(
         model="gemini-flash-lite-latest",  # Model nhanh nhất
         google_api_key=api_key,
         temperature=0.4,  # Tăng một chút để generate nhanh hơn
         convert_system_message_to_human=True,
         streaming=True,  # Enable streaming by default
-        max_output_tokens=800,  # Giảm xuống 400 để nhanh hơn
+        max_output_tokens=max_output_tokens,  # Theo ResponseProfile của câu hỏi
         top_p=0.95,  # Thêm top_p để ổn định
         top_k=40  # Giới hạn sampling space
     )
-    
+    # genai.configure() là global (key của client tạo sau cùng được dùng cho mọi client)
+    # → gắn client gRPC riêng với đúng key này. Lỗi 429 đổi thành QuotaExceededError để
+    # langchain không retry (backoff tới 60s) trên chính key đang hết quota
+    if client is not None:
+        llm.client = client
+        return llm
+    llm.client._client = QuotaAwareClient(glm.GenerativeServiceClient(client_options={"api_key": api_key}))
+    return llm
+
+def build_document_chain() -> LLMClientPool:
+    """Khởi tạo LLM pool + prompt (không phụ thuộc retrieval index, giữ nguyên khi reload)"""
     # Prompt với lịch sử
     # NOTE: We add a strict instruction to avoid producing tables (especially Markdown tables)
     # This is important for clients or integrations that cannot render tables.
@@ -261,12 +289,8 @@ THỜI GIAN HIỆN TẠI (QUAN TRỌNG - SỬ DỤNG ĐỂ TÍNH TOÁN):
 - Hãy sử dụng thông tin này để xác định "hôm nay", "ngày mai", "hôm qua" khi người dùng hỏi về kế hoạch hoặc thời gian.
 - Ví dụ: Nếu hôm nay là 2025-11-02, thì "ngày mai" là 2025-11-03, "hôm qua" là 2025-11-01.
 
-PHẠM VI TRÁCH NHIỆM (QUAN TRỌNG):
-- Bạn CHỈ được trả lời các câu hỏi về: du lịch Việt Nam, địa điểm tham quan, gợi ý quà tặng, lịch trình du lịch, thông tin người yêu/kế hoạch cá nhân (nếu có).
-- Bạn CÓ THỂ trả lời về thời gian hiện tại (hôm nay, ngày mai, giờ) khi người dùng hỏi.
-- Nếu câu hỏi KHÔNG thuộc các chủ đề trên (ví dụ: toán học, lịch sử thế giới, khoa học, công nghệ, nấu ăn, thể thao, v.v.), hãy TỪ CHỐI lịch sự bằng câu:
-  
-  "Xin lỗi, tôi chỉ có thể hỗ trợ về gợi ý du lịch và quà tặng. Tôi không thể trả lời câu hỏi về [chủ đề]."
+PHẠM VI: CHỈ trả lời về du lịch Việt Nam, quà tặng, thông tin người yêu/kế hoạch cá nhân (nếu có) và thời gian hiện tại.
+Câu hỏi ngoài phạm vi: "Xin lỗi, tôi chỉ có thể hỗ trợ về gợi ý du lịch và quà tặng. Tôi không thể trả lời câu hỏi về [chủ đề]."
 
 LƯU Ý QUAN TRỌNG: 
 1. KHÔNG ĐƯỢC TẠO BẢNG trong câu trả lời. KHÔNG SỬ DỤNG BẢNG Markdown hay các định dạng bảng nào.
@@ -292,128 +316,184 @@ CÂU HỎI: {input}
 HƯỚNG DẪN TRẢ LỜI:
 - Nếu câu hỏi về du lịch/quà tặng/thời gian: Trả lời chi tiết, thân thiện bằng tiếng Việt.
 - Nếu câu hỏi về kế hoạch theo thời gian: Sử dụng THỜI GIAN HIỆN TẠI để tính toán chính xác.
-- Nếu câu hỏi NGOÀI phạm vi (toán học, khoa học, v.v.): TỪ CHỐI lịch sự như hướng dẫn phía trên.
 - Nhớ: ĐỪNG tự động đề cập thông tin cá nhân nếu người dùng không hỏi về nó.
+- Độ dài: {answer_style}
 
 CÂU TRẢ LỜI:
 """
     
     prompt = PromptTemplate.from_template(prompt_template)
-    document_chain = create_stuff_documents_chain(llm, prompt)
-    retrieval_chain = create_retrieval_chain(retriever, document_chain)
-    
-    return retrieval_chain
+    return LLMClientPool(api_key_rotator, build_llm, prompt)
 
-# Global retrieval chain (lazy initialization)
-retrieval_chain = None
+class ChatbotGeneration:
+    """
+    Một phiên bản của retriever + document chain.
+    Request lấy tham chiếu tới generation lúc bắt đầu và dùng nó đến khi xong,
+    nên reload index không ảnh hưởng request/stream đang chạy.
+    """
+    
+    def __init__(self, retriever: NativeBM25Retriever, document_chain: LLMClientPool):
+        self.retriever = retriever
+        self.document_chain = document_chain
+        self.index_generation = retriever.index.generation
+        self.loaded_at = datetime.now().isoformat()
+
+def initialize_chatbot(document_chain=None) -> ChatbotGeneration:
+    """Khởi tạo BM25 Retriever (NumPy) và LLM"""
+    retriever = load_retriever()
+    if document_chain is None:
+        document_chain = build_document_chain()
+    return ChatbotGeneration(retriever, document_chain)
+
+# Global chatbot generation (lazy initialization, thay bằng phép gán tham chiếu khi reload)
+chatbot_generation = None
+_chatbot_init_lock = threading.Lock()
+_index_reload_lock = threading.Lock()
+INDEX_WATCH_INTERVAL = int(os.getenv("INDEX_WATCH_INTERVAL", "0"))  # giây, 0 = tắt watcher
+
+def get_chatbot() -> ChatbotGeneration:
+    """Lazy load chatbot generation hiện tại"""
+    global chatbot_generation
+    if chatbot_generation is None:
+        with _chatbot_init_lock:
+            if chatbot_generation is None:
+                print("=== INITIALIZING CHATBOT ===")
+                chatbot_generation = initialize_chatbot()
+                print("=== CHATBOT READY ===")
+                if INDEX_WATCH_INTERVAL > 0:
+                    start_index_watcher(INDEX_WATCH_INTERVAL)
+    return chatbot_generation
+
+# --- Answer Cache (câu hỏi không dùng thông tin cá nhân) ---
+answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl_seconds=ANSWER_CACHE_TTL)
+# Gộp các request giống hệt nhau đang chạy cùng lúc thành 1 lần gọi Gemini
+single_flight = SingleFlight()
+
+def load_intent_router():
+    """IntentRouter từ model đã train; None nếu tắt hoặc chưa có model (mọi câu đi qua LLM)"""
+    if not INTENT_ROUTER:
+        return None
+    if not os.path.exists(INTENT_MODEL_FILE):
+        print(f"⚠️ Không tìm thấy {INTENT_MODEL_FILE}, tắt intent router (chạy train_intent_router.py)")
+        return None
+    router = IntentRouter.from_file(INTENT_MODEL_FILE, confidence=INTENT_CONFIDENCE)
+    print(f"✅ Intent router: ngưỡng tin cậy {INTENT_CONFIDENCE}")
+    return router
+
+intent_router = load_intent_router()
+
+# Phân loại câu hỏi đi qua LLM → max_output_tokens + hướng dẫn độ dài
+question_classifier = QuestionClassifier() if ADAPTIVE_OUTPUT else None
+
+def response_profile(user_message: str):
+    """ResponseProfile cho câu hỏi (mặc định 800 token nếu ADAPTIVE_OUTPUT tắt)"""
+    if question_classifier is None:
+        return RESPONSE_PROFILES[DEFAULT_PROFILE]
+    return question_classifier.classify(user_message)
+
+def answer_context_key(chatbot: ChatbotGeneration, documents, history_text: str) -> str:
+    """
+    Context của câu trả lời: version prompt + generation index + doc ids đã retrieve + fingerprint
+    lịch sử đưa vào prompt ("còn giá vé thì sao?" phụ thuộc lượt trước của chính session đó,
+    nên chỉ dùng lại câu trả lời khi lịch sử giống hệt, thường là câu hỏi đầu tiên của session)
+    """
+    doc_ids = ",".join(str(doc.metadata.get("doc_id")) for doc in documents)
+    history = hashlib.sha1(history_text.encode("utf-8")).hexdigest()[:16]
+    return f"{PROMPT_VERSION}|{chatbot.index_generation}|{doc_ids}|{history}"
 
-def get_retrieval_chain():
-    """Lazy load retrieval chain"""
-    global retrieval_chain
-    if retrieval_chain is None:
-        print("=== INITIALIZING CHATBOT ===")
-        retrieval_chain = initialize_chatbot()
-        print("=== CHATBOT READY ===")
-    return retrieval_chain
+def reload_retrieval_index() -> Dict:
+    """
+    Mở index mới (ngoài request path) rồi swap generation bằng 1 phép gán tham chiếu.
+    Request đang chạy vẫn dùng generation cũ cho tới khi xong.
+    """
+    global chatbot_generation
+    with _index_reload_lock:
+        current = get_chatbot()
+        retriever = load_retriever()
+        chatbot_generation = ChatbotGeneration(retriever, current.document_chain)
+        print(f"🔄 Retrieval index reloaded: generation {current.index_generation} → {chatbot_generation.index_generation}")
+        return {
+            "previous_generation": current.index_generation,
+            "index_generation": chatbot_generation.index_generation,
+            "documents": retriever.index.n_docs,
+            "loaded_at": chatbot_generation.loaded_at
+        }
+
+def start_index_watcher(interval: int):
+    """Thread nền: reload khi manifest của index trên đĩa có generation mới"""
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                if read_generation(RETRIEVAL_INDEX_DIR) != chatbot_generation.index_generation:
+                    reload_retrieval_index()
+            except Exception as e:
+                print(f"⚠️ Index watcher error: {e}")
+    
+    threading.Thread(target=watch, name="index-watcher", daemon=True).start()
+    print(f"👀 Index watcher started (interval {interval}s)")
 
 # --- User Data Cache ---
-user_data_cache = {}
-CACHE_TTL = 240  # 4 phút (cân bằng giữa fresh data và performance)
+# Cache dùng chung với get_user_data_from_firebase: LRU theo bộ nhớ, TTL có jitter, stale-while-revalidate
+# (firebaseCache.py, cấu hình USER_CACHE_TTL / USER_CACHE_STALE / USER_CACHE_MAX_MB)
+user_data_cache = get_firebase_cache()
 
 def clear_user_cache(user_id: str):
-    """Clear tất cả cache cho user (cả main.py cache và firebaseCache)"""
-    # Clear cache trong main.py
-    if user_id in user_data_cache:
-        del user_data_cache[user_id]
-        print(f"🗑️ Main cache cleared for user {user_id}")
-    
-    # Clear cache trong firebaseCache.py
-    firebase_cache = get_firebase_cache()
-    firebase_cache.invalidate(user_id)
+    """Clear cache dữ liệu cá nhân của user"""
+    user_data_cache.invalidate(user_id)
 
 def get_user_data_cached(user_id: str) -> List[str]:
     """Lấy user data với caching để tăng tốc"""
-    current_time = time.time()
-    
-    # Kiểm tra cache
-    if user_id in user_data_cache:
-        cached_data, cached_time = user_data_cache[user_id]
-        if current_time - cached_time < CACHE_TTL:
-            print(f"✅ Cache HIT cho user {user_id}")
-            return cached_data
-    
-    # Cache miss - load từ Firebase
-    print(f"⚠️ Cache MISS cho user {user_id} - loading từ Firebase...")
     try:
-        from manageDataFirebase.buildDataApp import get_user_data_from_firebase
-        user_docs = get_user_data_from_firebase(user_id)
-        
-        # Lưu vào cache
-        user_data_cache[user_id] = (user_docs, current_time)
-        return user_docs
+        return user_data_cache.get_or_load(user_id, storage.load_user_docs)
     except Exception as e:
-        print(f"❌ Lỗi khi lấy data từ Firebase: {e}")
+        print(f"❌ Lỗi khi lấy data từ {storage.name}: {e}")
         return []
 
-# --- Firestore History Management ---
-def get_history_from_firestore(session_id: str) -> List[Dict]:
-    """Lấy lịch sử từ Firestore"""
-    try:
-        doc_ref = db.collection('chat_sessions').document(session_id)
-        doc = doc_ref.get()
-        
-        if doc.exists:
-            data = doc.to_dict()
-            return data.get('history', [])
-        return []
-    except Exception as e:
-        print(f"Error getting history: {e}")
-        return []
+# Lịch sử trong bộ nhớ + ghi storage ở background theo batch (sessionHistory.py)
+history_cache = SessionHistoryCache(
+    load_fn=lambda session_id: storage.load_history(session_id, MAX_HISTORY_SIZE),
+    save_fn=storage.save_histories,
+    max_history=HISTORY_RECENT_TURNS if HISTORY_MODE == "summary" else MAX_HISTORY_SIZE,
+    summarizer=summarize_turns if HISTORY_MODE == "summary" else None,
+    max_sessions=HISTORY_CACHE_SIZE,
+    ttl_seconds=HISTORY_CACHE_TTL,
+    flush_interval=HISTORY_FLUSH_INTERVAL,
+)
 
-def save_history_to_firestore(session_id: str, history: List[Dict]):
-    """Lưu lịch sử vào Firestore"""
-    try:
-        doc_ref = db.collection('chat_sessions').document(session_id)
-        doc_ref.set({
-            'history': history,
-            'updated_at': datetime.now()
-        })
-    except Exception as e:
-        print(f"Error saving history: {e}")
+def _flush_history_on_shutdown():
+    history_cache.close()
+
+atexit.register(_flush_history_on_shutdown)
+
+def _install_sigterm_flush():
+    """SIGTERM (Cloud Run, gunicorn) → ghi nốt lịch sử rồi chuyển cho handler cũ"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        _flush_history_on_shutdown()
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+_install_sigterm_flush()
 
 def get_history_text(session_id: str) -> str:
-    """Lấy lịch sử dưới dạng text"""
-    history = get_history_from_firestore(session_id)
-    
-    if not history:
-        return "Chưa có lịch sử hội thoại."
-    
-    history_text = []
-    for item in history:
-        history_text.append(f"Người dùng: {item['question']}")
-        history_text.append(f"Bot: {item['answer']}")
-    
-    return "\n".join(history_text)
+    """Lấy lịch sử dưới dạng text (đã render sẵn trong cache)"""
+    return history_cache.get_text(session_id)
 
 def add_to_history(session_id: str, question: str, answer: str):
-    """Thêm vào lịch sử"""
-    history = get_history_from_firestore(session_id)
-    
-    history.append({
-        "question": question,
-        "answer": answer,
-        "timestamp": datetime.now().isoformat()
-    })
-    
-    # Giữ chỉ 5 câu gần nhất
-    if len(history) > MAX_HISTORY_SIZE:
-        history = history[-MAX_HISTORY_SIZE:]
-    
-    save_history_to_firestore(session_id, history)
+    """Thêm vào lịch sử (lượt cũ bị bỏ hoặc gộp vào tóm tắt theo HISTORY_MODE), storage ghi ở background"""
+    history_cache.append(session_id, question, answer)
 
 def clear_history(session_id: str):
     """Xóa lịch sử"""
-    save_history_to_firestore(session_id, [])
+    history_cache.clear(session_id)
 
 # --- API Routes ---
 @app.route('/', methods=['GET'])
@@ -426,6 +506,8 @@ def root():
         "endpoints": {
             "health": "/health",
             "chat": "/chat (POST)",
+            "retrieve": "/retrieve (POST)",
+            "retrieve_batch": "/retrieve/batch (POST)",
             "history": "/history (GET)",
             "user_create": "/user/collection/create (POST)",
             "user_check": "/user/collection/check (GET)",
@@ -434,7 +516,9 @@ def root():
             "user_query": "/user/collection/query (POST)",
             "cache_stats": "/cache/stats (GET)",
             "cache_invalidate": "/cache/invalidate/<user_id> (POST)",
-            "cache_clear": "/cache/clear (POST)"
+            "cache_clear": "/cache/clear (POST)",
+            "reload_index": "/admin/reload-index (POST)",
+            "index_stats": "/admin/index-stats (GET)"
         },
         "timestamp": datetime.now().isoformat()
     })
@@ -465,15 +549,14 @@ def api_stats():
 
 @app.route('/cache/clear', methods=['POST'])
 def clear_cache():
-    """Clear user data cache"""
+    """Clear cache của 1 user (body {"user_id": ...}) hoặc toàn bộ user cache + answer cache (Admin only)"""
     try:
-        global user_data_cache
-        user_id = request.get_json().get('user_id') if request.get_json() else None
+        payload = request.get_json(silent=True) or {}
+        user_id = payload.get('user_id')
         
         if user_id:
             # Clear cache cho user cụ thể
-            if user_id in user_data_cache:
-                del user_data_cache[user_id]
+            if user_data_cache.invalidate(user_id):
                 return jsonify({
                     "success": True,
                     "message": f"Cache cleared cho user {user_id}"
@@ -484,12 +567,14 @@ def clear_cache():
                     "message": f"Không tìm thấy cache cho user {user_id}"
                 })
         else:
-            # Clear toàn bộ cache
-            cache_size = len(user_data_cache)
-            user_data_cache.clear()
+            # Clear toàn bộ cache (cả answer cache)
+            cache_size = user_data_cache.clear()
+            answer_entries = answer_cache.get_stats()["entries"]
+            answer_cache.clear()
             return jsonify({
                 "success": True,
-                "message": f"Đã clear {cache_size} user cache entries"
+                "message": f"Đã clear {cache_size} user cache entries, {answer_entries} answer cache entries",
+                "timestamp": datetime.now().isoformat()
             })
     except Exception as e:
         return jsonify({
@@ -501,23 +586,20 @@ def clear_cache():
 def cache_stats():
     """Xem thống kê cache"""
     try:
-        current_time = time.time()
-        cache_info = []
-        
-        for user_id, (data, cached_time) in user_data_cache.items():
-            age = current_time - cached_time
-            cache_info.append({
-                "user_id": user_id,
-                "documents_count": len(data),
-                "age_seconds": int(age),
-                "ttl_remaining": int(CACHE_TTL - age)
-            })
+        user_cache_stats = user_data_cache.get_stats()
         
         return jsonify({
             "success": True,
-            "total_cached_users": len(user_data_cache),
-            "cache_ttl": CACHE_TTL,
-            "cache_entries": cache_info
+            "total_cached_users": user_cache_stats["total_cached_users"],
+            "cache_ttl": user_cache_stats["ttl_seconds"],
+            "cache_entries": user_data_cache.entries_info(),
+            "user_cache": user_cache_stats,
+            "answer_cache": answer_cache.get_stats(),
+            "single_flight": single_flight.get_stats(),
+            "intent_router": intent_router.get_stats() if intent_router else None,
+            "response_profiles": question_classifier.get_stats() if question_classifier else None,
+            "session_history": history_cache.get_stats(),
+            "storage": storage.get_stats()
         })
     except Exception as e:
         return jsonify({
@@ -525,39 +607,84 @@ def cache_stats():
             "error": str(e)
         }), 500
 
+# Matcher câu hỏi cá nhân: cụm từ khóa có trọng số, khớp trọn âm tiết (personalMatcher.py)
+personal_matcher = PersonalMatcher(threshold=float(os.getenv("PERSONAL_THRESHOLD", str(PERSONAL_THRESHOLD))))
+
 def is_personal_question(message: str) -> bool:
     """
     Kiểm tra xem câu hỏi có liên quan đến thông tin cá nhân không
+    (chỉ khi đúng mới đọc dữ liệu cá nhân từ Firestore và đưa vào prompt)
     """
-    message_lower = message.lower()
-    
-    # Từ khóa liên quan đến thông tin cá nhân
-    personal_keywords = [
-        # Thông tin người dùng
-        'tôi', 'mình', 'em', 'của tôi', 'của mình', 'của em',
-        'sinh nhật', 'ngày sinh', 'tuổi', 'bao nhiêu tuổi',
-        'tên tôi', 'tên mình', 'tên em',
-        
-        # Thông tin người yêu
-        'người yêu', 'bạn trai', 'bạn gái', 'ny', 'crush',
-        'của anh ấy', 'của cô ấy', 'của bạn ấy',
-        
-        # Thông tin mối quan hệ
-        'hẹn hò', 'yêu nhau', 'bắt đầu yêu', 'kỷ niệm',
-        'chúng tôi', 'hai đứa', 'hai người', 'cả hai',
-        
-        # Thông tin kế hoạch
-        'kế hoạch của tôi', 'kế hoạch của mình', 'kế hoạch của em',
-        'kế hoạch chúng tôi', 'định làm gì', 'sắp đi đâu',
-        'dự định', 'có kế hoạch nào'
-    ]
-    
-    # Kiểm tra xem có từ khóa nào trong câu hỏi không
-    for keyword in personal_keywords:
-        if keyword in message_lower:
-            return True
-    
-    return False
+    return personal_matcher.is_personal(message)
+
+# Executor chung cho các bước trước LLM (đọc Firestore + retrieval chạy song song)
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "16"))
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+def _timed(fn, *args):
+    """(kết quả, thời gian chạy ms) - chạy trong prefetch_executor"""
+    start_time = time.perf_counter()
+    result = fn(*args)
+    return result, round((time.perf_counter() - start_time) * 1000, 1)
+
+def _retrieve(user_message: str):
+    chatbot = get_chatbot()
+    return chatbot, chatbot.retriever.invoke(user_message)
+
+def gather_chat_context(session_id: str, user_id, user_message: str) -> Dict:
+    """
+    Lấy lịch sử (Firestore), thông tin cá nhân (Firestore, chỉ khi câu hỏi cần) và retrieval
+    song song, join ngay trước khi render prompt → thời gian chờ = bước chậm nhất thay vì tổng.
+
+    Returns:
+        dict: chatbot, documents, history_text, personal_context, use_personal_context,
+        timings (ms từng bước + total_ms)
+    """
+    start_time = time.perf_counter()
+    use_personal_context = is_personal_question(user_message)
+
+    history_future = prefetch_executor.submit(_timed, get_history_text, session_id)
+    retrieval_future = prefetch_executor.submit(_timed, _retrieve, user_message)
+    user_data_future = None
+    if user_id and use_personal_context:
+        # Sử dụng cache để tăng tốc
+        user_data_future = prefetch_executor.submit(_timed, get_user_data_cached, user_id)
+    elif user_id:
+        print(f"ℹ️ Câu hỏi không liên quan đến thông tin cá nhân, bỏ qua Firebase data cho user {user_id}")
+
+    timings = {}
+    personal_context = ""
+    if user_data_future is not None:
+        try:
+            user_docs, timings["user_data_ms"] = user_data_future.result()
+            if user_docs:
+                personal_context = "\n\nTHÔNG TIN CÁ NHÂN CỦA NGƯỜI DÙNG:\n"
+                personal_context += "\n".join([f"- {doc}" for doc in user_docs])
+                print(f"✅ Đã lấy {len(user_docs)} thông tin cho user {user_id}")
+            else:
+                print(f"⚠️ User {user_id} chưa có dữ liệu trong Firebase")
+        except Exception as e:
+            print(f"⚠️ Lỗi khi lấy thông tin: {e}")
+    history_text, timings["history_ms"] = history_future.result()
+    (chatbot, documents), timings["retrieval_ms"] = retrieval_future.result()
+    timings["total_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+    print(f"⏱️ Pre-LLM: {timings}")
+
+    return {
+        "chatbot": chatbot,
+        "documents": documents,
+        "history_text": history_text,
+        "personal_context": personal_context,
+        "use_personal_context": use_personal_context,
+        "timings": timings,
+    }
+
+def rate_limited_response(error: RateLimitExceeded):
+    """HTTP 429 + Retry-After khi không có API key nào kịp nhận request"""
+    retry_after = math.ceil(error.retry_after)
+    response = jsonify({"success": False, "error": str(error), "retry_after": retry_after})
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 429
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -574,53 +701,71 @@ def chat():
         if not user_message:
             return jsonify({"error": "Message cannot be empty"}), 400
         
-        # Lấy lịch sử hội thoại
-        history_text = get_history_text(session_id)
-        
-        # Kiểm tra xem câu hỏi có liên quan đến thông tin cá nhân không
-        use_personal_context = is_personal_question(user_message)
-        
-        # Lấy thông tin cá nhân của user CHỈ KHI CẦN THIẾT
-        personal_context = ""
-        has_personal_context = False
-        if user_id and use_personal_context:
-            try:
-                # Sử dụng cache để tăng tốc
-                user_docs = get_user_data_cached(user_id)
-                
-                if user_docs:
-                    personal_context = "\n\nTHÔNG TIN CÁ NHÂN CỦA NGƯỜI DÙNG:\n"
-                    personal_context += "\n".join([f"- {doc}" for doc in user_docs])
-                    has_personal_context = True
-                    print(f"✅ Đã lấy {len(user_docs)} thông tin cho user {user_id}")
-                else:
-                    print(f"⚠️ User {user_id} chưa có dữ liệu trong Firebase")
-            except Exception as e:
-                print(f"⚠️ Lỗi khi lấy thông tin: {e}")
-        elif user_id and not use_personal_context:
-            print(f"ℹ️ Câu hỏi không liên quan đến thông tin cá nhân, bỏ qua Firebase data cho user {user_id}")
-        
-        # Gọi RAG chain với context được mở rộng
-        chain = get_retrieval_chain()
+        # Thông tin thời gian hiện tại để LLM (và intent router) có ngữ cảnh thời gian
+        current_time = get_current_time_info()
+
+        # Chào hỏi / hỏi giờ / câu hỏi ngoài phạm vi → trả lời tại chỗ, không retrieval, không gọi Gemini
+        routed = intent_router.route(user_message, current_time) if intent_router else None
+        if routed:
+            add_to_history(session_id, user_message, routed["answer"])
+            return jsonify({
+                "success": True,
+                "session_id": session_id,
+                "user_id": user_id,
+                "question": user_message,
+                "answer": routed["answer"],
+                "has_personal_context": False,
+                "used_personal_data": False,
+                "cached": False,
+                "coalesced": False,
+                "routed_intent": routed["intent"],
+                "timestamp": datetime.now().isoformat(),
+                "current_time": current_time
+            })
+
+        # Lịch sử hội thoại, thông tin cá nhân (CHỈ KHI CẦN THIẾT) và retrieval chạy song song;
+        # retrieval trước LLM để biết doc ids cho answer cache
+        context = gather_chat_context(session_id, user_id, user_message)
+        chatbot = context["chatbot"]
+        documents = context["documents"]
+        history_text = context["history_text"]
+        personal_context = context["personal_context"]
+        use_personal_context = context["use_personal_context"]
+        has_personal_context = bool(personal_context)
 
         # Kết hợp history với personal context
         enhanced_history = history_text
         if personal_context:
             enhanced_history = f"{history_text}\n{personal_context}"
 
-        # Thêm thông tin thời gian hiện tại vào input để LLM có ngữ cảnh thời gian
-        current_time = get_current_time_info()
-        
         # Format current_time thành string để truyền vào prompt
         current_time_str = f"{current_time['vn_human']} (UTC: {current_time['utc_iso']})"
 
-        response = chain.invoke({
-            "input": user_message,
-            "history": enhanced_history,
-            "current_time": current_time_str
-        })
-        
-        bot_answer = response["answer"]
+        # Câu hỏi không dùng thông tin cá nhân → thử answer cache trước khi gọi Gemini
+        context_key = None
+        if not use_personal_context and answer_cache.is_cacheable(user_message):
+            context_key = answer_context_key(chatbot, documents, history_text)
+        bot_answer = answer_cache.get(user_message, context_key) if context_key else None
+        cached = bot_answer is not None
+        coalesced = False
+
+        profile = response_profile(user_message)
+
+        if not cached:
+            # Request giống hệt đang chạy → dùng chung câu trả lời thay vì gọi Gemini lần nữa
+            start_time = time.perf_counter()
+            bot_answer, coalesced = single_flight.run(
+                flight_key(user_message, answer_context_key(chatbot, documents, history_text), enhanced_history),
+                lambda: chatbot.document_chain.invoke({
+                    "input": user_message,
+                    "history": enhanced_history,
+                    "current_time": current_time_str,
+                    "answer_style": profile.instruction,
+                    "context": documents
+                }, profile.name)
+            )
+            if context_key and not coalesced:
+                answer_cache.set(user_message, context_key, bot_answer, (time.perf_counter() - start_time) * 1000)
         
         # Lưu lịch sử
         add_to_history(session_id, user_message, bot_answer)
@@ -633,10 +778,19 @@ def chat():
             "answer": bot_answer,
             "has_personal_context": has_personal_context,
             "used_personal_data": use_personal_context,
+            "cached": cached,
+            "coalesced": coalesced,
+            "routed_intent": None,
+            "response_class": profile.name,
+            "timings": context["timings"],
             "timestamp": datetime.now().isoformat(),
             "current_time": current_time
         })
     
+    except RateLimitExceeded as e:
+        # Mọi key đều hết lượt quá deadline hàng đợi → 429 để client thử lại, không phải 500
+        print(f"⏳ Rate limited: {e}")
+        return rate_limited_response(e)
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -657,50 +811,64 @@ def chat_stream():
         if not user_message:
             return jsonify({"error": "Message cannot be empty"}), 400
         
-        # Lấy lịch sử và context cá nhân (giống endpoint /chat)
-        history_text = get_history_text(session_id)
-        use_personal_context = is_personal_question(user_message)
-        
-        personal_context = ""
-        if user_id and use_personal_context:
-            try:
-                # Sử dụng cache để tăng tốc
-                user_docs = get_user_data_cached(user_id)
-                if user_docs:
-                    personal_context = "\n\nTHÔNG TIN CÁ NHÂN CỦA NGƯỜI DÙNG:\n"
-                    personal_context += "\n".join([f"- {doc}" for doc in user_docs])
-                    print(f"✅ Stream: Đã lấy {len(user_docs)} thông tin cho user {user_id}")
-            except Exception as e:
-                print(f"⚠️ Stream: Lỗi: {e}")
-        
-        enhanced_history = history_text
-        if personal_context:
-            enhanced_history = f"{history_text}\n{personal_context}"
-        
         current_time = get_current_time_info()
         current_time_str = f"{current_time['vn_human']} (UTC: {current_time['utc_iso']})"
         
         # Tạo streaming generator
         def generate():
             try:
-                chain = get_retrieval_chain()
+                # Câu trả lời tại chỗ của intent router cũng phát dưới dạng token (giống answer cache)
+                routed = intent_router.route(user_message, current_time) if intent_router else None
+                if routed:
+                    yield f"data: {json.dumps({'type': 'start', 'session_id': session_id, 'cached': False, 'coalesced': False, 'routed_intent': routed['intent']})}\n\n"
+                    for token in replay_chunks(routed["answer"]):
+                        yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
+                    add_to_history(session_id, user_message, routed["answer"])
+                    yield f"data: {json.dumps({'type': 'done', 'full_answer': routed['answer']})}\n\n"
+                    return
+
+                # Lịch sử, context cá nhân và retrieval song song (giống endpoint /chat)
+                context = gather_chat_context(session_id, user_id, user_message)
+                chatbot = context["chatbot"]
+                documents = context["documents"]
+                use_personal_context = context["use_personal_context"]
+                enhanced_history = context["history_text"]
+                if context["personal_context"]:
+                    enhanced_history = f"{enhanced_history}\n{context['personal_context']}"
+
+                context_key = None
+                if not use_personal_context and answer_cache.is_cacheable(user_message):
+                    context_key = answer_context_key(chatbot, documents, context["history_text"])
+                cached_answer = answer_cache.get(user_message, context_key) if context_key else None
                 full_answer = ""
+                coalesced = False
+                profile = response_profile(user_message)
+                if cached_answer is not None:
+                    # Phát lại câu trả lời đã cache dưới dạng token (client không cần xử lý khác)
+                    tokens = replay_chunks(cached_answer)
+                else:
+                    # Stream từ LLM; request giống hệt đang stream → theo stream của request đó
+                    tokens, coalesced = single_flight.stream(
+                        flight_key(user_message, answer_context_key(chatbot, documents, context["history_text"]), enhanced_history),
+                        lambda: chatbot.document_chain.stream({
+                            "input": user_message,
+                            "history": enhanced_history,
+                            "current_time": current_time_str,
+                            "answer_style": profile.instruction,
+                            "context": documents
+                        }, profile.name)
+                    )
                 
                 # Send initial metadata
-                yield f"data: {json.dumps({'type': 'start', 'session_id': session_id})}\n\n"
+                yield f"data: {json.dumps({'type': 'start', 'session_id': session_id, 'cached': cached_answer is not None, 'coalesced': coalesced, 'response_class': profile.name, 'timings': context['timings']})}\n\n"
                 
-                # Stream từ LLM
-                for chunk in chain.stream({
-                    "input": user_message,
-                    "history": enhanced_history,
-                    "current_time": current_time_str
-                }):
-                    # LangChain stream trả về dict với key 'answer'
-                    if 'answer' in chunk:
-                        token = chunk['answer']
-                        full_answer += token
-                        # Send token qua Server-Sent Events format
-                        yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
+                start_time = time.perf_counter()
+                for token in tokens:
+                    full_answer += token
+                    # Send token qua Server-Sent Events format
+                    yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
+                if context_key and cached_answer is None and not coalesced:
+                    answer_cache.set(user_message, context_key, full_answer, (time.perf_counter() - start_time) * 1000)
                 
                 # Lưu lịch sử sau khi stream xong
                 add_to_history(session_id, user_message, full_answer)
@@ -708,6 +876,9 @@ def chat_stream():
                 # Send completion signal
                 yield f"data: {json.dumps({'type': 'done', 'full_answer': full_answer})}\n\n"
                 
+            except RateLimitExceeded as e:
+                print(f"⏳ Stream rate limited: {e}")
+                yield f"data: {json.dumps({'type': 'error', 'error': str(e), 'status': 429, 'retry_after': math.ceil(e.retry_after)})}\n\n"
             except Exception as e:
                 error_msg = str(e)
                 print(f"Stream error: {error_msg}")
@@ -730,12 +901,13 @@ def chat_stream():
 def get_history():
     try:
         session_id = request.args.get('session_id', 'default')
-        history = get_history_from_firestore(session_id)
+        history = history_cache.get_history(session_id)
         
         return jsonify({
             "success": True,
             "session_id": session_id,
             "history": history,
+            "summary": history_cache.get_summary(session_id),
             "count": len(history)
         })
     except Exception as e:
@@ -939,9 +1111,7 @@ def query_user_collection():
 def invalidate_user_cache(user_id):
     """Invalidate cache for specific user"""
     try:
-        from firebaseCache import get_cache
-        cache = get_cache()
-        cache.invalidate(user_id)
+        user_data_cache.invalidate(user_id)
         
         return jsonify({
             "success": True,
@@ -951,22 +1121,6 @@ def invalidate_user_cache(user_id):
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
-@app.route('/cache/clear', methods=['POST'])
-def clear_all_cache():
-    """Clear all cache (Admin only)"""
-    try:
-        from firebaseCache import get_cache
-        cache = get_cache()
-        cache.clear()
-        
-        return jsonify({
-            "success": True,
-            "message": "All cache cleared",
-            "timestamp": datetime.now().isoformat()
-        })
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
-
 @app.route('/admin/build-all-data', methods=['POST'])
 def build_all_user_data():
     """Build toàn bộ dữ liệu từ Firebase vào ChromaDB (Admin only)"""
@@ -988,6 +1142,153 @@ def build_all_user_data():
         print(f"Error building all data: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+MAX_RETRIEVE_BATCH = 256
+MAX_RETRIEVE_K = 20
+
+def retrieve_documents(queries: List[str], k: int, filters: Dict = None, hybrid: bool = False) -> List[List[Dict]]:
+    """
+    Chỉ chạy retrieval (không gọi LLM) cho nhiều query bằng 1 lần chấm điểm vector hóa.
+    filters: bộ lọc facet áp dụng cho mọi query (vd {"loai": "qua_tang"}), None = tự nhận diện
+    hybrid: gộp BM25 (lọc facet tự động) với dense bằng RRF, từng query một; bỏ qua filters
+    """
+    index = get_chatbot().retriever.index
+    results = []
+    if hybrid:
+        batch_hits = [hybrid_top_k(index, query, k) for query in queries]
+    else:
+        query_filters = [filters] * len(queries) if filters is not None else None
+        batch_hits = index.top_k_batch(queries, k, query_filters)
+    for hits in batch_hits:
+        documents = []
+        for doc_id, score in hits:
+            text, metadata = index.document(doc_id)
+            documents.append({
+                "doc_id": doc_id,
+                "score": round(score, 4),
+                "content": text,
+                "metadata": metadata
+            })
+        results.append(documents)
+    return results
+
+def _parse_retrieve_k(data: Dict) -> int:
+    k = int(data.get('k', get_chatbot().retriever.k))
+    return max(1, min(k, MAX_RETRIEVE_K))
+
+def _parse_retrieve_hybrid(data: Dict) -> bool:
+    hybrid = data.get('hybrid', get_chatbot().retriever.hybrid)
+    if not isinstance(hybrid, bool):
+        raise ValueError("'hybrid' phải là true/false")
+    return hybrid
+
+def _parse_retrieve_filters(data: Dict):
+    filters = data.get('filters')
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError("'filters' phải là object {field: value | [values]}")
+    return filters
+
+@app.route('/retrieve', methods=['POST'])
+def retrieve():
+    """Retrieval-only: trả về documents BM25 cho 1 query (debug / đánh giá retrieval)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        query = str(data.get('query', '')).strip()
+        if not query:
+            return jsonify({"error": "Missing 'query'"}), 400
+
+        start_time = time.perf_counter()
+        documents = retrieve_documents(
+            [query], _parse_retrieve_k(data), _parse_retrieve_filters(data), _parse_retrieve_hybrid(data)
+        )[0]
+        return jsonify({
+            "success": True,
+            "query": query,
+            "documents": documents,
+            "latency_ms": round((time.perf_counter() - start_time) * 1000, 3)
+        })
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    except Exception as e:
+        print(f"Error in retrieve: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/retrieve/batch', methods=['POST'])
+def retrieve_batch():
+    """
+    Retrieval-only cho nhiều query trong 1 request.
+    Các query được chấm điểm cùng lúc (ma trận sparse queries x corpus) thay vì lặp từng query.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        if not isinstance(queries, list) or not queries:
+            return jsonify({"error": "Missing 'queries' (list)"}), 400
+        if len(queries) > MAX_RETRIEVE_BATCH:
+            return jsonify({"error": f"Tối đa {MAX_RETRIEVE_BATCH} queries mỗi request"}), 400
+
+        queries = [str(query).strip() for query in queries]
+        start_time = time.perf_counter()
+        results = retrieve_documents(
+            queries, _parse_retrieve_k(data), _parse_retrieve_filters(data), _parse_retrieve_hybrid(data)
+        )
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        return jsonify({
+            "success": True,
+            "results": [
+                {"query": query, "documents": documents}
+                for query, documents in zip(queries, results)
+            ],
+            "latency_ms": round(latency_ms, 3),
+            "latency_per_query_ms": round(latency_ms / len(queries), 3)
+        })
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    except Exception as e:
+        print(f"Error in retrieve batch: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/admin/reload-index', methods=['POST'])
+def reload_index():
+    """Reload retrieval index không cần restart (Admin only)"""
+    try:
+        data = request.get_json(silent=True) or {}
+
+        # wait=true: chờ reload xong rồi trả kết quả; mặc định chạy nền
+        if data.get('wait'):
+            result = reload_retrieval_index()
+            return jsonify({"success": True, **result})
+
+        if _index_reload_lock.locked():
+            return jsonify({
+                "success": False,
+                "message": "Index đang được reload"
+            }), 409
+
+        threading.Thread(target=reload_retrieval_index, name="index-reload", daemon=True).start()
+        return jsonify({
+            "success": True,
+            "message": "Đang reload index ở background",
+            "current_generation": get_chatbot().index_generation
+        }), 202
+
+    except Exception as e:
+        print(f"Error reloading index: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/admin/index-stats', methods=['GET'])
+def index_stats():
+    """Xem thống kê retrieval index đang phục vụ"""
+    try:
+        chatbot = get_chatbot()
+        return jsonify({
+            "success": True,
+            "loaded_at": chatbot.loaded_at,
+            "on_disk_generation": read_generation(RETRIEVAL_INDEX_DIR),
+            "index": chatbot.retriever.index.stats()
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # --- Firebase Functions Entry Point ---
 @https_fn.on_request(
     cors=options.CorsOptions(
@@ -1039,6 +1340,7 @@ def start_firebase_sync():
         )
         
         print("\n🔄 Đang khởi động Firebase Realtime Sync...")
+        db = firestore.client()
         
         # Listener cho users collection
         users_ref = db.collection("users")
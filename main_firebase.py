@@ -2,7 +2,6 @@
 # Version: Firebase Functions compatible
 
 import os
-import pickle
 from typing import Dict, List
 from datetime import datetime
 
@@ -16,16 +15,17 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.retrievers import BM25Retriever
 from langchain.prompts import PromptTemplate
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 
+from retrieval.nativeBM25Retriever import NativeBM25Retriever
+
 # Initialize Firebase Admin
 initialize_app()
 
 # --- Cấu hình ---
-DOCUMENTS_PICKLE_FILE = "bm25_documents.pkl"
+RETRIEVAL_INDEX_DIR = "retrieval_index"
 MAX_HISTORY_SIZE = 5
 
 # Khởi tạo Flask app
@@ -54,16 +54,12 @@ def get_google_api_key():
 # --- Khởi tạo Chatbot ---
 def initialize_chatbot():
     """Khởi tạo BM25 Retriever và LLM"""
-    if not os.path.exists(DOCUMENTS_PICKLE_FILE):
-        raise FileNotFoundError(f"Không tìm thấy file {DOCUMENTS_PICKLE_FILE}")
-    
-    print(f"Loading documents from {DOCUMENTS_PICKLE_FILE}...")
-    with open(DOCUMENTS_PICKLE_FILE, 'rb') as f:
-        documents = pickle.load(f)
-    print(f"Loaded {len(documents)} documents")
+    if not os.path.exists(RETRIEVAL_INDEX_DIR):
+        raise FileNotFoundError(f"Không tìm thấy index {RETRIEVAL_INDEX_DIR}")
     
-    # BM25 Retriever
-    retriever = BM25Retriever.from_documents(documents, k=3)
+    print(f"Loading index from {RETRIEVAL_INDEX_DIR}...")
+    retriever = NativeBM25Retriever.from_index_dir(RETRIEVAL_INDEX_DIR, k=3)
+    print(f"Loaded {retriever.index.n_docs} documents")
     
     # Gemini LLM
     api_key = get_google_api_key()
@@ -3,8 +3,7 @@ from manageDataFirebase.buildCollectionUser import build_collection_user
 from manageDataFirebase.updateCollectionExists import update_collection_exists
 from google.cloud.firestore_v1.base_query import FieldFilter
 from firebaseCache import get_cache
-from datetime import datetime
-import pytz
+from storage.userDocuments import build_user_documents
 
 
 def build_data_app():
@@ -69,18 +68,17 @@ def get_user_data_from_firebase(user_id, use_cache=True):
     
     Returns:
         list[str]: Danh sách các text documents về user
+        (lỗi query: [] nếu use_cache, ngược lại raise để cache không lưu / không ghi đè bản cũ bằng [])
     """
     try:
-        # ✅ Kiểm tra cache trước
+        # ✅ Qua cache dùng chung (firebaseCache.py): hit, bản cũ + refresh nền, hoặc 1 lần query cho mọi request cùng miss
         if use_cache:
-            cache = get_cache()
-            cached_data = cache.get(user_id)
-            if cached_data is not None:
-                return cached_data
+            return get_cache().get_or_load(
+                user_id, lambda uid: get_user_data_from_firebase(uid, use_cache=False)
+            )
         
-        # ❌ Cache miss hoặc force refresh -> query Firebase
+        # ❌ Cache miss / refresh -> query Firebase
         print(f"🔄 Loading data from Firebase for user {user_id}...")
-        user_docs = []
         
         # 1. Lấy thông tin user
         user_ref = db.collection("users").document(user_id)
@@ -91,68 +89,16 @@ def get_user_data_from_firebase(user_id, use_cache=True):
             return []
         
         user_data = user_doc.to_dict() or {}
-        
-        # Thêm thông tin cơ bản của user
-        text_user = (
-            f"Thông tin của người dùng tên : {user_data.get('name', 'Không rõ')}, "
-            f"ngày sinh nhật : {user_data.get('dateOfBirth', 'Không có')}, "
-            f"Số điện thoại : {user_data.get('phoneNumber', 'Không có')}, "
-            f"Giới tính : {user_data.get('gender', 'Không rõ')}"
-        )
-        user_docs.append(text_user)
+        partner_data = None
+        plans = []
         
         # 2. Kiểm tra xem user có người yêu không
         partner_id = user_data.get('partnerId')
         if partner_id:
-            # ✅ FIX: Convert Firestore Timestamp to Vietnam timezone
-            start_date_raw = user_data.get("startLoveDate")
-            if start_date_raw:
-                try:
-                    # Convert Firestore Timestamp to datetime
-                    if hasattr(start_date_raw, 'timestamp'):
-                        # It's a Firestore Timestamp
-                        dt = datetime.fromtimestamp(start_date_raw.timestamp())
-                    else:
-                        # It's already a datetime or string
-                        dt = start_date_raw if isinstance(start_date_raw, datetime) else datetime.fromisoformat(str(start_date_raw))
-                    
-                    # Convert to Vietnam timezone (UTC+7)
-                    vietnam_tz = pytz.timezone('Asia/Ho_Chi_Minh')
-                    dt_vietnam = dt.replace(tzinfo=pytz.UTC).astimezone(vietnam_tz)
-                    
-                    # Format as readable string
-                    start_date = dt_vietnam.strftime("%d/%m/%Y")
-                except Exception as e:
-                    print(f"⚠️ Lỗi convert startLoveDate: {e}")
-                    start_date = str(start_date_raw)
-            else:
-                start_date = "không rõ"
-            
             # Lấy THÔNG TIN ĐẦY ĐỦ của người yêu (bao gồm cả thông tin chi tiết)
             partner_doc = db.collection("users").document(partner_id).get()
             if partner_doc.exists:
                 partner_data = partner_doc.to_dict() or {}
-                partner_name = partner_data.get("name", "Không rõ")
-                partner_dob = partner_data.get("dateOfBirth", "Không có")
-                partner_phone = partner_data.get("phoneNumber", "Không có")
-                partner_gender = partner_data.get("gender", "Không rõ")
-                
-                # Thêm thông tin cơ bản về mối quan hệ
-                text_couple = (
-                    f"Bạn bắt đầu hẹn hò vào thời gian : {start_date}, "
-                    f"người yêu bạn tên là : {partner_name}"
-                )
-                user_docs.append(text_couple)
-                
-                # ✅ THÊM: Thông tin chi tiết về người yêu
-                text_partner_detail = (
-                    f"Thông tin chi tiết về người yêu của bạn: "
-                    f"Tên: {partner_name}, "
-                    f"Ngày sinh: {partner_dob}, "
-                    f"Số điện thoại: {partner_phone}, "
-                    f"Giới tính: {partner_gender}"
-                )
-                user_docs.append(text_partner_detail)
                 
                 # 3. Tìm coupleId
                 couples_ref = db.collection("couples")
@@ -174,27 +120,17 @@ def get_user_data_from_firebase(user_id, use_cache=True):
                 if couple_id:
                     plans_ref = db.collection("couple_plans")
                     plans_query = plans_ref.where(filter=FieldFilter("coupleId", "==", couple_id)).get()
-                    
-                    for plan_doc in plans_query:
-                        plan_data = plan_doc.to_dict() or {}
-                        title = plan_data.get('title', '')
-                        date_plan = plan_data.get('date', '')
-                        timePlan = plan_data.get('time', '')
-                        details= plan_data.get('details', '')
-                        textPlan = f"Bạn có 1 kế hoạch: {title}, vào ngày: {date_plan} , giờ: {timePlan} với nội dung: {details}"
-                        user_docs.append(textPlan)
-                    
-        # ✅ Lưu vào cache trước khi return
-        if use_cache:
-            cache = get_cache()
-            cache.set(user_id, user_docs)
+                    plans = [plan_doc.to_dict() or {} for plan_doc in plans_query]
         
-        return user_docs
+        # Text giống hệt backend SQLite (storage/userDocuments.py)
+        return build_user_documents(user_data, partner_data, plans)
         
     except Exception as e:
         print(f"❌ Lỗi khi load data từ Firebase cho user {user_id}: {e}")
         import traceback
         traceback.print_exc()
+        if not use_cache:
+            raise
         return []
 
 
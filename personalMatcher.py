@@ -0,0 +1,97 @@
+"""
+Personal Matcher
+Quyết định câu hỏi có cần thông tin cá nhân (Firestore: user, người yêu, kế hoạch) hay không.
+
+Thay cho `keyword in message.lower()` trên ~40 từ khóa: từ khóa ngắn như "em", "ny" khớp cả
+giữa chữ ("xem", "nyc", "hem") → câu hỏi chung bị đi đường cá nhân, tốn Firestore reads và
+token prompt. Ở đây:
+- Automaton Aho-Corasick trên âm tiết (keywordMatcher.py): chỉ khớp trọn âm tiết
+- Mỗi cụm từ khóa có trọng số; điểm = tổng trọng số các cụm (khác nhau) khớp, cá nhân khi
+  điểm >= ngưỡng. Đại từ đơn lẻ ("tôi", "mình") chỉ là tín hiệu yếu, cần thêm ngữ cảnh
+- Câu gõ không dấu khớp với từ khóa đã bỏ dấu
+
+Đo độ chính xác / tốc độ: python benchmark_personal.py (dữ liệu personal_testdata.csv)
+"""
+from typing import Dict, List, Optional, Tuple
+
+from keywordMatcher import KeywordMatcher
+from retrieval.vietnameseTokenizer import fold_diacritics, normalize_text
+
+PERSONAL_THRESHOLD = 1.0
+
+# Cụm từ khóa -> trọng số (>= PERSONAL_THRESHOLD: một mình đủ để coi là câu hỏi cá nhân).
+# Trọng số 0: cụm trung tính che các từ khóa bên trong (hỏi về bot/cuộc trò chuyện, không về người dùng)
+PERSONAL_KEYWORDS: Dict[str, float] = {
+    # Thông tin người dùng
+    "của tôi": 0.7, "của mình": 0.7, "của em": 0.7, "của tớ": 0.7,
+    "tên tôi": 1.0, "tên mình": 1.0, "tên em": 1.0,
+    "ngày sinh": 1.0, "bao nhiêu tuổi": 1.0, "thông tin cá nhân": 1.0,
+    "sinh nhật": 0.5, "tuổi": 0.3, "thông tin": 0.4,
+
+    # Thông tin người yêu
+    "người yêu": 1.0, "bạn trai": 1.0, "bạn gái": 1.0, "ny": 1.0, "crush": 1.0,
+    "anh ấy": 1.0, "cô ấy": 1.0, "bạn ấy": 0.6, "vợ": 1.0, "chồng": 1.0,
+
+    # Thông tin mối quan hệ
+    "hẹn hò": 1.0, "yêu nhau": 1.0, "bắt đầu yêu": 1.0, "kỷ niệm": 0.5,
+    "chúng tôi": 1.0, "chúng mình": 1.0, "hai đứa": 1.0, "hai người": 0.5, "cả hai": 0.5,
+
+    # Thông tin kế hoạch
+    "kế hoạch": 0.6, "lịch": 0.5, "lịch hẹn": 1.0, "định làm gì": 1.0, "sắp đi đâu": 1.0,
+    "dự định": 0.6, "có kế hoạch nào": 1.0,
+
+    # Đại từ ngôi thứ nhất: tín hiệu yếu ("Tôi muốn biết về Hà Nội" không cần dữ liệu cá nhân)
+    "tôi": 0.5, "mình": 0.5, "em": 0.4, "tớ": 0.4,
+
+    # Thuộc tính của người dùng: cùng "của tôi" (0.7) đủ ngưỡng ("sở thích của tôi", "địa chỉ của mình")
+    "tên": 0.3, "sở thích": 0.3, "địa chỉ": 0.3, "quê": 0.3, "quê quán": 0.3, "số điện thoại": 0.3,
+    "email": 0.3, "nghề nghiệp": 0.3, "công việc": 0.3, "giới tính": 0.3, "tính cách": 0.3,
+
+    # Từ để hỏi: cùng đại từ + động từ tự mô tả ("tôi tên", "mình thích"... bên dưới) đủ ngưỡng;
+    # cùng đại từ đơn lẻ thì chưa ("Tôi muốn biết Hà Nội có gì" = 0.5 + 0.3)
+    "gì": 0.3, "nào": 0.3, "đâu": 0.3, "bao giờ": 0.3, "khi nào": 0.3, "bao nhiêu": 0.3, "mấy": 0.3,
+
+    # Cụm trung tính
+    "câu hỏi của tôi": 0.0, "câu hỏi của mình": 0.0, "giúp gì cho tôi": 0.0, "giúp gì cho mình": 0.0,
+    "cho tôi hỏi": 0.0, "cho mình hỏi": 0.0, "lịch trình": 0.0, "lịch sử": 0.0, "em bé": 0.0,
+    "thông tin về": 0.0, "du lịch": 0.0,
+}
+# Đại từ ngôi thứ nhất + động từ tự mô tả: "Tôi tên gì?", "Tôi thích ăn gì?", "Tôi sinh năm nào?"
+PERSONAL_KEYWORDS.update(
+    (f"{pronoun} {verb}", 0.7)
+    for pronoun in ("tôi", "mình", "em", "tớ")
+    for verb in ("tên", "sinh", "thích", "ghét", "quê", "làm nghề")
+)
+
+
+class PersonalMatcher:
+    """Chấm điểm câu hỏi theo các cụm từ khóa cá nhân có trọng số"""
+
+    def __init__(self, keywords: Optional[Dict[str, float]] = None, threshold: float = PERSONAL_THRESHOLD):
+        self.keywords = dict(PERSONAL_KEYWORDS if keywords is None else keywords)
+        self.threshold = threshold
+        items = list(self.keywords.items())
+        # Câu có dấu khớp đúng dấu ("tối" không khớp "tôi"); câu không dấu khớp sau khi bỏ dấu
+        self.matchers = {False: KeywordMatcher(items), True: KeywordMatcher(items, fold=True)}
+
+    def matches(self, message: str) -> List[Tuple[str, float]]:
+        """
+        Các cụm từ khóa (không lặp) khớp trong câu, kèm trọng số.
+        Chồng lấn thì giữ cụm dài nhất bắt đầu sớm nhất: "của tôi" không cộng thêm "tôi",
+        cụm trọng số 0 ("câu hỏi của tôi") vô hiệu hóa các cụm ngắn bên trong
+        """
+        normalized = normalize_text(message)
+        matcher = self.matchers[fold_diacritics(normalized) == normalized]
+        found, covered_until = {}, 0
+        for match in sorted(matcher.find_all(normalized), key=lambda m: (m.start, m.start - m.end)):
+            if match.start >= covered_until:
+                found.setdefault(match.phrase, match.value)
+                covered_until = match.end
+        return list(found.items())
+
+    def score(self, message: str) -> float:
+        return sum(weight for _, weight in self.matches(message))
+
+    def is_personal(self, message: str) -> bool:
+        return self.score(message) >= self.threshold
+
@@ -1,20 +1,26 @@
 # File: prepare_bm25_data.py
 
+import csv
 import os
-import pickle
-from langchain_community.document_loaders import CSVLoader
 from langchain_core.documents import Document
 
+from ingestion.csvRowDocument import row_to_document
+from retrieval.segmentedIndex import SegmentedIndex
+
 # --- Cấu hình ---
 DATA_FILE = 'dulieu.csv'
 HANOI_FILE = 'Hanoi.md'
-DOCUMENTS_PICKLE_FILE = "bm25_documents.pkl" # File sẽ lưu trữ các documents
+RETRIEVAL_INDEX_DIR = "retrieval_index" # Thư mục index (manifest + segments mmap) lưu documents + postings
+# Embedding hashed n-gram + IVF cục bộ cho hybrid retrieval (không cần mạng/GPU). Mặc định theo
+# HYBRID_RETRIEVAL của main.py (tắt): server không đọc dense vectors thì không build/mmap thêm
+BUILD_DENSE_INDEX = os.getenv("BUILD_DENSE_INDEX", os.getenv("HYBRID_RETRIEVAL", "0")) == "1"
 
 # --- 1. Tải và xử lý dữ liệu từ CSV ---
 print("--- BẮT ĐẦU CHUẨN BỊ DỮ LIỆU BM25 ---")
 print(f"1. Đang tải dữ liệu từ {DATA_FILE}...")
-loader = CSVLoader(file_path=DATA_FILE, encoding='utf-8')
-documents = loader.load()
+# Cùng định dạng text với CSVLoader, nhưng giữ các cột thành field (BM25F + lọc facet)
+with open(DATA_FILE, 'r', encoding='utf-8') as f:
+    documents = [row_to_document(row, DATA_FILE, i) for i, row in enumerate(csv.DictReader(f))]
 print(f"-> Đã tải {len(documents)} documents từ CSV.")
 
 # --- 2. Tải dữ liệu từ Hanoi.md ---
@@ -33,17 +39,22 @@ else:
 
 print(f"-> Tổng cộng: {len(documents)} documents.")
 
-# (Tùy chọn) Nếu bạn muốn dùng PyViTokenizer để tách từ tiếng Việt cho BM25:
-# from pyvi import ViTokenizer
-# for doc in documents:
-#     doc.page_content = ViTokenizer.tokenize(doc.page_content)
-# print("-> Đã Tokenize tiếng Việt (nếu bật).")
+# Tách từ tiếng Việt (NFC, bỏ dấu song song, bigram âm tiết) được chạy một lần
+# bên trong BM25Index.build - xem retrieval/vietnameseTokenizer.py.
 
 
-# --- 3. Lưu trữ Documents xuống đĩa ---
-print(f"3. Đang lưu trữ Documents vào file '{DOCUMENTS_PICKLE_FILE}'...")
-with open(DOCUMENTS_PICKLE_FILE, 'wb') as f:
-    pickle.dump(documents, f)
+# --- 3. Build index BM25 và lưu xuống đĩa ---
+# Vocabulary, postings, độ dài documents và text được tính một lần lúc build image,
+# server chỉ cần mmap file này khi khởi động.
+# Dữ liệu mới sau này thêm bằng update_index.py (segment mới), không cần chạy lại file này.
+print(f"3. Đang build index và lưu vào thư mục '{RETRIEVAL_INDEX_DIR}'...")
+index = SegmentedIndex.create(
+    RETRIEVAL_INDEX_DIR,
+    texts=[doc.page_content for doc in documents],
+    metadatas=[doc.metadata for doc in documents],
+    dense=BUILD_DENSE_INDEX,
+)
+print(f"-> Index có {index.n_docs} documents (dense: {index.has_dense}).")
 
 print("--- HOÀN THÀNH CHUẨN BỊ DỮ LIỆU ---")
-print(f"Documents đã được lưu thành công tại file: {DOCUMENTS_PICKLE_FILE}")
\ No newline at end of file
+print(f"Index đã được lưu thành công tại thư mục: {RETRIEVAL_INDEX_DIR}")
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Response Profile
+Chọn độ dài câu trả lời (max_output_tokens + hướng dẫn độ dài trong prompt) theo loại câu hỏi.
+
+Thời gian generate chiếm phần lớn latency và tỷ lệ với số token sinh ra: câu "ngày mai tôi có
+kế hoạch gì" không cần cùng ngân sách 800 token với "lịch trình Sapa 3 ngày". Phân loại cục bộ
+(Aho-Corasick trên âm tiết, không gọi model) thành:
+- refusal: chủ đề ngoài phạm vi mà intent router chưa đủ tin cậy để tự trả lời
+- itinerary: lịch trình nhiều ngày / theo buổi
+- factual: tra cứu 1 thông tin (ở đâu, mấy giờ, giá vé, kế hoạch/ngày sinh của người dùng)
+- recommendation: gợi ý (mặc định, giữ ngân sách cũ 800 token); "ở đâu"/"là gì" kèm từ đánh giá
+  ("Ăn phở ở đâu ngon nhất?", "Hẹn hò ở đâu lãng mạn?") là xin gợi ý, không phải tra cứu
+
+Đo độ chính xác: python benchmark_response_profile.py (dữ liệu response_profile_testdata.csv)
+
+Hướng dẫn độ dài đi kèm để model tự kết thúc trước giới hạn thay vì bị cắt giữa câu.
+"""
+from collections import Counter
+from typing import Dict, NamedTuple
+
+from intentRouter import has_diacritics, keyword_groups
+from keywordMatcher import KeywordMatcher
+
+
+class ResponseProfile(NamedTuple):
+    name: str
+    max_output_tokens: int
+    instruction: str   # điền vào {answer_style} của prompt
+
+
+RESPONSE_PROFILES: Dict[str, ResponseProfile] = {
+    profile.name: profile for profile in [
+        ResponseProfile("factual", 320, "Ngắn gọn, đi thẳng vào thông tin được hỏi (1-3 câu)."),
+        ResponseProfile("recommendation", 800, "Gợi ý 3-5 lựa chọn phù hợp, mỗi lựa chọn 1-2 câu."),
+        ResponseProfile("itinerary", 1200, "Lịch trình theo từng ngày/buổi, mỗi mục 1 gạch đầu dòng ngắn."),
+        ResponseProfile("refusal", 128, "Chỉ 1 câu từ chối lịch sự theo mẫu ở phần PHẠM VI."),
+    ]
+}
+DEFAULT_PROFILE = "recommendation"
+
+# Thứ tự ưu tiên khi câu khớp nhiều loại: "nên đi đâu 3 ngày" là lịch trình, "nên ăn ở đâu" là gợi ý
+PROFILE_KEYWORDS = {
+    "itinerary": [
+        "lịch trình", "hành trình", "tour", "đi mấy ngày", "nên đi mấy ngày", "kế hoạch chi tiết",
+        "ngày đầu", "ngày thứ hai", "cuối tuần đi đâu",
+    ],
+    "recommendation": [
+        "gợi ý", "nên", "tặng gì", "quà gì", "quà", "ăn gì", "chơi gì", "đi đâu", "chỗ nào",
+        "địa điểm nào", "món nào", "tư vấn", "có gì", "như thế nào", "thế nào",
+    ],
+    "factual": [
+        "ở đâu", "mấy giờ", "giờ nào", "lúc nào", "khi nào", "bao giờ", "ngày nào", "bao nhiêu",
+        "bao xa", "bao lâu", "giá vé", "giá bao nhiêu", "có không", "có phải", "tên gì", "là gì",
+        "năm nào", "kế hoạch gì", "có kế hoạch", "có lịch", "ngày sinh", "sinh nhật",
+    ],
+}
+# Từ đánh giá: câu hỏi mở ("ở đâu", "là gì") có các từ này là xin gợi ý nhiều lựa chọn
+EVALUATIVE_KEYWORDS = [
+    "ngon", "đẹp", "lãng mạn", "nhất", "nổi tiếng", "rẻ", "chill", "yên tĩnh", "hấp dẫn", "thú vị", "đáng đi",
+]
+# Từ khóa factual chỉ là câu hỏi mở, không phải tra cứu 1 thông tin cụ thể (khác "mấy giờ", "giá vé")
+_OPEN_QUESTIONS = {"ở đâu", "là gì"}
+_PRIORITY = ("itinerary", "recommendation", "factual")
+_DAY_UNITS = {"ngày", "đêm", "ngay", "dem"}
+# Câu hỏi có/không ("... có mở cửa không?") chỉ cần trả lời ngắn
+_YES_NO_ENDINGS = {"không", "chưa", "khong", "chua"}
+
+
+def _build_matcher(fold: bool) -> KeywordMatcher:
+    keywords = [(phrase, name) for name, phrases in PROFILE_KEYWORDS.items() for phrase in phrases]
+    keywords += [(phrase, "evaluative") for phrase in EVALUATIVE_KEYWORDS]
+    return KeywordMatcher(keywords, fold=fold)
+
+
+_MATCHERS = {False: _build_matcher(fold=False), True: _build_matcher(fold=True)}
+
+
+class QuestionClassifier:
+    """Chọn ResponseProfile cho từng câu hỏi đi qua LLM"""
+
+    def __init__(self, profiles: Dict[str, ResponseProfile] = RESPONSE_PROFILES):
+        self.profiles = profiles
+        self.counts = Counter()
+
+    def classify(self, message: str) -> ResponseProfile:
+        name = self._classify(message)
+        self.counts[name] += 1
+        return self.profiles[name]
+
+    def _classify(self, message: str) -> str:
+        groups = keyword_groups(message)
+        kinds = {kind for kind, _ in groups}
+        if "topic" in kinds and "in_scope" not in kinds:
+            return "refusal"
+        matcher = _MATCHERS[not has_diacritics(message)]
+        syllables = matcher.tokens(message)
+        # "3 ngày 2 đêm", "2 ngày" → lịch trình nhiều ngày
+        if any(a.isdigit() and b in _DAY_UNITS for a, b in zip(syllables, syllables[1:])):
+            return "itinerary"
+        matches = matcher.find_all(message)
+        matched = {match.value for match in matches}
+        factual_phrases = {match.phrase for match in matches if match.value == "factual"}
+        if "evaluative" in matched and factual_phrases and factual_phrases <= _OPEN_QUESTIONS:
+            matched.add("recommendation")
+        for name in _PRIORITY:
+            if name in matched:
+                return name
+        if syllables and syllables[-1] in _YES_NO_ENDINGS:
+            return "factual"
+        return DEFAULT_PROFILE
+
+    def get_stats(self) -> dict:
+        total = sum(self.counts.values())
+        return {
+            "total": total,
+            "by_class": dict(self.counts),
+            "max_output_tokens": {name: profile.max_output_tokens for name, profile in self.profiles.items()},
+        }
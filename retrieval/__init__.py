@@ -0,0 +1 @@
+# Retrieval package
@@ -0,0 +1,648 @@
+"""
+BM25 Index
+Inverted index BM25 lưu dưới dạng sparse NumPy arrays (CSR theo term)
+để chấm điểm query bằng phép nhân sparse vector hóa thay vì duyệt từng document.
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from retrieval.denseIndex import DenseIndex
+from retrieval.facets import DEFAULT_FIELD, FACET_FIELDS, FIELD_WEIGHTS, FacetIndex, document_fields, resolve_filters
+from retrieval.vietnameseTokenizer import tokenize_document, tokenize_query
+
+
+def default_tokenizer(text: str) -> List[str]:
+    """Tách từ mặc định: lowercase + tách theo khoảng trắng (giống BM25Retriever)"""
+    return text.lower().split()
+
+
+# Tokenizer được lưu theo tên trong file index để query path dùng lại đúng tokenizer lúc build
+# Mỗi tokenizer gồm (hàm cho document, hàm cho query)
+TOKENIZERS: Dict[str, Tuple[Callable[[str], Sequence[str]], Callable[[str], Sequence[str]]]] = {
+    "whitespace": (default_tokenizer, default_tokenizer),
+    "vi": (tokenize_document, tokenize_query),
+}
+DEFAULT_TOKENIZER = "vi"
+
+
+class BM25Index:
+    """
+    Inverted index BM25 dạng CSR:
+    - indptr[t]:indptr[t+1] là khoảng postings của term t
+    - postings: doc ids (sắp xếp tăng dần trong mỗi term)
+    - tf_weights: phần tf BM25F đã bão hòa (tf từng field nhân trọng số field, chuẩn hóa
+      theo độ dài field), tính sẵn lúc build
+    - idf: idf của từng term
+    - term_max_weights[t]: max tf_weights trên postings của term t (chặn trên cho MaxScore)
+    - facets: bitmap các cột có cấu trúc (retrieval/facets.py) để lọc trước khi chấm điểm
+    - dense: embedding + IVF cục bộ (retrieval/denseIndex.py) cho hybrid retrieval (optional)
+
+    Điểm BM25 của query = tổng idf[t] * qtf[t] * tf_weights trên postings của các term,
+    gom theo doc id bằng np.bincount. Corpus lớn thì top_k dùng MaxScore để bỏ qua postings
+    của các term phổ biến không thể đưa document vào top-k.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        indptr: np.ndarray,
+        postings: np.ndarray,
+        tf_weights: np.ndarray,
+        idf: np.ndarray,
+        doc_lens: np.ndarray,
+        texts: Sequence[str],
+        metadatas: Sequence[dict],
+        k1: float = 1.5,
+        b: float = 0.75,
+        tokenizer_name: str = DEFAULT_TOKENIZER,
+        term_max_weights: Optional[np.ndarray] = None,
+        facets: Optional[FacetIndex] = None,
+        dense: Optional[DenseIndex] = None,
+    ):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings = postings
+        self.tf_weights = tf_weights
+        self.idf = idf
+        self.doc_lens = doc_lens
+        self.texts = texts
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.tokenizer_name = tokenizer_name
+        self.document_tokenizer, self.query_tokenizer = TOKENIZERS[tokenizer_name]
+        self._term_max_weights = term_max_weights
+        self.facets = facets
+        self.dense = dense
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_lens)
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def term_max_weights(self) -> np.ndarray:
+        """Chặn trên tf_weights của từng term (file index cũ không có section này thì tính lại)"""
+        if self._term_max_weights is None:
+            self._term_max_weights = compute_term_max_weights(self.indptr, self.tf_weights)
+        return self._term_max_weights
+
+    @classmethod
+    def build(
+        cls,
+        texts: Iterable[str],
+        metadatas: Optional[Iterable[dict]] = None,
+        tokenizer_name: str = DEFAULT_TOKENIZER,
+        k1: float = 1.5,
+        b: float = 0.75,
+        dense: bool = False,
+    ) -> "BM25Index":
+        """
+        Build index từ danh sách texts.
+
+        Documents có metadata["fields"] (dòng dulieu.csv) được chấm điểm BM25F: tf của mỗi field
+        nhân FIELD_WEIGHTS và chuẩn hóa theo độ dài trung bình của field đó. Documents không có
+        field là 1 field duy nhất → đúng công thức BM25 thường.
+
+        Args:
+            texts: Nội dung các documents
+            metadatas: Metadata tương ứng (optional)
+            tokenizer_name: Tên tokenizer trong TOKENIZERS, dùng chung cho documents và query
+            k1, b: Tham số BM25
+            dense: Build thêm DenseIndex cho hybrid retrieval
+
+        Returns:
+            BM25Index đã build xong
+        """
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        tokenizer = TOKENIZERS[tokenizer_name][0]
+
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_lens = np.zeros(len(texts), dtype=np.float32)
+        # Mỗi "chunk" là 1 field của 1 document
+        chunk_docs: List[int] = []
+        chunk_fields: List[str] = []
+        chunk_lens: List[int] = []
+
+        for doc_id, (text, metadata) in enumerate(zip(texts, metadatas)):
+            for field, field_text in document_fields(text, metadata).items():
+                tokens = tokenizer(field_text)
+                for token in tokens:
+                    term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                chunk_docs.append(doc_id)
+                chunk_fields.append(field)
+                chunk_lens.append(len(tokens))
+                doc_lens[doc_id] += len(tokens)
+
+        chunk_lens_arr = np.asarray(chunk_lens, dtype=np.int64)
+        occurrence_weights = np.repeat(
+            _field_occurrence_weights(chunk_fields, chunk_lens_arr, b, float(doc_lens.mean()) if len(texts) else 0.0),
+            chunk_lens_arr,
+        )
+        indptr, postings, tfs = _group_postings(
+            np.asarray(term_ids, dtype=np.int64),
+            np.repeat(np.asarray(chunk_docs, dtype=np.int64), chunk_lens_arr),
+            len(vocabulary),
+            occurrence_weights,
+        )
+
+        tf_weights = _saturate_tf(tfs, k1)
+        idf = compute_idf(np.diff(indptr), len(texts))
+
+        return cls(
+            vocabulary=vocabulary,
+            indptr=indptr,
+            postings=postings,
+            tf_weights=tf_weights,
+            idf=idf,
+            doc_lens=doc_lens,
+            texts=texts,
+            metadatas=metadatas,
+            k1=k1,
+            b=b,
+            tokenizer_name=tokenizer_name,
+            term_max_weights=compute_term_max_weights(indptr, tf_weights),
+            facets=FacetIndex.build(metadatas),
+            dense=DenseIndex.build(texts) if dense else None,
+        )
+
+    def term_ids_for(self, tokens: Sequence[str]) -> np.ndarray:
+        """Term id của từng token (-1 nếu token không có trong vocabulary)"""
+        return np.fromiter(
+            (self.vocabulary.get(token, -1) for token in tokens), dtype=np.int64, count=len(tokens)
+        )
+
+    def document_frequencies(self, term_ids: np.ndarray) -> np.ndarray:
+        """Số documents chứa mỗi term (0 với term id -1)"""
+        valid = term_ids >= 0
+        df = np.zeros(len(term_ids), dtype=np.int64)
+        df[valid] = self.indptr[term_ids[valid] + 1] - self.indptr[term_ids[valid]]
+        return df
+
+    def query_terms(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Chuyển query thành (term ids, query term frequencies), bỏ các term ngoài vocabulary"""
+        tokens, qtf = count_query_tokens(self.query_tokenizer(query))
+        term_ids = self.term_ids_for(tokens)
+        valid = term_ids >= 0
+        return term_ids[valid], qtf[valid]
+
+    def query_token_weights(self, query: str) -> Tuple[List[str], np.ndarray]:
+        """Tokens (không trùng) của query + trọng số idf * qtf (0 với token ngoài vocabulary)"""
+        tokens, qtf = count_query_tokens(self.query_tokenizer(query))
+        df = self.document_frequencies(self.term_ids_for(tokens))
+        return tokens, np.where(df > 0, compute_idf(df, self.n_docs) * qtf, 0.0)
+
+    def score_terms(self, term_ids: np.ndarray, term_weights: np.ndarray) -> np.ndarray:
+        """
+        Nhân sparse: tổng term_weights[t] * tf_weights trên postings của các term.
+
+        Args:
+            term_ids: Term ids (hợp lệ) của query
+            term_weights: Trọng số từng term (thường là idf * qtf)
+
+        Returns:
+            Dense vector điểm, độ dài n_docs
+        """
+        if len(term_ids) == 0:
+            return np.zeros(self.n_docs, dtype=np.float64)
+
+        starts = self.indptr[term_ids]
+        ends = self.indptr[term_ids + 1]
+        lengths = ends - starts
+
+        # Gom postings của các term trong query thành 1 mảng liên tục
+        positions = _concat_ranges(starts, lengths)
+        weights = np.repeat(np.asarray(term_weights, dtype=np.float32), lengths)
+        contributions = self.tf_weights[positions] * weights
+
+        return np.bincount(self.postings[positions], weights=contributions, minlength=self.n_docs)
+
+    def score_terms_batch(
+        self, term_ids_list: Sequence[np.ndarray], term_weights_list: Sequence[np.ndarray]
+    ) -> np.ndarray:
+        """
+        Nhân ma trận sparse (queries x terms) x (terms x documents) cho nhiều query cùng lúc.
+
+        Postings của tất cả query được gom vào 1 mảng với chỉ số phẳng = hàng * n_docs + doc id,
+        rồi 1 lần np.bincount cho ra ma trận điểm (n_queries, n_docs).
+        """
+        n_queries = len(term_ids_list)
+        if n_queries == 1:
+            return self.score_terms(term_ids_list[0], term_weights_list[0])[np.newaxis, :]
+        if n_queries == 0 or not any(len(ids) for ids in term_ids_list):
+            return np.zeros((n_queries, self.n_docs), dtype=np.float64)
+
+        term_ids = np.concatenate(term_ids_list).astype(np.int64, copy=False)
+        term_weights = np.concatenate(term_weights_list).astype(np.float32, copy=False)
+        # Offset hàng của từng term trong ma trận phẳng
+        row_offsets = np.repeat(
+            np.arange(n_queries, dtype=np.int64) * self.n_docs,
+            [len(ids) for ids in term_ids_list],
+        )
+
+        starts = self.indptr[term_ids]
+        lengths = self.indptr[term_ids + 1] - starts
+        positions = _concat_ranges(starts, lengths)
+        contributions = self.tf_weights[positions] * np.repeat(term_weights, lengths)
+        flat = self.postings[positions] + np.repeat(row_offsets, lengths)
+        scores = np.bincount(flat, weights=contributions, minlength=n_queries * self.n_docs)
+        return scores.reshape(n_queries, self.n_docs)
+
+    def score_candidates(
+        self, term_ids: np.ndarray, term_weights: np.ndarray, doc_ids: np.ndarray
+    ) -> np.ndarray:
+        """
+        Điểm của các term cho 1 tập documents nhỏ: tra từng doc trong postings (đã sắp xếp)
+        bằng np.searchsorted thay vì đọc hết postings của term.
+        """
+        scores = np.zeros(len(doc_ids), dtype=np.float64)
+        if len(doc_ids) == 0:
+            return scores
+        # Cùng dtype với postings để searchsorted không phải ép kiểu cả đoạn postings
+        doc_ids = np.asarray(doc_ids, dtype=self.postings.dtype)
+        for term_id, weight in zip(term_ids, term_weights):
+            start, end = int(self.indptr[term_id]), int(self.indptr[term_id + 1])
+            term_postings = self.postings[start:end]
+            positions = np.minimum(np.searchsorted(term_postings, doc_ids), end - start - 1)
+            found = term_postings[positions] == doc_ids
+            scores[found] += weight * self.tf_weights[start + positions[found]]
+        return scores
+
+    def top_k_terms(
+        self,
+        term_ids: np.ndarray,
+        term_weights: np.ndarray,
+        k: int,
+        threshold: float = 0.0,
+        deleted_mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Top-k theo MaxScore (kết quả giống chấm điểm toàn bộ; mọi bước nhân trọng số float32 như
+        score_terms, so ngưỡng nới PRUNING_TOLERANCE để sai số cộng dồn không loại document đúng bằng ngưỡng):
+        1. Chấm điểm đầy đủ các documents của term có chặn trên cao nhất → ngưỡng = điểm thứ k
+        2. Các term có tổng chặn trên < ngưỡng là "không thiết yếu": document chỉ chứa
+           các term này không thể vào top-k → chỉ gom postings của term thiết yếu
+        3. Cộng điểm term không thiết yếu cho các ứng viên còn khả năng vượt ngưỡng,
+           loại dần ứng viên sau mỗi term
+
+        Args:
+            threshold: Điểm thứ k đã biết từ nơi khác (segment trước), 0 nếu chưa có
+            deleted_mask: Documents đã xóa (bị loại khỏi kết quả)
+        """
+        lengths = self.indptr[term_ids + 1] - self.indptr[term_ids]
+        if k <= 0 or len(term_ids) < 2 or int(lengths.sum()) < PRUNING_MIN_POSTINGS:
+            scores = self.score_terms(term_ids, term_weights)
+            if deleted_mask is not None:
+                scores[deleted_mask] = 0.0
+            return select_top_k(scores, k)
+
+        term_weights = np.asarray(term_weights, dtype=np.float32)
+        upper = term_weights.astype(np.float64) * self.term_max_weights[term_ids]
+
+        # 1. Ngưỡng ban đầu: điểm thứ k (chỉ tính các term có chặn trên cao nhất, thường là term
+        # hiếm, postings ngắn). Điểm một phần <= điểm thật nên đây là cận dưới hợp lệ của top-k.
+        by_upper = np.argsort(-upper, kind="stable")
+        seed = by_upper[:int(np.searchsorted(np.cumsum(lengths[by_upper]), k)) + 1]
+        _, seed_scores = self._partial_scores(term_ids[seed], term_weights[seed], deleted_mask)
+        threshold = max(threshold, _kth_largest(seed_scores, k))
+
+        # 2. Tách term thiết yếu / không thiết yếu theo tổng chặn trên tăng dần
+        ascending = np.argsort(upper, kind="stable")
+        prefix_upper = np.cumsum(upper[ascending])
+        n_optional = int(np.searchsorted(prefix_upper, _pruning_cutoff(threshold), side="left"))
+        if n_optional == 0:
+            scores = self.score_terms(term_ids, term_weights)
+            if deleted_mask is not None:
+                scores[deleted_mask] = 0.0
+            return select_top_k(scores, k)
+
+        # 3. Ứng viên = documents chứa term thiết yếu còn khả năng vượt ngưỡng khi cộng thêm
+        # chặn trên của term không thiết yếu (điểm một phần cũng là cận dưới → nâng ngưỡng trước)
+        essential = ascending[n_optional:]
+        scores = self.score_terms(term_ids[essential], term_weights[essential])
+        if deleted_mask is not None:
+            scores[deleted_mask] = 0.0
+        candidates = np.flatnonzero(
+            (scores > 0) & (scores + prefix_upper[n_optional - 1] >= _pruning_cutoff(threshold))
+        )
+        candidate_scores = scores[candidates]
+        threshold = max(threshold, _kth_largest(candidate_scores, k))
+        keep = candidate_scores + prefix_upper[n_optional - 1] >= _pruning_cutoff(threshold)
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+        for position in range(n_optional - 1, -1, -1):
+            term = ascending[position]
+            candidate_scores += self.score_candidates(term_ids[[term]], term_weights[[term]], candidates)
+            remaining = prefix_upper[position - 1] if position > 0 else 0.0
+            keep = candidate_scores + remaining >= _pruning_cutoff(threshold)
+            candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+
+        return [
+            (int(candidates[i]), float(candidate_scores[i]))
+            for i, _ in select_top_k(candidate_scores, k)
+        ]
+
+    def _partial_scores(
+        self, term_ids: np.ndarray, term_weights: np.ndarray, deleted_mask: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Điểm chỉ tính các term cho trước, dạng sparse: (doc ids có postings, điểm tương ứng)"""
+        lengths = self.indptr[term_ids + 1] - self.indptr[term_ids]
+        positions = _concat_ranges(self.indptr[term_ids], lengths)
+        doc_ids = self.postings[positions]
+        contributions = self.tf_weights[positions] * np.repeat(term_weights, lengths)
+        if deleted_mask is not None:
+            alive = ~deleted_mask[doc_ids]
+            doc_ids, contributions = doc_ids[alive], contributions[alive]
+        unique_docs, inverse = np.unique(doc_ids, return_inverse=True)
+        return unique_docs, np.bincount(inverse, weights=contributions, minlength=len(unique_docs))
+
+    def top_k_batch_terms(
+        self,
+        term_ids_list: Sequence[np.ndarray],
+        term_weights_list: Sequence[np.ndarray],
+        k: int,
+        deleted_mask: Optional[np.ndarray] = None,
+        thresholds: Optional[Sequence[float]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k cho nhiều query đã chuyển thành term ids/trọng số.
+        Corpus nhỏ: gộp query thành block chấm điểm 1 lần; corpus lớn: từng query qua MaxScore.
+        """
+        results: List[List[Tuple[int, float]]] = []
+        for start, end in batch_blocks(len(term_ids_list), self.n_docs):
+            if end - start == 1:
+                threshold = thresholds[start] if thresholds is not None else 0.0
+                results.append(self.top_k_terms(
+                    term_ids_list[start], term_weights_list[start], k, threshold, deleted_mask
+                ))
+                continue
+            scores = self.score_terms_batch(term_ids_list[start:end], term_weights_list[start:end])
+            if deleted_mask is not None:
+                scores[:, deleted_mask] = 0.0
+            results.extend(select_top_k_batch(scores, k))
+        return results
+
+    def known_facet_values(self) -> Dict[str, List[str]]:
+        """field -> các giá trị facet (đã chuẩn hóa) có trong index"""
+        if self.facets is None:
+            return {}
+        return {field: self.facets.values(field) for field in FACET_FIELDS}
+
+    def has_facet_match(self, filters: Dict[str, List[str]]) -> bool:
+        """Có document nào khớp thật sự bộ lọc không (không tính documents thiếu field)"""
+        return self.facets is not None and bool(self.facets.match(filters).any())
+
+    def allowed_mask(
+        self, filters: Dict[str, List[str]], deleted_mask: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Documents qua bộ lọc facet và chưa bị xóa"""
+        if self.facets is None:
+            allowed = np.ones(self.n_docs, dtype=bool)
+        else:
+            allowed = self.facets.allowed(filters)
+        if deleted_mask is not None:
+            allowed &= ~deleted_mask
+        return allowed
+
+    def top_k_allowed(
+        self,
+        term_ids: np.ndarray,
+        term_weights: np.ndarray,
+        k: int,
+        allowed: np.ndarray,
+        threshold: float = 0.0,
+    ) -> List[Tuple[int, float]]:
+        """
+        Top-k chỉ trong các documents được phép (đã lọc facet).
+        Tập nhỏ: tra điểm trực tiếp từng document (không đọc hết postings);
+        tập lớn: MaxScore với documents ngoài tập coi như đã xóa.
+        """
+        allowed_ids = np.flatnonzero(allowed)
+        if len(allowed_ids) * SUBSET_SCORING_RATIO <= self.n_docs:
+            scores = self.score_candidates(term_ids, term_weights, allowed_ids)
+            return [(int(allowed_ids[i]), score) for i, score in select_top_k(scores, k)]
+        return self.top_k_terms(term_ids, term_weights, k, threshold, ~allowed)
+
+    def top_k_batch(
+        self,
+        queries: Sequence[str],
+        k: int,
+        filters: Optional[Sequence[Optional[Dict[str, List[str]]]]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k cho nhiều query; chia block để ma trận điểm không vượt MAX_BATCH_CELLS.
+
+        Args:
+            filters: Bộ lọc facet cho từng query (None = tự nhận diện từ query, {} = không lọc).
+                     Lọc không ra kết quả nào thì chấm điểm lại trên toàn bộ index.
+        """
+        term_ids_list, weights_list = [], []
+        for query in queries:
+            term_ids, qtf = self.query_terms(query)
+            term_ids_list.append(term_ids)
+            weights_list.append(self.idf[term_ids] * qtf)
+
+        results: List[List[Tuple[int, float]]] = [[] for _ in queries]
+        known_values = self.known_facet_values()
+        unfiltered = []
+        for row, query in enumerate(queries):
+            query_filters = resolve_filters(query, filters[row] if filters else None, known_values)
+            if query_filters and self.has_facet_match(query_filters):
+                results[row] = self.top_k_allowed(
+                    term_ids_list[row], weights_list[row], k, self.allowed_mask(query_filters)
+                )
+            if not results[row]:
+                unfiltered.append(row)
+
+        hits = self.top_k_batch_terms(
+            [term_ids_list[row] for row in unfiltered], [weights_list[row] for row in unfiltered], k
+        )
+        for row, row_hits in zip(unfiltered, hits):
+            results[row] = row_hits
+        return results
+
+    def score(self, query: str) -> np.ndarray:
+        """Tính điểm BM25 của query cho toàn bộ documents (dense vector độ dài n_docs)"""
+        term_ids, qtf = self.query_terms(query)
+        return self.score_terms(term_ids, self.idf[term_ids] * qtf)
+
+    def top_k(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Lấy top-k (doc_id, score) có điểm > 0, sắp xếp giảm dần (có lọc facet tự động)"""
+        return self.top_k_batch([query], k)[0]
+
+    def dense_top_k(
+        self, query: str, k: int, deleted_mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """Top-k (doc_id, cosine) theo DenseIndex; [] nếu index không có phần dense"""
+        if self.dense is None:
+            return []
+        return self.dense.search(query, k, excluded=deleted_mask)
+
+    def document(self, doc_id: int) -> Tuple[str, dict]:
+        """Lấy (text, metadata) của document"""
+        return self.texts[doc_id], dict(self.metadatas[doc_id])
+
+
+# Giới hạn số ô của ma trận điểm (n_queries x n_docs) trong 1 block (~256KB float64) để
+# np.bincount ghi ngẫu nhiên vẫn nằm trong cache. Gộp query lợi nhất với corpus nhỏ (bớt overhead
+# mỗi lần gọi NumPy); corpus lớn hơn MAX_BATCH_CELLS thì mỗi block chỉ còn 1 query.
+MAX_BATCH_CELLS = 32_768
+
+
+# Tập documents sau lọc facet nhỏ hơn n_docs / SUBSET_SCORING_RATIO thì tra điểm trực tiếp
+SUBSET_SCORING_RATIO = 8
+
+# Dưới ngưỡng tổng postings này thì chấm điểm toàn bộ luôn nhanh hơn MaxScore
+# (các bước tách term / tra searchsorted có overhead cố định)
+PRUNING_MIN_POSTINGS = 50_000
+# Sai số tương đối cho phép khi so điểm với ngưỡng MaxScore: điểm là tổng các tích float32
+# cộng theo thứ tự khác nhau giữa các bước, chặn trên tính bằng float64
+PRUNING_TOLERANCE = 1e-5
+
+
+def batch_blocks(n_queries: int, n_docs: int) -> List[Tuple[int, int]]:
+    """Chia n_queries thành các block [start, end) sao cho block * n_docs <= MAX_BATCH_CELLS"""
+    rows = max(1, MAX_BATCH_CELLS // max(n_docs, 1))
+    return [(start, min(start + rows, n_queries)) for start in range(0, n_queries, rows)]
+
+
+def count_query_tokens(tokens: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    """Gom token trùng trong query: (tokens duy nhất, query term frequencies)"""
+    counts: Dict[str, int] = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return list(counts.keys()), np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+
+
+def _group_postings(
+    term_ids: np.ndarray,
+    doc_ids: np.ndarray,
+    n_terms: int,
+    occurrence_weights: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gom các cặp (term, doc) thành postings CSR + term frequency.
+    Có occurrence_weights thì tf = tổng trọng số các lần xuất hiện (tf BM25F) thay vì số lần.
+    """
+    if len(term_ids) == 0:
+        return (
+            np.zeros(n_terms + 1, dtype=np.int64),
+            np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=np.float32),
+        )
+    if occurrence_weights is None:
+        occurrence_weights = np.ones(len(term_ids), dtype=np.float64)
+
+    order = np.lexsort((doc_ids, term_ids))
+    term_ids = term_ids[order]
+    doc_ids = doc_ids[order]
+
+    # Đánh dấu vị trí bắt đầu của mỗi cặp (term, doc) khác nhau
+    is_new = np.ones(len(term_ids), dtype=bool)
+    is_new[1:] = (term_ids[1:] != term_ids[:-1]) | (doc_ids[1:] != doc_ids[:-1])
+    starts = np.flatnonzero(is_new)
+    tfs = np.add.reduceat(occurrence_weights[order], starts).astype(np.float32)
+
+    unique_terms = term_ids[starts]
+    postings = doc_ids[starts].astype(np.int32)
+    indptr = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(unique_terms, minlength=n_terms), out=indptr[1:])
+    return indptr, postings, tfs
+
+
+def _field_occurrence_weights(
+    fields: Sequence[str], lengths: np.ndarray, b: float, avg_doc_len: float
+) -> np.ndarray:
+    """
+    Trọng số của 1 lần xuất hiện term trong mỗi field:
+    FIELD_WEIGHTS[field] / (1 - b + b * độ dài field / độ dài trung bình của field đó)
+
+    Field DEFAULT_FIELD (document không cấu trúc) so với độ dài trung bình của cả document
+    để đoạn văn dài vẫn bị chuẩn hóa như BM25 thường khi trộn với các dòng CSV.
+    """
+    fields = np.asarray(fields, dtype=object)
+    weights = np.ones(len(fields), dtype=np.float64)
+    for field in set(fields.tolist()):
+        in_field = fields == field
+        avg_len = avg_doc_len if field == DEFAULT_FIELD else float(lengths[in_field].mean())
+        avg_len = max(avg_len, 1e-9)
+        norm = 1.0 - b + b * lengths[in_field] / avg_len
+        weights[in_field] = FIELD_WEIGHTS.get(field, 1.0) / norm
+    return weights
+
+
+def _saturate_tf(tfs: np.ndarray, k1: float) -> np.ndarray:
+    """Bão hòa tf (đã chuẩn hóa độ dài): tf * (k1 + 1) / (tf + k1)"""
+    return (tfs * (k1 + 1.0) / (tfs + k1)).astype(np.float32)
+
+
+def compute_term_max_weights(indptr: np.ndarray, tf_weights: np.ndarray) -> np.ndarray:
+    """Max tf_weights trên postings của từng term (0 với term không có postings)"""
+    n_terms = len(indptr) - 1
+    max_weights = np.zeros(n_terms, dtype=np.float32)
+    non_empty = np.flatnonzero(np.diff(indptr) > 0)
+    if len(non_empty):
+        max_weights[non_empty] = np.maximum.reduceat(tf_weights, indptr[non_empty])
+    return max_weights
+
+
+def compute_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    """IDF dạng Lucene (luôn dương): log(1 + (N - df + 0.5) / (df + 0.5))"""
+    df = df.astype(np.float64)
+    return np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+
+def _concat_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Tạo mảng chỉ số nối liền các khoảng [start, start + length) mà không cần vòng lặp Python"""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total, dtype=np.int64)
+
+
+def _pruning_cutoff(threshold: float) -> float:
+    """Ngưỡng đã nới PRUNING_TOLERANCE: document có điểm >= giá trị này chưa bị loại"""
+    return threshold - abs(threshold) * PRUNING_TOLERANCE
+
+
+def _kth_largest(values: np.ndarray, k: int) -> float:
+    """Giá trị lớn thứ k (0 nếu chưa đủ k phần tử)"""
+    if k <= 0 or len(values) < k:
+        return 0.0
+    return float(np.partition(values, len(values) - k)[len(values) - k])
+
+
+def select_top_k(scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """Chọn top-k bằng argpartition (O(n)) rồi chỉ sort k phần tử"""
+    if k <= 0 or len(scores) == 0:
+        return []
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(doc_id), float(scores[doc_id])) for doc_id in candidates if scores[doc_id] > 0]
+
+
+def select_top_k_batch(scores: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+    """select_top_k cho từng hàng của ma trận điểm, argpartition theo axis=1"""
+    n_queries, n_docs = scores.shape
+    if k <= 0 or n_docs == 0:
+        return [[] for _ in range(n_queries)]
+    k = min(k, n_docs)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < n_docs else np.tile(np.arange(n_docs), (n_queries, 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+    return [
+        [(int(doc_id), float(score)) for doc_id, score in zip(row_ids, row_scores) if score > 0]
+        for row_ids, row_scores in zip(candidates, candidate_scores)
+    ]
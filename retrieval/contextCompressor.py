@@ -0,0 +1,85 @@
+"""
+Context Compressor
+Rút gọn document dài trước khi đưa vào prompt: chấm điểm từng câu theo query bằng BM25
+dùng lại thống kê của retrieval index (idf toàn cục + tokenizer lúc build), chỉ giữ các câu
+liên quan nhất trong ngân sách token.
+
+Nhắm vào các đoạn Hanoi.md dài và mota_chi_tiet đã gộp notes/*.txt (update_dulieu.py):
+cả bài vài nghìn token trong khi câu trả lời chỉ nằm trong vài câu.
+"""
+
+from typing import List
+
+import numpy as np
+
+from retrieval.contextPacker import estimate_tokens, split_sentences
+
+# Document ngắn hơn mức này giữ nguyên (dòng CSV thường ~100-150 token)
+COMPRESS_MIN_TOKENS = 200
+# Số câu đầu luôn giữ (dòng loai/ten của CSV, câu mở đầu đoạn văn) để LLM biết đang nói về gì
+LEAD_SENTENCES = 2
+
+
+class ContextCompressor:
+    """
+    Chọn câu theo điểm BM25 của câu với query.
+
+    Args:
+        index: BM25Index hoặc SegmentedIndex (cần query_token_weights + document_tokenizer)
+        k1, b: Tham số BM25 ở mức câu (chuẩn hóa theo độ dài trung bình các câu trong document)
+    """
+
+    def __init__(
+        self,
+        index,
+        k1: float = 1.2,
+        b: float = 0.75,
+        min_tokens: int = COMPRESS_MIN_TOKENS,
+        lead_sentences: int = LEAD_SENTENCES,
+    ):
+        self.index = index
+        self.k1 = k1
+        self.b = b
+        self.min_tokens = min_tokens
+        self.lead_sentences = lead_sentences
+
+    def score_sentences(self, query: str, sentences: List[str]) -> np.ndarray:
+        """Điểm BM25 của từng câu với query"""
+        tokens, weights = self.index.query_token_weights(query)
+        positions = {token: i for i, token in enumerate(tokens) if weights[i] > 0}
+        scores = np.zeros(len(sentences))
+        if not positions or not sentences:
+            return scores
+
+        tfs = np.zeros((len(sentences), len(tokens)))
+        lengths = np.zeros(len(sentences))
+        for row, sentence in enumerate(sentences):
+            sentence_tokens = self.index.document_tokenizer(sentence)
+            lengths[row] = len(sentence_tokens)
+            for token in sentence_tokens:
+                col = positions.get(token)
+                if col is not None:
+                    tfs[row, col] += 1
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        return (tfs * (self.k1 + 1) / (tfs + norm[:, None])) @ weights
+
+    def select(self, query: str, text: str, budget: int) -> List[str]:
+        """
+        Các câu giữ lại (theo thứ tự gốc) trong budget token: LEAD_SENTENCES câu đầu,
+        sau đó các câu có điểm cao nhất. Không câu nào khớp query thì trả về [].
+        """
+        sentences = split_sentences(text)
+        scores = self.score_sentences(query, sentences)
+        if not scores.any():
+            return []
+
+        lead = range(min(self.lead_sentences, len(sentences)))
+        ranked = [i for i in np.argsort(-scores, kind="stable") if scores[i] > 0 and i >= len(lead)]
+        chosen, used = [], 0
+        for i in list(lead) + ranked:
+            tokens = estimate_tokens(sentences[i])
+            if used + tokens > budget:
+                continue
+            chosen.append(i)
+            used += tokens
+        return [sentences[i] for i in sorted(chosen)]
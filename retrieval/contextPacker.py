@@ -0,0 +1,135 @@
+"""
+Context Packer
+Ghép context cho prompt theo ngân sách token thay vì nhét cố định k documents:
+- Ước lượng token cục bộ (không gọi API count_tokens)
+- Lấy lần lượt các documents điểm cao nhất, còn đủ ngân sách thì lấy nguyên document,
+  không đủ thì lấy câu đầu + các câu trùng nhiều âm tiết với query nhất vừa ngân sách
+- 1 document dài (đoạn Hanoi.md, notes) chiếm tối đa MAX_DOCUMENT_SHARE ngân sách khi còn
+  documents khác đủ điểm phía sau, để câu hỏi cần nhiều documents không bị 1 bài dài chiếm hết
+- Bỏ documents điểm quá thấp so với document đứng đầu (không nhồi nhiễu cho đủ ngân sách)
+- Có compressor (retrieval/contextCompressor.py): document dài chỉ giữ các câu liên quan tới query
+
+Kích thước prompt ổn định → độ trễ Gemini ổn định, mà câu hỏi cần 2-3 dòng dữ liệu vẫn đủ context.
+"""
+
+import math
+import re
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from retrieval.vietnameseTokenizer import fold_diacritics, normalize_text, split_syllables
+
+if TYPE_CHECKING:
+    from retrieval.contextCompressor import ContextCompressor
+
+DEFAULT_TOKEN_BUDGET = 1200
+# Phần còn lại của ngân sách nhỏ hơn mức này thì dừng (đoạn quá ngắn không có ích)
+MIN_SPAN_TOKENS = 40
+# Documents có điểm < MIN_RELATIVE_SCORE * điểm cao nhất bị bỏ
+MIN_RELATIVE_SCORE = 0.35
+MAX_DOCUMENT_SHARE = 0.6
+# Gemini tách tiếng Việt có dấu thành nhiều token hơn tiếng Anh: ~1.4 token / âm tiết hoặc dấu câu
+TOKENS_PER_UNIT = 1.4
+
+_TOKEN_UNIT = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+# Dòng "cột: giá trị" của document CSV (ingestion/csvRowDocument.py)
+_FIELD_LINE = re.compile(r"\n(?=[a-z_]+:\s)")
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token Gemini của text (âm tiết + dấu câu, làm tròn lên)"""
+    return math.ceil(len(_TOKEN_UNIT.findall(text)) * TOKENS_PER_UNIT)
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Tách câu theo dấu kết câu; mỗi dòng "cột: giá trị" của CSV bắt đầu câu mới.
+    Xuống dòng khác (Hanoi.md ngắt dòng giữa câu) chỉ là khoảng trắng.
+    """
+    sentences = []
+    for block in _FIELD_LINE.split(text):
+        sentences.extend(" ".join(part.split()) for part in _SENTENCE_BREAK.split(block))
+    return [sentence for sentence in sentences if sentence]
+
+
+def _syllables(text: str) -> set:
+    return set(split_syllables(fold_diacritics(normalize_text(text))))
+
+
+class ContextPacker:
+    """Chọn documents / đoạn câu cho prompt trong giới hạn token_budget"""
+
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        min_span_tokens: int = MIN_SPAN_TOKENS,
+        min_relative_score: float = MIN_RELATIVE_SCORE,
+        max_document_share: float = MAX_DOCUMENT_SHARE,
+        compressor: Optional["ContextCompressor"] = None,
+    ):
+        self.token_budget = token_budget
+        self.min_span_tokens = min_span_tokens
+        self.min_relative_score = min_relative_score
+        self.max_document_share = max_document_share
+        self.compressor = compressor
+
+    def select_sentences(self, query: str, text: str, budget: int) -> List[str]:
+        """
+        Các câu (theo thứ tự gốc) vừa budget token: câu đầu (tên / loại của document), sau đó các câu
+        trùng nhiều âm tiết với query nhất; cùng độ trùng (kể cả khi không câu nào khớp) thì câu trước trước
+        """
+        sentences = split_sentences(text)
+        query_syllables = _syllables(query)
+        overlaps = [len(query_syllables & _syllables(sentence)) for sentence in sentences]
+        ranked = sorted(range(len(sentences)), key=lambda i: (i > 0, -overlaps[i], i))
+        chosen, used = [], 0
+        for i in ranked:
+            tokens = estimate_tokens(sentences[i])
+            if used + tokens > budget:
+                continue
+            chosen.append(i)
+            used += tokens
+        return [sentences[i] for i in sorted(chosen)]
+
+    def pack(self, query: str, scored_documents: Sequence[Tuple[Document, float]]) -> List[Document]:
+        """
+        Ghép context từ documents đã sắp xếp theo điểm giảm dần.
+
+        Returns:
+            Documents (nguyên vẹn hoặc rút gọn còn các câu vừa ngân sách), metadata có thêm
+            "score" và "context_tokens"
+        """
+        if not scored_documents:
+            return []
+        top_score = scored_documents[0][1]
+        eligible = [
+            (document, score) for position, (document, score) in enumerate(scored_documents)
+            if position == 0 or score >= top_score * self.min_relative_score
+        ]
+        document_cap = int(self.token_budget * self.max_document_share)
+        remaining = self.token_budget
+        packed = []
+        for position, (document, score) in enumerate(eligible):
+            if remaining < self.min_span_tokens:
+                break
+            # Document cuối cùng được dùng hết phần ngân sách còn lại
+            limit = remaining if position == len(eligible) - 1 else min(remaining, document_cap)
+            content = document.page_content
+            tokens = estimate_tokens(content)
+            if self.compressor is not None and tokens > self.compressor.min_tokens:
+                sentences = self.compressor.select(query, content, limit)
+                if sentences:
+                    content = "\n".join(sentences)
+                    tokens = estimate_tokens(content)
+            if tokens > limit:
+                sentences = self.select_sentences(query, content, limit)
+                if not sentences:
+                    continue
+                content = "\n".join(sentences)
+                tokens = estimate_tokens(content)
+            remaining -= tokens
+            metadata = dict(document.metadata, score=round(float(score), 4), context_tokens=tokens)
+            packed.append(Document(page_content=content, metadata=metadata))
+        return packed
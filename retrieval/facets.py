@@ -0,0 +1,189 @@
+"""
+Facets
+Giữ các cột có cấu trúc của dulieu.csv thành field riêng (metadata["fields"]) để:
+- Chấm điểm BM25F: mỗi field có trọng số và chuẩn hóa độ dài riêng (tên địa điểm/món quà quan trọng hơn mô tả)
+- Lọc trước bằng bitmap: query nhắm rõ quà tặng (loai=qua_tang) hoặc 1 tỉnh/thương hiệu
+  chỉ chấm điểm các documents khớp
+
+Documents không có field (đoạn văn Hanoi.md, notes) coi như "không rõ" và luôn qua bộ lọc.
+"""
+
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from retrieval.vietnameseTokenizer import fold_diacritics, normalize_text, split_syllables
+
+# Field mặc định cho documents không có cấu trúc (chấm điểm như BM25 thường)
+DEFAULT_FIELD = "content"
+
+# Trọng số BM25F của từng field (field không có trong bảng: 1.0)
+FIELD_WEIGHTS = {
+    "ten": 3.0,
+    "tinh_thanh_hoac_thuong_hieu": 2.0,
+    "hoat_dong_noi_bat": 1.5,
+    "mota_chi_tiet": 1.0,
+    "doi_tuong": 1.0,
+    "so_thich_hoac_dip_le": 1.0,
+    "chi_phi_hoac_muc_gia": 0.5,
+    "loai": 0.5,
+}
+
+# Các cột được đánh bitmap facet
+FACET_FIELDS = (
+    "loai",
+    "tinh_thanh_hoac_thuong_hieu",
+    "doi_tuong",
+    "so_thich_hoac_dip_le",
+    "chi_phi_hoac_muc_gia",
+)
+
+# Từ khóa nhận diện loại document từ query (so khớp trên text giữ dấu, theo âm tiết)
+LOAI_KEYWORDS = {
+    "qua_tang": ("quà", "tặng"),
+    "du_lich": ("du lịch", "đi chơi", "tham quan", "điểm đến"),
+    "ke_hoach_hen_ho": ("hẹn hò", "buổi hẹn"),
+}
+
+# Field nhận diện tự động từ query khi không truyền filters
+DETECTED_FIELDS = ("tinh_thanh_hoac_thuong_hieu",)
+
+_VALUE_SEPARATORS = re.compile(r"[;,]")
+_FIELD_PREFIX = "="
+
+
+def document_fields(text: str, metadata: Optional[Mapping]) -> Dict[str, str]:
+    """Các field của document để chấm điểm BM25F (không có cấu trúc thì cả text là 1 field)"""
+    fields = (metadata or {}).get("fields")
+    if fields:
+        return {name: value for name, value in fields.items() if value}
+    return {DEFAULT_FIELD: text}
+
+
+def normalize_facet_value(value: str) -> str:
+    """'Đà Nẵng' -> 'da nang' (bỏ dấu, chỉ giữ âm tiết) để khớp cả query không dấu"""
+    return " ".join(split_syllables(fold_diacritics(normalize_text(value))))
+
+
+def facet_values(value: str) -> List[str]:
+    """Tách ô nhiều giá trị ('cặp đôi;gia đình') thành các giá trị đã chuẩn hóa"""
+    values = (normalize_facet_value(part) for part in _VALUE_SEPARATORS.split(value or ""))
+    return [v for v in values if v]
+
+
+class FacetIndex:
+    """
+    Bitmap facet dạng packed bits (np.packbits), mỗi key 1 hàng:
+    - "field=value": documents có giá trị đó
+    - "field": documents có field đó (để documents không có field luôn qua bộ lọc)
+    """
+
+    def __init__(self, keys: Sequence[str], bitmaps: np.ndarray, n_docs: int):
+        self.keys = list(keys)
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self.bitmaps = bitmaps.reshape(len(self.keys), -1) if len(self.keys) else bitmaps
+        self.n_docs = n_docs
+
+    @classmethod
+    def build(cls, metadatas: Sequence[Mapping]) -> Optional["FacetIndex"]:
+        """Build bitmap từ metadata["fields"]; None nếu không document nào có field facet"""
+        n_docs = len(metadatas)
+        members: Dict[str, List[int]] = {}
+        for doc_id, metadata in enumerate(metadatas):
+            fields = (metadata or {}).get("fields") or {}
+            for field in FACET_FIELDS:
+                values = facet_values(fields.get(field, ""))
+                if not values:
+                    continue
+                members.setdefault(field, []).append(doc_id)
+                for value in values:
+                    members.setdefault(f"{field}{_FIELD_PREFIX}{value}", []).append(doc_id)
+        if not members:
+            return None
+
+        keys = sorted(members)
+        bits = np.zeros((len(keys), n_docs), dtype=bool)
+        for row, key in enumerate(keys):
+            bits[row, members[key]] = True
+        return cls(keys, np.packbits(bits, axis=1), n_docs)
+
+    def values(self, field: str) -> List[str]:
+        prefix = f"{field}{_FIELD_PREFIX}"
+        return [key[len(prefix):] for key in self.keys if key.startswith(prefix)]
+
+    def _bits(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return np.unpackbits(self.bitmaps[row], count=self.n_docs).astype(bool)
+
+    def match(self, filters: Mapping[str, Iterable[str]]) -> np.ndarray:
+        """Documents khớp thật sự mọi field trong filters (OR giữa các giá trị của 1 field)"""
+        mask = np.ones(self.n_docs, dtype=bool)
+        for field, values in filters.items():
+            field_mask = np.zeros(self.n_docs, dtype=bool)
+            for value in values:
+                bits = self._bits(f"{field}{_FIELD_PREFIX}{value}")
+                if bits is not None:
+                    field_mask |= bits
+            mask &= field_mask
+        return mask
+
+    def allowed(self, filters: Mapping[str, Iterable[str]]) -> np.ndarray:
+        """Documents qua bộ lọc: khớp giá trị, hoặc không có field đó"""
+        mask = np.ones(self.n_docs, dtype=bool)
+        for field, values in filters.items():
+            has_field = self._bits(field)
+            if has_field is None:
+                continue
+            mask &= self.match({field: values}) | ~has_field
+        return mask
+
+
+def detect_facets(query: str, known_values: Mapping[str, Iterable[str]]) -> Dict[str, List[str]]:
+    """
+    Nhận diện bộ lọc từ query:
+    - loai: theo LOAI_KEYWORDS, chỉ khi query nhắm đúng 1 loại
+    - tỉnh/thương hiệu: giá trị có trong index xuất hiện nguyên cụm âm tiết trong query
+
+    Args:
+        known_values: field -> các giá trị (đã chuẩn hóa) có trong index
+    """
+    accented = f" {' '.join(split_syllables(normalize_text(query)))} "
+    folded = f" {normalize_facet_value(query)} "
+    filters: Dict[str, List[str]] = {}
+
+    loai = [
+        name for name, keywords in LOAI_KEYWORDS.items()
+        if any(f" {keyword} " in accented for keyword in keywords)
+    ]
+    if len(loai) == 1 and normalize_facet_value(loai[0]) in set(known_values.get("loai", ())):
+        filters["loai"] = [normalize_facet_value(loai[0])]
+
+    for field in DETECTED_FIELDS:
+        matched = [value for value in known_values.get(field, ()) if f" {value} " in folded]
+        if matched:
+            filters[field] = matched
+    return filters
+
+
+def resolve_filters(
+    query: str,
+    explicit: Optional[Mapping[str, Iterable[str]]],
+    known_values: Mapping[str, Iterable[str]],
+) -> Dict[str, List[str]]:
+    """
+    Bộ lọc cho 1 query: dùng filters truyền vào (chuẩn hóa giá trị) nếu có, ngược lại tự nhận diện.
+    explicit = {} nghĩa là không lọc.
+    """
+    if explicit is None:
+        return detect_facets(query, known_values)
+    filters = {}
+    for field, values in explicit.items():
+        if isinstance(values, str):
+            values = [values]
+        normalized = [v for value in values for v in facet_values(value)]
+        if normalized:
+            filters[field] = normalized
+    return filters
@@ -0,0 +1,41 @@
+"""
+Hybrid Retrieval
+Kết hợp BM25 và dense (retrieval/denseIndex.py) bằng reciprocal rank fusion:
+    score(d) = sum over rankings of 1 / (RRF_K + rank(d))
+Chỉ dùng thứ hạng nên không cần chuẩn hóa thang điểm BM25 với cosine.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+RRF_K = 60
+# Số ứng viên lấy từ mỗi nguồn trước khi fusion
+FUSION_DEPTH = 20
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[List[Tuple[int, float]]],
+    k: int,
+    rrf_k: int = RRF_K,
+) -> List[Tuple[int, float]]:
+    """
+    Gộp nhiều danh sách (doc_id, score) đã sắp xếp giảm dần thành top-k (doc_id, điểm RRF).
+    Hòa điểm thì giữ thứ tự xuất hiện đầu tiên (ưu tiên ranking đứng trước).
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
+
+
+def hybrid_top_k(index, query: str, k: int, depth: int = FUSION_DEPTH) -> List[Tuple[int, float]]:
+    """
+    Top-k hybrid trên BM25Index hoặc SegmentedIndex.
+    Index không có phần dense thì trả về đúng thứ tự BM25.
+    """
+    depth = max(depth, k)
+    bm25_hits = index.top_k(query, depth)
+    dense_hits = index.dense_top_k(query, depth)
+    if not dense_hits:
+        return bm25_hits[:k]
+    return reciprocal_rank_fusion([bm25_hits, dense_hits], k)
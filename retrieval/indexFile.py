@@ -0,0 +1,283 @@
+"""
+Retrieval Index File
+Định dạng file index có version, mở bằng mmap để khởi động nhanh và chia sẻ page giữa các worker.
+
+Layout:
+    MAGIC (8 bytes) | version (uint32) | header_len (uint32) | header JSON | sections...
+
+Header JSON mô tả tham số BM25 + vị trí từng section (offset, dtype, count).
+Mỗi section được căn lề 64 bytes để np.frombuffer đọc trực tiếp từ mmap, không copy.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from retrieval.bm25Index import BM25Index
+from retrieval.denseIndex import DenseIndex
+from retrieval.facets import FacetIndex
+
+INDEX_MAGIC = b"CBRAGIDX"
+INDEX_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 64
+
+
+class PackedStrings(Sequence):
+    """Danh sách string lưu dạng blob UTF-8 + offsets, decode lazy theo từng phần tử"""
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self.blob[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.raw(i).decode("utf-8")
+
+
+class PackedMetadatas(Sequence):
+    """Metadata của documents lưu dạng JSON đã pack, parse lazy"""
+
+    def __init__(self, strings: PackedStrings):
+        self.strings = strings
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return json.loads(self.strings[i])
+
+
+class MappedVocabulary:
+    """
+    Vocabulary đọc thẳng từ mmap: terms sắp xếp theo bytes, tra cứu bằng binary search.
+    Không phải dựng dict lúc mở file → thời gian mở index không phụ thuộc kích thước vocabulary.
+    """
+
+    def __init__(self, sorted_terms: PackedStrings, sorted_term_ids: np.ndarray):
+        self.sorted_terms = sorted_terms
+        self.sorted_term_ids = sorted_term_ids
+
+    def __len__(self) -> int:
+        return len(self.sorted_terms)
+
+    def __contains__(self, term: str) -> bool:
+        return self.get(term) is not None
+
+    def get(self, term: str, default=None) -> Optional[int]:
+        key = term.encode("utf-8")
+        view = _RawView(self.sorted_terms)
+        pos = bisect.bisect_left(view, key)
+        if pos < len(view) and view[pos] == key:
+            return int(self.sorted_term_ids[pos])
+        return default
+
+
+class _RawView(Sequence):
+    """View bytes của PackedStrings để bisect so sánh trực tiếp trên bytes"""
+
+    def __init__(self, strings: PackedStrings):
+        self.strings = strings
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, i):
+        return self.strings.raw(i)
+
+
+def _pack_strings(values: Sequence[str]):
+    """Pack list string thành (blob bytes, offsets int64)"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def save_index(index: BM25Index, path: str, extra_sections: Optional[Dict[str, np.ndarray]] = None):
+    """
+    Ghi BM25Index ra file index (ghi file tạm rồi os.replace để thay thế nguyên tử).
+
+    Args:
+        index: BM25Index cần lưu
+        path: Đường dẫn file đích
+        extra_sections: Các mảng NumPy bổ sung (lưu kèm, đọc lại qua load_index(...).sections)
+    """
+    terms = [""] * index.n_terms
+    for term, term_id in index.vocabulary.items():
+        terms[term_id] = term
+    order = sorted(range(len(terms)), key=lambda t: terms[t].encode("utf-8"))
+    vocab_blob, vocab_offsets = _pack_strings([terms[t] for t in order])
+    text_blob, text_offsets = _pack_strings(list(index.texts))
+    meta_blob, meta_offsets = _pack_strings(
+        [json.dumps(metadata, ensure_ascii=False) for metadata in index.metadatas]
+    )
+
+    sections = {
+        "indptr": np.asarray(index.indptr, dtype=np.int64),
+        "postings": np.asarray(index.postings, dtype=np.int32),
+        "tf_weights": np.asarray(index.tf_weights, dtype=np.float32),
+        "idf": np.asarray(index.idf, dtype=np.float32),
+        "doc_lens": np.asarray(index.doc_lens, dtype=np.float32),
+        "term_max_weights": np.asarray(index.term_max_weights, dtype=np.float32),
+        "vocab_blob": vocab_blob,
+        "vocab_offsets": vocab_offsets,
+        "vocab_term_ids": np.asarray(order, dtype=np.int64),
+        "text_blob": text_blob,
+        "text_offsets": text_offsets,
+        "meta_blob": meta_blob,
+        "meta_offsets": meta_offsets,
+    }
+    if index.facets is not None:
+        facet_blob, facet_offsets = _pack_strings(index.facets.keys)
+        sections["facet_keys_blob"] = facet_blob
+        sections["facet_keys_offsets"] = facet_offsets
+        sections["facet_bitmaps"] = np.asarray(index.facets.bitmaps, dtype=np.uint8).ravel()
+    if index.dense is not None:
+        sections["dense_vectors"] = np.asarray(index.dense.vectors, dtype=np.float32).ravel()
+        sections["dense_idf"] = np.asarray(index.dense.idf, dtype=np.float32)
+        sections["dense_passage_doc_ids"] = np.asarray(index.dense.passage_doc_ids, dtype=np.int32)
+        sections["ivf_centroids"] = np.asarray(index.dense.centroids, dtype=np.float32).ravel()
+        sections["ivf_indptr"] = np.asarray(index.dense.list_indptr, dtype=np.int64)
+        sections["ivf_passage_ids"] = np.asarray(index.dense.list_passage_ids, dtype=np.int32)
+    sections.update(extra_sections or {})
+
+    header = {
+        "version": INDEX_VERSION,
+        "n_docs": index.n_docs,
+        "n_terms": index.n_terms,
+        "k1": index.k1,
+        "b": index.b,
+        "tokenizer": index.tokenizer_name,
+        "sections": {},
+    }
+
+    # Vùng dữ liệu bắt đầu sau header (ước lượng với offset lớn nhất), căn lề _ALIGNMENT
+    layout = []
+    data_start = _align(_PREAMBLE.size + len(_estimate_header(header, sections)))
+    offset = data_start
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        header["sections"][name] = {
+            "offset": offset,
+            "dtype": array.dtype.str,
+            "count": int(array.size),
+        }
+        layout.append((offset, array))
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    if _PREAMBLE.size + len(header_bytes) > data_start:
+        raise ValueError("Header index quá lớn")
+
+    file_size = offset
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(INDEX_MAGIC, INDEX_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for section_offset, array in layout:
+            f.seek(section_offset)
+            f.write(array.tobytes())
+        f.truncate(file_size)
+    os.replace(tmp_path, path)
+
+
+def load_index(path: str) -> BM25Index:
+    """
+    Mở file index bằng mmap (read-only) và trả về BM25Index trỏ thẳng vào vùng nhớ map.
+
+    Raises:
+        ValueError: File không đúng định dạng hoặc khác version
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, header_len = _PREAMBLE.unpack_from(mm, 0)
+    if magic != INDEX_MAGIC:
+        raise ValueError(f"File {path} không phải retrieval index")
+    if version != INDEX_VERSION:
+        raise ValueError(f"Index version {version} không được hỗ trợ (cần {INDEX_VERSION})")
+    header = json.loads(mm[_PREAMBLE.size:_PREAMBLE.size + header_len].decode("utf-8"))
+
+    sections = {
+        name: np.frombuffer(mm, dtype=np.dtype(spec["dtype"]), count=spec["count"], offset=spec["offset"])
+        for name, spec in header["sections"].items()
+    }
+
+    vocabulary = MappedVocabulary(
+        PackedStrings(sections["vocab_blob"], sections["vocab_offsets"]),
+        sections["vocab_term_ids"],
+    )
+    index = BM25Index(
+        vocabulary=vocabulary,
+        indptr=sections["indptr"],
+        postings=sections["postings"],
+        tf_weights=sections["tf_weights"],
+        idf=sections["idf"],
+        doc_lens=sections["doc_lens"],
+        texts=PackedStrings(sections["text_blob"], sections["text_offsets"]),
+        metadatas=PackedMetadatas(PackedStrings(sections["meta_blob"], sections["meta_offsets"])),
+        k1=header["k1"],
+        b=header["b"],
+        tokenizer_name=header["tokenizer"],
+        term_max_weights=sections.get("term_max_weights"),
+        facets=_load_facets(sections, header["n_docs"]),
+        dense=_load_dense(sections),
+    )
+    # Giữ tham chiếu tới mmap + sections để vùng nhớ không bị đóng khi index còn dùng
+    index.mmap = mm
+    index.sections = sections
+    index.header = header
+    return index
+
+
+def _load_facets(sections: Dict[str, np.ndarray], n_docs: int) -> Optional[FacetIndex]:
+    if "facet_bitmaps" not in sections:
+        return None
+    keys = list(PackedStrings(sections["facet_keys_blob"], sections["facet_keys_offsets"]))
+    return FacetIndex(keys, sections["facet_bitmaps"], n_docs)
+
+
+def _load_dense(sections: Dict[str, np.ndarray]) -> Optional[DenseIndex]:
+    if "dense_vectors" not in sections:
+        return None
+    return DenseIndex(
+        vectors=sections["dense_vectors"],
+        idf=sections["dense_idf"],
+        passage_doc_ids=sections["dense_passage_doc_ids"],
+        centroids=sections["ivf_centroids"],
+        list_indptr=sections["ivf_indptr"],
+        list_passage_ids=sections["ivf_passage_ids"],
+    )
+
+
+def _estimate_header(header: Dict, sections: Dict[str, np.ndarray]) -> bytes:
+    """Header với offset/count lớn nhất có thể, dùng để chặn trên kích thước header thật"""
+    estimate = dict(header)
+    estimate["sections"] = {
+        name: {"offset": 2 ** 62, "dtype": np.asarray(array).dtype.str, "count": 2 ** 62}
+        for name, array in sections.items()
+    }
+    return json.dumps(estimate, ensure_ascii=False).encode("utf-8")
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
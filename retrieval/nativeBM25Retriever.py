@@ -0,0 +1,71 @@
+"""
+Native BM25 Retriever
+Retriever LangChain dùng BM25Index (NumPy) thay cho BM25Retriever/rank_bm25
+"""
+
+from typing import Any, Iterable, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from retrieval.bm25Index import BM25Index
+from retrieval.contextPacker import ContextPacker
+from retrieval.hybrid import hybrid_top_k
+from retrieval.indexFile import load_index
+from retrieval.segmentedIndex import SegmentedIndex
+
+
+class NativeBM25Retriever(BaseRetriever):
+    """Retriever BM25 vector hóa, dùng được trực tiếp với create_retrieval_chain"""
+
+    index: Any
+    """ BM25Index hoặc SegmentedIndex đã build."""
+    k: int = 4
+    """ Số documents trả về (có packer: số ứng viên đưa vào packer)."""
+    packer: Optional[ContextPacker] = None
+    """ Ghép context theo ngân sách token (None = trả nguyên k documents)."""
+    hybrid: bool = False
+    """ Gộp BM25 với dense retrieval (RRF) nếu index có phần dense."""
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: Iterable[Document],
+        **kwargs: Any,
+    ) -> "NativeBM25Retriever":
+        """Build index từ danh sách Documents (thay thế BM25Retriever.from_documents)"""
+        documents = list(documents)
+        index = BM25Index.build(
+            texts=[doc.page_content for doc in documents],
+            metadatas=[doc.metadata for doc in documents],
+        )
+        return cls(index=index, **kwargs)
+
+    @classmethod
+    def from_index_file(cls, path: str, **kwargs: Any) -> "NativeBM25Retriever":
+        """Mở index đã build sẵn (mmap) - không unpickle, không tính lại thống kê term"""
+        return cls(index=load_index(path), **kwargs)
+
+    @classmethod
+    def from_index_dir(cls, directory: str, **kwargs: Any) -> "NativeBM25Retriever":
+        """Mở index nhiều segment (hỗ trợ thêm/xóa documents không cần rebuild)"""
+        return cls(index=SegmentedIndex.open(directory), **kwargs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        hits = hybrid_top_k(self.index, query, self.k) if self.hybrid else self.index.top_k(query, self.k)
+        scored_documents = []
+        for doc_id, score in hits:
+            text, metadata = self.index.document(doc_id)
+            metadata["doc_id"] = doc_id
+            scored_documents.append((Document(page_content=text, metadata=metadata), score))
+        if self.packer is not None:
+            return self.packer.pack(query, scored_documents)
+        return [document for document, _ in scored_documents]
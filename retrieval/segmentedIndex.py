@@ -0,0 +1,440 @@
+"""
+Segmented Retrieval Index
+Index nhiều segment kiểu LSM để thêm/xóa documents mà không phải rebuild toàn bộ corpus.
+
+Layout thư mục:
+    manifest.json          - danh sách segment, doc id kế tiếp, doc ids đã xóa (tombstones)
+    segment_000001.bin     - mỗi segment là 1 file index (retrieval/indexFile.py) + section doc_ids
+
+- add_documents: ghi thêm 1 segment nhỏ, cấp doc id mới (tăng dần, không tái sử dụng)
+- delete_documents: ghi tombstone vào manifest, document bị loại khi query
+- compact: gộp các segment nhỏ nhất thành 1 segment, bỏ hẳn documents đã xóa
+IDF được tính trên toàn bộ segments lúc query; phần tf của mỗi segment dùng avgdl
+tại thời điểm ghi segment, compact sẽ chuẩn hóa lại.
+Manifest "dense": true thì mỗi segment có thêm DenseIndex (idf embedding theo segment).
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from retrieval.bm25Index import (
+    DEFAULT_TOKENIZER,
+    TOKENIZERS,
+    BM25Index,
+    compute_idf,
+    count_query_tokens,
+)
+from retrieval.facets import resolve_filters
+from retrieval.indexFile import load_index, save_index
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+LOCK_FILE = ".lock"
+
+# Compact tự động khi số segment vượt ngưỡng: gộp MERGE_FACTOR segment nhỏ nhất
+MAX_SEGMENTS = 8
+MERGE_FACTOR = 4
+
+
+class SegmentedIndex:
+    """Index gồm nhiều segment BM25Index (mmap) + tombstones, doc id toàn cục"""
+
+    def __init__(self, directory: str, manifest: Dict, segments: List[BM25Index]):
+        self.directory = directory
+        self.manifest = manifest
+        self.segments = segments
+        self.document_tokenizer, self.query_tokenizer = TOKENIZERS[manifest["tokenizer"]]
+        self._refresh_deleted_masks()
+
+    # --- Mở / tạo ---
+
+    @classmethod
+    def open(cls, directory: str) -> "SegmentedIndex":
+        """Mở index từ thư mục (các segment được mmap)"""
+        manifest = _read_manifest(directory)
+        segments = [load_index(os.path.join(directory, seg["file"])) for seg in manifest["segments"]]
+        return cls(directory, manifest, segments)
+
+    @classmethod
+    def create(
+        cls,
+        directory: str,
+        texts: Iterable[str],
+        metadatas: Optional[Iterable[dict]] = None,
+        tokenizer_name: str = DEFAULT_TOKENIZER,
+        k1: float = 1.5,
+        b: float = 0.75,
+        dense: bool = False,
+    ) -> "SegmentedIndex":
+        """
+        Tạo index mới (ghi đè index cũ trong thư mục) với toàn bộ corpus trong 1 segment.
+
+        Args:
+            dense: Build thêm DenseIndex cho mọi segment (kể cả segment thêm sau/compact)
+        """
+        os.makedirs(directory, exist_ok=True)
+        # Giữ generation/số segment của index cũ (nếu có) để tên file không trùng
+        # và reader đang chạy nhận ra có phiên bản mới
+        previous = {}
+        if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            previous = _read_manifest(directory)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "generation": previous.get("generation", 0),
+            "tokenizer": tokenizer_name,
+            "k1": k1,
+            "b": b,
+            "dense": dense,
+            "next_doc_id": 0,
+            "next_segment": previous.get("next_segment", 1),
+            "segments": [],
+            "deleted": [],
+        }
+        index = cls(directory, manifest, [])
+        with index._write_lock():
+            old_files = [f for f in os.listdir(directory) if f.startswith("segment_")]
+            texts = list(texts)
+            metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+            if texts:
+                doc_ids = np.arange(len(texts), dtype=np.int64)
+                index._write_segment(texts, metadatas, doc_ids)
+                manifest["next_doc_id"] = len(texts)
+            index._commit()
+            for name in old_files:
+                os.remove(os.path.join(directory, name))
+        return index
+
+    # --- Thống kê ---
+
+    @property
+    def n_docs(self) -> int:
+        """Số documents còn sống"""
+        return sum(seg.n_docs for seg in self.segments) - len(self.manifest["deleted"])
+
+    @property
+    def generation(self) -> int:
+        return self.manifest["generation"]
+
+    @property
+    def has_dense(self) -> bool:
+        return bool(self.segments) and all(seg.dense is not None for seg in self.segments)
+
+    def stats(self) -> Dict:
+        return {
+            "generation": self.generation,
+            "live_documents": self.n_docs,
+            "deleted_documents": len(self.manifest["deleted"]),
+            "next_doc_id": self.manifest["next_doc_id"],
+            "dense": self.has_dense,
+            "segments": [
+                {"file": seg["file"], "n_docs": seg["n_docs"]} for seg in self.manifest["segments"]
+            ],
+        }
+
+    # --- Query ---
+
+    def top_k(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (doc id toàn cục, score) trên tất cả segments, bỏ documents đã xóa"""
+        return self.top_k_batch([query], k)[0]
+
+    def top_k_batch(
+        self,
+        queries: Sequence[str],
+        k: int,
+        filters: Optional[Sequence[Optional[Dict[str, List[str]]]]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k cho nhiều query: segment nhỏ chấm điểm cả batch bằng 1 phép nhân sparse,
+        segment lớn dùng MaxScore (xem BM25Index.top_k_batch_terms).
+
+        Args:
+            filters: Bộ lọc facet cho từng query (None = tự nhận diện, {} = không lọc),
+                     xem BM25Index.top_k_batch
+        """
+        results: List[List[Tuple[int, float]]] = [[] for _ in queries]
+        if not self.segments or not queries:
+            return results
+
+        # IDF toàn cục: cộng document frequency của từng token qua các segment
+        total_docs = sum(seg.n_docs for seg in self.segments)
+        query_weights = []
+        segment_term_ids: List[List[np.ndarray]] = [[] for _ in self.segments]
+        for query in queries:
+            tokens, qtf = count_query_tokens(self.query_tokenizer(query))
+            term_ids = [seg.term_ids_for(tokens) for seg in self.segments]
+            query_weights.append(compute_idf(self._document_frequencies(term_ids), total_docs) * qtf)
+            for seg_index, ids in enumerate(term_ids):
+                segment_term_ids[seg_index].append(ids)
+
+        # Bộ lọc facet: chỉ áp dụng khi có document (ở bất kỳ segment nào) khớp thật sự
+        known_values: Dict[str, set] = {}
+        for seg in self.segments:
+            for field, values in seg.known_facet_values().items():
+                known_values.setdefault(field, set()).update(values)
+        query_filters = []
+        for row, query in enumerate(queries):
+            row_filters = resolve_filters(query, filters[row] if filters else None, known_values)
+            if row_filters and not any(seg.has_facet_match(row_filters) for seg in self.segments):
+                row_filters = {}
+            query_filters.append(row_filters)
+
+        filtered = [row for row, row_filters in enumerate(query_filters) if row_filters]
+        self._search_segments(segment_term_ids, query_weights, k, results, filtered, query_filters)
+        # Lọc không ra kết quả → chấm điểm lại không lọc
+        unfiltered = [row for row in range(len(queries)) if not query_filters[row] or not results[row]]
+        self._search_segments(segment_term_ids, query_weights, k, results, unfiltered)
+        return results
+
+    def query_token_weights(self, query: str) -> Tuple[List[str], np.ndarray]:
+        """Tokens (không trùng) của query + trọng số idf toàn cục * qtf (0 với token không có ở segment nào)"""
+        tokens, qtf = count_query_tokens(self.query_tokenizer(query))
+        if not self.segments:
+            return tokens, np.zeros(len(tokens))
+        df = self._document_frequencies([seg.term_ids_for(tokens) for seg in self.segments])
+        total_docs = sum(seg.n_docs for seg in self.segments)
+        return tokens, np.where(df > 0, compute_idf(df, total_docs) * qtf, 0.0)
+
+    def _document_frequencies(self, segment_term_ids: List[np.ndarray]) -> np.ndarray:
+        """Document frequency toàn cục: cộng df của từng token qua các segment"""
+        return sum(
+            (seg.document_frequencies(ids) for seg, ids in zip(self.segments, segment_term_ids)),
+            np.zeros(len(segment_term_ids[0]), dtype=np.int64),
+        )
+
+    def _search_segments(
+        self,
+        segment_term_ids: List[List[np.ndarray]],
+        query_weights: List[np.ndarray],
+        k: int,
+        results: List[List[Tuple[int, float]]],
+        rows: List[int],
+        query_filters: Optional[List[Dict[str, List[str]]]] = None,
+    ):
+        """Chấm điểm các query ở vị trí rows trên mọi segment, gộp top-k vào results"""
+        if not rows:
+            return
+        for seg, term_ids_list, deleted_mask in zip(self.segments, segment_term_ids, self._deleted_masks):
+            valid_ids = [term_ids_list[row][term_ids_list[row] >= 0] for row in rows]
+            valid_weights = [query_weights[row][term_ids_list[row] >= 0] for row in rows]
+            # Điểm thứ k đã có từ các segment trước là ngưỡng cho MaxScore ở segment này
+            thresholds = [_kth_score(results[row], k) for row in rows]
+            if query_filters is None:
+                segment_hits = seg.top_k_batch_terms(valid_ids, valid_weights, k, deleted_mask, thresholds)
+            else:
+                segment_hits = [
+                    seg.top_k_allowed(ids, weights, k, seg.allowed_mask(query_filters[row], deleted_mask), threshold)
+                    for row, ids, weights, threshold in zip(rows, valid_ids, valid_weights, thresholds)
+                ]
+            seg_doc_ids = seg.sections["doc_ids"]
+            for row, hits in zip(rows, segment_hits):
+                results[row].extend((int(seg_doc_ids[local]), score) for local, score in hits)
+                results[row].sort(key=lambda item: -item[1])
+                del results[row][k:]
+
+    def dense_top_k(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (doc id toàn cục, cosine) theo DenseIndex của các segments, bỏ documents đã xóa"""
+        hits = []
+        for seg, deleted_mask in zip(self.segments, self._deleted_masks):
+            seg_doc_ids = seg.sections["doc_ids"]
+            hits.extend((int(seg_doc_ids[local]), score) for local, score in seg.dense_top_k(query, k, deleted_mask))
+        hits.sort(key=lambda item: -item[1])
+        return hits[:k]
+
+    def document(self, doc_id: int) -> Tuple[str, dict]:
+        """Lấy (text, metadata) theo doc id toàn cục"""
+        seg, local = self._locate(doc_id)
+        return seg.document(local)
+
+    # --- Ghi ---
+
+    def add_documents(self, texts: Sequence[str], metadatas: Optional[Sequence[dict]] = None) -> List[int]:
+        """
+        Thêm documents vào index dưới dạng 1 segment mới.
+
+        Returns:
+            Danh sách doc id được cấp cho các documents mới
+        """
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        if not texts:
+            return []
+        with self._write_lock():
+            self._reload()
+            start = self.manifest["next_doc_id"]
+            doc_ids = np.arange(start, start + len(texts), dtype=np.int64)
+            self._write_segment(texts, metadatas, doc_ids)
+            self.manifest["next_doc_id"] = start + len(texts)
+            self._commit()
+            if len(self.segments) > MAX_SEGMENTS:
+                self._compact_locked(force=False)
+        print(f"✅ Đã thêm {len(texts)} documents (doc id {start}-{start + len(texts) - 1})")
+        return doc_ids.tolist()
+
+    def delete_documents(self, doc_ids: Iterable[int]) -> int:
+        """Đánh dấu xóa documents (tombstone). Trả về số documents thực sự bị xóa."""
+        with self._write_lock():
+            self._reload()
+            deleted = set(self.manifest["deleted"])
+            existing = set()
+            for seg in self.segments:
+                existing.update(int(d) for d in seg.sections["doc_ids"])
+            removed = [int(d) for d in doc_ids if int(d) in existing and int(d) not in deleted]
+            if removed:
+                self.manifest["deleted"] = sorted(deleted.union(removed))
+                self._commit()
+        print(f"🗑️ Đã xóa {len(removed)} documents")
+        return len(removed)
+
+    def compact(self, force: bool = False):
+        """
+        Gộp segments.
+
+        Args:
+            force: True = gộp tất cả thành 1 segment (bỏ hết tombstones),
+                   False = chỉ gộp khi số segment vượt MAX_SEGMENTS
+        """
+        with self._write_lock():
+            self._reload()
+            self._compact_locked(force=force)
+
+    # --- Nội bộ ---
+
+    def _compact_locked(self, force: bool):
+        while len(self.segments) > 1 and (force or len(self.segments) > MAX_SEGMENTS):
+            if force:
+                chosen = list(range(len(self.segments)))
+            else:
+                by_size = sorted(range(len(self.segments)), key=lambda i: self.segments[i].n_docs)
+                chosen = sorted(by_size[:MERGE_FACTOR])
+
+            deleted = set(self.manifest["deleted"])
+            texts, metadatas, doc_ids = [], [], []
+            for i in chosen:
+                seg = self.segments[i]
+                for local, doc_id in enumerate(seg.sections["doc_ids"]):
+                    if int(doc_id) in deleted:
+                        continue
+                    text, metadata = seg.document(local)
+                    texts.append(text)
+                    metadatas.append(metadata)
+                    doc_ids.append(int(doc_id))
+
+            merged_ids = set()
+            for i in chosen:
+                merged_ids.update(int(d) for d in self.segments[i].sections["doc_ids"])
+            old_files = [self.manifest["segments"][i]["file"] for i in chosen]
+
+            keep = [i for i in range(len(self.segments)) if i not in chosen]
+            self.manifest["segments"] = [self.manifest["segments"][i] for i in keep]
+            self.segments = [self.segments[i] for i in keep]
+            self.manifest["deleted"] = sorted(deleted - merged_ids)
+
+            if texts:
+                order = np.argsort(doc_ids, kind="stable")
+                self._write_segment(
+                    [texts[i] for i in order],
+                    [metadatas[i] for i in order],
+                    np.asarray(doc_ids, dtype=np.int64)[order],
+                )
+            self._commit()
+
+            # Reader khác vẫn mmap được file cũ sau khi unlink (POSIX)
+            for name in old_files:
+                os.remove(os.path.join(self.directory, name))
+            print(f"🔧 Compact {len(chosen)} segments → {len(texts)} documents")
+            if force:
+                break
+
+    def _write_segment(self, texts: List[str], metadatas: List[dict], doc_ids: np.ndarray):
+        name = f"segment_{self.manifest['next_segment']:06d}.bin"
+        self.manifest["next_segment"] += 1
+        path = os.path.join(self.directory, name)
+        segment = BM25Index.build(
+            texts,
+            metadatas,
+            tokenizer_name=self.manifest["tokenizer"],
+            k1=self.manifest["k1"],
+            b=self.manifest["b"],
+            dense=self.manifest.get("dense", False),
+        )
+        save_index(segment, path, extra_sections={"doc_ids": doc_ids})
+        self.manifest["segments"].append({"file": name, "n_docs": len(texts)})
+        self.segments.append(load_index(path))
+
+    def _commit(self):
+        """Ghi manifest nguyên tử (file tạm + os.replace) và tăng generation"""
+        self.manifest["generation"] += 1
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        self._refresh_deleted_masks()
+
+    def _reload(self):
+        """Đọc lại manifest (process khác có thể đã ghi) trước khi sửa"""
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return
+        manifest = _read_manifest(self.directory)
+        if manifest["generation"] == self.manifest["generation"]:
+            return
+        loaded = {seg["file"]: index for seg, index in zip(self.manifest["segments"], self.segments)}
+        self.segments = [
+            loaded.get(seg["file"]) or load_index(os.path.join(self.directory, seg["file"]))
+            for seg in manifest["segments"]
+        ]
+        self.manifest = manifest
+        self._refresh_deleted_masks()
+
+    def _refresh_deleted_masks(self):
+        deleted = np.asarray(self.manifest["deleted"], dtype=np.int64)
+        self._deleted_masks = []
+        for seg in self.segments:
+            mask = np.isin(seg.sections["doc_ids"], deleted) if len(deleted) else None
+            self._deleted_masks.append(mask if mask is not None and mask.any() else None)
+
+    def _locate(self, doc_id: int) -> Tuple[BM25Index, int]:
+        for seg in self.segments:
+            seg_doc_ids = seg.sections["doc_ids"]
+            pos = int(np.searchsorted(seg_doc_ids, doc_id))
+            if pos < len(seg_doc_ids) and seg_doc_ids[pos] == doc_id:
+                return seg, pos
+        raise KeyError(f"Không tìm thấy document {doc_id}")
+
+    @contextmanager
+    def _write_lock(self):
+        """Khóa file để chỉ 1 process ghi index tại một thời điểm"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_generation(directory: str) -> int:
+    """Generation hiện tại của index trên đĩa (dùng để phát hiện index đã thay đổi)"""
+    return _read_manifest(directory)["generation"]
+
+
+def _read_manifest(directory: str) -> Dict:
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Không tìm thấy {path}. Chạy prepare_data.py trước!")
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Manifest version {manifest.get('version')} không được hỗ trợ")
+    return manifest
+
+
+def _kth_score(hits: List[Tuple[int, float]], k: int) -> float:
+    """Điểm thứ k trong danh sách hits đã sắp xếp giảm dần (0 nếu chưa đủ k)"""
+    return hits[k - 1][1] if k > 0 and len(hits) >= k else 0.0
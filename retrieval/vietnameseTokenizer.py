@@ -0,0 +1,64 @@
+"""
+Vietnamese Tokenizer
+Chuẩn hóa + tách từ tiếng Việt cho retrieval index:
+- Unicode NFC + lowercase (gõ tổ hợp/dựng sẵn đều ra cùng một term)
+- Tách âm tiết theo ký tự chữ/số, bỏ dấu câu
+- Bigram âm tiết ("hạ_long") để bắt từ ghép
+- Field gấp dấu song song ("~ha", "~ha_long") để query không dấu vẫn khớp,
+  query có dấu khớp cả hai field nên được ưu tiên hơn
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, Tuple
+
+# Prefix cho các term của field đã bỏ dấu (không thể xuất hiện trong âm tiết vì không phải \w)
+FOLDED_PREFIX = "~"
+BIGRAM_JOINER = "_"
+
+_SYLLABLE_PATTERN = re.compile(r"[^\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """NFC + lowercase"""
+    return unicodedata.normalize("NFC", text).lower()
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: 'hạ long' -> 'ha long', 'đà lạt' -> 'da lat'"""
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return unicodedata.normalize("NFC", stripped).replace("đ", "d").replace("Đ", "D")
+
+
+def split_syllables(text: str) -> List[str]:
+    """Tách text (đã normalize) thành danh sách âm tiết"""
+    return _SYLLABLE_PATTERN.findall(text)
+
+
+def _with_bigrams(syllables: List[str], prefix: str = "") -> List[str]:
+    tokens = [prefix + syllable for syllable in syllables]
+    tokens.extend(
+        prefix + syllables[i] + BIGRAM_JOINER + syllables[i + 1]
+        for i in range(len(syllables) - 1)
+    )
+    return tokens
+
+
+def tokenize_document(text: str) -> List[str]:
+    """
+    Tách từ cho document (chạy một lần lúc build index).
+
+    Returns:
+        Âm tiết + bigram giữ dấu, nối với âm tiết + bigram đã bỏ dấu (có FOLDED_PREFIX)
+    """
+    syllables = split_syllables(normalize_text(text))
+    folded = [fold_diacritics(syllable) for syllable in syllables]
+    return _with_bigrams(syllables) + _with_bigrams(folded, FOLDED_PREFIX)
+
+
+@lru_cache(maxsize=4096)
+def tokenize_query(text: str) -> Tuple[str, ...]:
+    """Tách từ cho query - cùng pipeline với document, memoize vì query thường lặp lại"""
+    return tuple(tokenize_document(text))
@@ -0,0 +1,332 @@
+"""
+Session History Cache
+Lịch sử hội thoại trong bộ nhớ process + ghi Firestore kiểu write-behind.
+
+Trước đây mỗi lượt chat tốn 3 round trip Firestore trên đường găng: get_history_text() đọc
+chat_sessions/{id}, add_to_history() đọc lại rồi set() cả document (event `done` của stream
+chờ lần ghi này). Ở đây:
+- Cache LRU theo session: lịch sử + text đã render sẵn cho prompt (TTL để thấy ghi từ instance khác)
+- append()/clear() chỉ sửa cache và ghi nhận thao tác cần lưu (SessionWrites); thread nền gom các
+  session cần ghi thành batch (HISTORY_FLUSH_INTERVAL giây hoặc khi đủ batch_size session)
+- Storage append-only: mỗi lượt là 1 entry riêng có `seq` tăng dần, chỉ ghi các lượt mới
+  (không ghi lại cả mảng lịch sử, 2 lượt đồng thời không ghi đè nhau)
+- Session còn thao tác chưa ghi không bị đẩy khỏi cache (bản trong bộ nhớ luôn mới nhất)
+- Chế độ tóm tắt (summarizer): chỉ giữ max_history lượt gần nhất nguyên văn, các lượt cũ hơn được
+  gộp dần vào 1 đoạn tóm tắt lưu cạnh các lượt (summary + summary_seq) → {history} trong prompt
+  có kích thước chặn trên dù session dài bao nhiêu. Chỉ gộp khi append (cùng lần ghi với lượt mới):
+  đọc session không đổi tóm tắt, lượt chưa gộp chỉ bị cắt khỏi text của prompt
+- close() (atexit / SIGTERM) ghi nốt các session còn chờ trước khi process thoát
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from retrieval.contextPacker import estimate_tokens, split_sentences
+from retrieval.vietnameseTokenizer import fold_diacritics, normalize_text, split_syllables
+
+EMPTY_HISTORY_TEXT = "Chưa có lịch sử hội thoại."
+SUMMARY_TOKEN_BUDGET = 400
+SUMMARY_ANSWER_CHARS = 200
+
+_seq_lock = threading.Lock()
+_last_seq = 0
+
+
+def next_seq() -> int:
+    """Số thứ tự lượt chat: nanosecond hiện tại, tăng nghiêm ngặt trong process"""
+    global _last_seq
+    with _seq_lock:
+        _last_seq = max(time.time_ns(), _last_seq + 1)
+        return _last_seq
+
+
+class StoredHistory(NamedTuple):
+    """Lịch sử đọc từ storage: các lượt gần nhất + tóm tắt các lượt có seq <= summary_seq"""
+    turns: List[Dict]
+    summary: str = ""
+    summary_seq: int = 0
+
+
+def _syllables(text: str) -> set:
+    return set(split_syllables(fold_diacritics(normalize_text(text))))
+
+
+def summarize_turns(summary: str, turns: List[Dict], token_budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Tóm tắt trích xuất (không gọi LLM, chạy ngay khi append): mỗi lượt 1 dòng gồm câu hỏi + câu
+    trong câu trả lời trùng nhiều âm tiết với câu hỏi nhất. Vượt token_budget thì bỏ các dòng cũ nhất.
+    """
+    lines = summary.splitlines() if summary else []
+    for turn in turns:
+        question = " ".join(turn["question"].split())
+        question_syllables = _syllables(question)
+        sentences = [sentence.strip("*#-•> ") for sentence in split_sentences(turn["answer"].replace("**", ""))]
+        sentences = [sentence for sentence in sentences if sentence]
+        # Cùng độ trùng thì ưu tiên câu dài hơn (câu chào "Chào bạn!" ít thông tin)
+        best = max(
+            sentences,
+            key=lambda sentence: (len(question_syllables & _syllables(sentence)), min(len(sentence), SUMMARY_ANSWER_CHARS)),
+            default="",
+        )
+        if len(best) > SUMMARY_ANSWER_CHARS:
+            best = best[:SUMMARY_ANSWER_CHARS].rsplit(" ", 1)[0] + "..."
+        lines.append(f"- Hỏi: {question} → Đáp: {best}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > token_budget:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def render_history(history: List[Dict], summary: str = "") -> str:
+    """Lịch sử dưới dạng text cho prompt (tóm tắt các lượt cũ + các lượt gần nhất nguyên văn)"""
+    if not history and not summary:
+        return EMPTY_HISTORY_TEXT
+    lines = []
+    if summary:
+        lines.append("Tóm tắt các lượt trước:")
+        lines.append(summary)
+    for item in history:
+        lines.append(f"Người dùng: {item['question']}")
+        lines.append(f"Bot: {item['answer']}")
+    return "\n".join(lines)
+
+
+class _Session:
+    __slots__ = ("history", "summary", "summary_seq", "text", "loaded_at")
+
+    def __init__(self, history: List[Dict], summary: str = "", summary_seq: int = 0, window: int = None):
+        """window: số lượt gần nhất đưa vào text (None = tất cả)"""
+        self.history = history
+        self.summary = summary
+        self.summary_seq = summary_seq
+        recent = history if window is None else history[max(0, len(history) - window):]
+        self.text = render_history(recent, summary)
+        self.loaded_at = time.time()
+
+
+class SessionWrites:
+    """
+    Thao tác chưa ghi của 1 session: xóa lịch sử cũ (cleared), thêm các lượt mới (turns),
+    thay tóm tắt (summary, summary_seq; None = không đổi)
+    """
+    __slots__ = ("cleared", "turns", "summary", "summary_seq")
+
+    def __init__(
+        self, cleared: bool = False, turns: List[Dict] = None,
+        summary: Optional[str] = None, summary_seq: int = 0,
+    ):
+        self.cleared = cleared
+        self.turns = turns or []
+        self.summary = summary
+        self.summary_seq = summary_seq
+
+    def merge(self, newer: "SessionWrites") -> "SessionWrites":
+        if newer.cleared:
+            return newer
+        if newer.summary is not None:
+            return SessionWrites(self.cleared, self.turns + newer.turns, newer.summary, newer.summary_seq)
+        return SessionWrites(self.cleared, self.turns + newer.turns, self.summary, self.summary_seq)
+
+
+class SessionHistoryCache:
+    """
+    load_fn(session_id) -> StoredHistory: đọc từ storage khi cache miss.
+    save_fn({session_id: SessionWrites}): ghi 1 batch (chạy trên thread flush).
+    summarizer(summary, turns) -> summary: bật chế độ tóm tắt các lượt cũ hơn max_history.
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[str], StoredHistory],
+        save_fn: Callable[[Dict[str, SessionWrites]], None],
+        max_history: int,
+        summarizer: Optional[Callable[[str, List[Dict]], str]] = None,
+        max_sessions: int = 10000,
+        ttl_seconds: float = 300,
+        flush_interval: float = 1.0,
+        batch_size: int = 100,
+    ):
+        self.load_fn = load_fn
+        self.save_fn = save_fn
+        self.max_history = max_history
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self.pending: Dict[str, SessionWrites] = {}
+        self.writing: Dict[str, SessionWrites] = {}   # batch đang ghi (chưa chắc đã lưu)
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+        self.appends = 0
+        self.summarized_turns = 0
+        self.writes = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.thread = threading.Thread(target=self._flush_loop, name="history-flush", daemon=True)
+        self.thread.start()
+
+    # --- Đọc ---
+    def _session(self, session_id: str) -> _Session:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None and (
+                self._unsaved(session_id) or time.time() - session.loaded_at < self.ttl_seconds
+            ):
+                self.sessions.move_to_end(session_id)
+                self.hits += 1
+                return session
+            self.misses += 1
+
+        stored = self.load_fn(session_id)
+        # Không tóm tắt ở đây (đọc không được đổi dữ liệu): các lượt sau summary_seq giữ nguyên,
+        # text chỉ lấy max_history lượt gần nhất, lượt cũ hơn được gộp ở lần append kế tiếp
+        history = [turn for turn in stored.turns if turn.get("seq", 0) > stored.summary_seq]
+        with self.lock:
+            # Trong lúc đọc có request khác đã append → bản trong cache mới hơn
+            if self._unsaved(session_id):
+                return self.sessions[session_id]
+            return self._put(session_id, history, stored.summary, stored.summary_seq)
+
+    def _compact(self, history: List[Dict], summary: str, summary_seq: int):
+        """(các lượt giữ nguyên văn, summary, summary_seq, summary có đổi không)"""
+        if len(history) <= self.max_history:
+            return history, summary, summary_seq, False
+        folded, history = history[:-self.max_history], history[-self.max_history:]
+        if self.summarizer is None:
+            return history, summary, summary_seq, False
+        self.summarized_turns += len(folded)
+        return history, self.summarizer(summary, folded), folded[-1].get("seq", summary_seq), True
+
+    def _unsaved(self, session_id: str) -> bool:
+        return session_id in self.pending or session_id in self.writing
+
+    def _put(self, session_id: str, history: List[Dict], summary: str = "", summary_seq: int = 0) -> _Session:
+        session = _Session(history, summary, summary_seq, self.max_history)
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.max_sessions:
+            # Bỏ session cũ nhất đã ghi xong (session chưa ghi chỉ có bản đầy đủ trong bộ nhớ)
+            evict = next((old for old in self.sessions if not self._unsaved(old)), None)
+            if evict is None:
+                break
+            del self.sessions[evict]
+        return session
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        return list(self._session(session_id).history)
+
+    def get_text(self, session_id: str) -> str:
+        return self._session(session_id).text
+
+    def get_summary(self, session_id: str) -> str:
+        return self._session(session_id).summary
+
+    # --- Ghi ---
+    def append(self, session_id: str, question: str, answer: str):
+        """
+        Thêm 1 lượt hỏi đáp, ghi Firestore ở background. Giữ max_history lượt gần nhất;
+        lượt cũ hơn bị bỏ, hoặc gộp vào tóm tắt nếu có summarizer
+        """
+        current = self._session(session_id)
+        with self.lock:
+            current = self.sessions.get(session_id, current)
+            history = list(current.history)
+            turn = {
+                "question": question,
+                "answer": answer,
+                "timestamp": datetime.now().isoformat(),
+                "seq": next_seq()
+            }
+            history.append(turn)
+            history, summary, summary_seq, summarized = self._compact(
+                history, current.summary, current.summary_seq
+            )
+            self._put(session_id, history, summary, summary_seq)
+            writes = SessionWrites(turns=[turn])
+            if summarized:
+                writes.summary, writes.summary_seq = summary, summary_seq
+            self._record(session_id, writes)
+            self.appends += 1
+            wake = len(self.pending) >= self.batch_size
+        if wake:
+            self.wakeup.set()
+
+    def clear(self, session_id: str):
+        with self.lock:
+            self._put(session_id, [])
+            self._record(session_id, SessionWrites(cleared=True))
+        self.wakeup.set()
+
+    def _record(self, session_id: str, writes: SessionWrites):
+        pending = self.pending.get(session_id)
+        self.pending[session_id] = writes if pending is None else pending.merge(writes)
+
+    def _flush_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Ghi mọi session đang chờ theo batch; trả về số session đã ghi"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.writing = pending
+            items = list(pending.items())
+            written = 0
+            for start in range(0, len(items), self.batch_size):
+                batch = dict(items[start:start + self.batch_size])
+                try:
+                    self.save_fn(batch)
+                except Exception as e:
+                    print(f"❌ Lỗi ghi lịch sử ({len(batch)} sessions), thử lại lần flush sau: {e}")
+                    with self.lock:
+                        self.write_errors += 1
+                        for session_id, writes in batch.items():
+                            # Giữ thứ tự: thao tác của batch lỗi trước các thao tác mới thêm trong lúc ghi
+                            newer = self.pending.get(session_id)
+                            self.pending[session_id] = writes if newer is None else writes.merge(newer)
+                    continue
+                written += len(batch)
+                with self.lock:
+                    self.writes += len(batch)
+                    self.batches += 1
+            with self.lock:
+                self.writing = {}
+            return written
+
+    def close(self):
+        """Dừng thread flush và ghi nốt các session còn chờ"""
+        self.closed = True
+        self.wakeup.set()
+        written = self.flush()
+        if written:
+            print(f"💾 Đã ghi {written} sessions lịch sử trước khi tắt")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "cached_sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "appends": self.appends,
+                "summary_mode": self.summarizer is not None,
+                "summarized_turns": self.summarized_turns,
+                "pending_writes": len(self.pending),
+                "writes": self.writes,
+                "write_batches": self.batches,
+                "write_errors": self.write_errors,
+                "flush_interval": self.flush_interval,
+            }
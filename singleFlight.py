@@ -0,0 +1,213 @@
+"""
+Single Flight
+Gộp các request giống hệt nhau đang chạy cùng lúc (app mobile retry, nhiều user hỏi cùng 1 câu
+đang hot) thành 1 lần gọi Gemini: request đến đầu tiên (leader) gọi LLM, các request đến sau
+(followers) cùng key chờ kết quả của leader; follower của /chat/stream nhận lại từng token
+leader đã nhận và tiếp tục theo stream của leader.
+
+- Key = câu hỏi đã chuẩn hóa + context (version prompt + generation index + doc ids) + fingerprint
+  của lịch sử/thông tin cá nhân đưa vào prompt → chỉ gộp khi prompt gửi Gemini giống nhau
+- Chỉ gộp request đang chạy (xong là bỏ key), không phải cache
+- Phạm vi 1 process (mỗi gunicorn worker có bảng riêng)
+"""
+import hashlib
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from answerCache import normalize_question
+
+# Follower chờ leader tối đa (giây) cho mỗi token / cả câu trả lời
+FOLLOWER_TIMEOUT = 60.0
+
+
+def flight_key(question: str, context_key: str, prompt_context: str) -> Tuple[str, str, str]:
+    """(câu hỏi chuẩn hóa, context retrieval, fingerprint lịch sử + thông tin cá nhân)"""
+    fingerprint = hashlib.sha1(prompt_context.encode("utf-8")).hexdigest()[:16]
+    return normalize_question(question), context_key, fingerprint
+
+
+class LeaderCancelled(Exception):
+    """Leader dừng giữa chừng (client ngắt stream) trước khi có câu trả lời đầy đủ"""
+
+
+class Flight:
+    """1 lần gọi LLM đang chạy: các chunk đã nhận + trạng thái kết thúc"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.condition = threading.Condition()
+
+    def publish(self, chunk: str):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def subscribe(self, timeout: float = FOLLOWER_TIMEOUT) -> Iterator[str]:
+        """Các chunk từ đầu, rồi chunk mới ngay khi leader nhận được"""
+        position = 0
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(lambda: position < len(self.chunks) or self.done, timeout):
+                    raise TimeoutError("Hết thời gian chờ câu trả lời từ request đang xử lý")
+                pending = self.chunks[position:]
+                finished, error = self.done, self.error
+            position += len(pending)
+            yield from pending
+            if finished and position == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    def result(self, timeout: float = FOLLOWER_TIMEOUT) -> str:
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.done, timeout):
+                raise TimeoutError("Hết thời gian chờ câu trả lời từ request đang xử lý")
+            if self.error is not None:
+                raise self.error
+            return "".join(self.chunks)
+
+
+class SingleFlight:
+    """Bảng các lần gọi LLM đang chạy theo key"""
+
+    def __init__(self):
+        self.flights: Dict[Tuple[str, str, str], Flight] = {}
+        self.lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0, "handoffs": 0}
+
+    def _join(self, key) -> Tuple[Flight, bool]:
+        """(flight, True nếu request này là leader)"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.stats["followers"] += 1
+                return flight, False
+            flight = Flight()
+            self.flights[key] = flight
+            self.stats["leaders"] += 1
+            return flight, True
+
+    def _land(self, key, flight: Flight, error: Optional[BaseException] = None):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.finish(error)
+        if flight.followers:
+            print(f"🛬 Single flight: {flight.followers} request trùng dùng chung 1 lần gọi LLM")
+
+    def run(self, key, fn: Callable[[], str]) -> Tuple[str, bool]:
+        """(câu trả lời, True nếu dùng chung kết quả của leader)"""
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.result(), True
+        try:
+            answer = fn()
+        except BaseException as e:
+            self._land(key, flight, e)
+            raise
+        flight.publish(answer)
+        self._land(key, flight)
+        return answer, False
+
+    def stream(self, key, producer: Callable[[], Iterator[str]]) -> Tuple[Iterator[str], bool]:
+        """(iterator các token, True nếu theo stream của leader)"""
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.subscribe(), True
+        return _LeaderStream(self, key, flight, producer), False
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            total = self.stats["leaders"] + self.stats["followers"]
+            return {
+                **self.stats,
+                "in_flight": len(self.flights),
+                "coalesced_rate": round(self.stats["followers"] / total, 4) if total else 0.0,
+            }
+
+
+class _LeaderStream:
+    """
+    Iterator token của leader: chuyển từng token cho followers. Đóng trước khi stream xong
+    (client ngắt, kể cả khi chưa đọc token nào):
+    - có follower → thread nền đọc nốt stream upstream cho followers (1 tab đóng không làm hỏng
+      các request đang chờ cùng câu trả lời)
+    - không có follower → bỏ key rồi hủy upstream (không ai cần kết quả nữa)
+    """
+
+    def __init__(self, single_flight: SingleFlight, key, flight: Flight, producer: Callable[[], Iterator[str]]):
+        self.single_flight = single_flight
+        self.key = key
+        self.flight = flight
+        self.producer = producer
+        self.iterator: Optional[Iterator[str]] = None
+        self.landed = False
+        self.detached = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self.landed or self.detached:
+            raise StopIteration
+        try:
+            if self.iterator is None:
+                self.iterator = iter(self.producer())
+            chunk = next(self.iterator)
+        except StopIteration:
+            self._land(None)
+            raise
+        except Exception as e:
+            self._land(e)
+            raise
+        self.flight.publish(chunk)
+        return chunk
+
+    def _land(self, error: Optional[BaseException]):
+        if not self.landed:
+            self.landed = True
+            self.single_flight._land(self.key, self.flight, error)
+
+    def _drain(self):
+        """Đọc nốt upstream cho followers sau khi leader đã rời đi"""
+        try:
+            if self.iterator is None:
+                self.iterator = iter(self.producer())
+            for chunk in self.iterator:
+                self.flight.publish(chunk)
+        except Exception as e:
+            self._land(e)
+        else:
+            self._land(None)
+
+    def close(self):
+        if self.landed or self.detached:
+            return
+        with self.single_flight.lock:
+            # Kiểm tra + bỏ key trong cùng 1 lock: không có follower nào chen vào sau khi quyết định hủy
+            handoff = self.flight.followers > 0
+            if handoff:
+                self.single_flight.stats["handoffs"] += 1
+            elif self.single_flight.flights.get(self.key) is self.flight:
+                del self.single_flight.flights[self.key]
+        if handoff:
+            self.detached = True
+            print(f"🔀 Single flight: request gốc đã ngắt, tiếp tục stream cho {self.flight.followers} request đang chờ")
+            threading.Thread(target=self._drain, name="single-flight-handoff", daemon=True).start()
+            return
+        self._land(LeaderCancelled("Request gốc đã dừng trước khi trả lời xong"))
+        if hasattr(self.iterator, "close"):
+            self.iterator.close()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,79 @@
+"""
+Chat Storage
+Giao diện chung cho nơi lưu lịch sử hội thoại và dữ liệu cá nhân của user.
+
+- firestore (mặc định): production, client tạo lazily ở lần dùng đầu tiên
+- sqlite / memory: SQLite nhúng (file hoặc ":memory:"), có thể giả lập độ trễ mạng mỗi round trip
+  → chạy toàn bộ pipeline / load test trên máy cá nhân, so sánh các chiến lược cache lặp lại được
+
+Cấu hình (env): STORAGE_BACKEND, SQLITE_PATH, STORAGE_LATENCY_MS, STORAGE_JITTER_MS, STORAGE_FIXTURE
+"""
+import os
+import threading
+from typing import Dict, List
+
+from sessionHistory import SessionWrites, StoredHistory
+
+STORAGE_BACKENDS = ("firestore", "sqlite", "memory")
+DEFAULT_SQLITE_PATH = "chat_storage.db"
+# Số thao tác tối đa trong 1 batch ghi Firestore
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class ChatStorage:
+    """Lịch sử (append-only theo seq + tóm tắt) và dữ liệu cá nhân của user"""
+
+    name = "base"
+
+    def __init__(self):
+        self.stats_lock = threading.Lock()
+        self.history_reads = 0
+        self.history_batches = 0
+        self.user_reads = 0
+
+    def _count(self, counter: str, amount: int = 1):
+        with self.stats_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def load_history(self, session_id: str, limit: int) -> StoredHistory:
+        """`limit` lượt gần nhất (theo seq) + tóm tắt các lượt cũ"""
+        raise NotImplementedError
+
+    def save_histories(self, writes: Dict[str, SessionWrites]):
+        """Ghi thao tác của nhiều session (xóa / thêm lượt / thay tóm tắt) trong 1 batch"""
+        raise NotImplementedError
+
+    def load_user_docs(self, user_id: str) -> List[str]:
+        """Các đoạn text về user, người yêu và kế hoạch (storage/userDocuments.py)"""
+        raise NotImplementedError
+
+    def get_stats(self) -> dict:
+        with self.stats_lock:
+            return {
+                "backend": self.name,
+                "history_reads": self.history_reads,
+                "history_batches": self.history_batches,
+                "user_reads": self.user_reads,
+            }
+
+
+def create_storage(backend: str = None) -> ChatStorage:
+    """Storage theo STORAGE_BACKEND (firestore | sqlite | memory)"""
+    backend = (backend or os.getenv("STORAGE_BACKEND", "firestore")).lower()
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"STORAGE_BACKEND không hợp lệ: {backend} (chọn {', '.join(STORAGE_BACKENDS)})")
+
+    if backend == "firestore":
+        from storage.firestoreStorage import FirestoreStorage
+        return FirestoreStorage()
+
+    from storage.sqliteStorage import SQLiteStorage
+    storage = SQLiteStorage(
+        path=":memory:" if backend == "memory" else os.getenv("SQLITE_PATH", DEFAULT_SQLITE_PATH),
+        latency_ms=float(os.getenv("STORAGE_LATENCY_MS", "0")),
+        jitter_ms=float(os.getenv("STORAGE_JITTER_MS", "0")),
+    )
+    fixture = os.getenv("STORAGE_FIXTURE")
+    if fixture:
+        storage.load_fixture(fixture)
+    return storage
@@ -0,0 +1,88 @@
+"""
+Firestore Storage
+- Lịch sử: chat_sessions/{session_id}/turns/{seq}, mỗi lượt hỏi đáp 1 document (append-only);
+  document chat_sessions/{session_id} giữ updated_at, tóm tắt (summary, summary_seq)
+  và mảng history của session lưu theo kiểu cũ
+- Dữ liệu user: users / couples / couple_plans (manageDataFirebase/buildDataApp.py)
+"""
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+from firebase_admin import firestore
+
+from sessionHistory import SessionWrites, StoredHistory
+from storage.chatStorage import FIRESTORE_BATCH_LIMIT, ChatStorage
+
+
+class FirestoreStorage(ChatStorage):
+    name = "firestore"
+
+    def __init__(self, client_factory=None):
+        super().__init__()
+        self.client_factory = client_factory or firestore.client
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    @property
+    def db(self):
+        """Firestore client tạo ở lần dùng đầu tiên (import main không cần credentials)"""
+        if self._db is None:
+            with self._db_lock:
+                if self._db is None:
+                    self._db = self.client_factory()
+        return self._db
+
+    def _turns_collection(self, session_id: str):
+        return self.db.collection('chat_sessions').document(session_id).collection('turns')
+
+    def load_history(self, session_id: str, limit: int) -> StoredHistory:
+        """Query turns sắp theo seq giảm dần + limit (không đọc cả lịch sử)"""
+        self._count("history_reads")
+        try:
+            doc = self.db.collection('chat_sessions').document(session_id).get()
+            data = doc.to_dict() if doc.exists else {}
+            docs = self._turns_collection(session_id).order_by(
+                'seq', direction=firestore.Query.DESCENDING
+            ).limit(limit).get()
+            turns = [turn.to_dict() for turn in docs][::-1]
+            if not turns:
+                # Session lưu theo kiểu cũ (cả mảng history trong 1 document)
+                turns = data.get('history', [])[-limit:]
+            return StoredHistory(turns, data.get('summary', ""), data.get('summary_seq', 0))
+        except Exception as e:
+            print(f"Error getting history: {e}")
+            return StoredHistory([])
+
+    def save_histories(self, writes: Dict[str, SessionWrites]):
+        """Mỗi lượt mới 1 document trong turns, không ghi lại các lượt cũ"""
+        operations = []
+        for session_id, session_writes in writes.items():
+            session_ref = self.db.collection('chat_sessions').document(session_id)
+            if session_writes.cleared:
+                operations.extend(
+                    ("delete", (doc.reference,), {}) for doc in self._turns_collection(session_id).get()
+                )
+                operations.append(("set", (session_ref, {'history': []}), {}))
+            for turn in session_writes.turns:
+                # seq trùng nhau giữa 2 instance vẫn không ghi đè nhờ hậu tố ngẫu nhiên
+                turn_ref = self._turns_collection(session_id).document(f"{turn['seq']:020d}-{uuid.uuid4().hex[:6]}")
+                operations.append(("set", (turn_ref, turn), {}))
+            session_data = {'updated_at': datetime.now()}
+            if session_writes.summary is not None:
+                session_data.update(summary=session_writes.summary, summary_seq=session_writes.summary_seq)
+            operations.append(("set", (session_ref, session_data), {"merge": True}))
+
+        for start in range(0, len(operations), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for method, args, kwargs in operations[start:start + FIRESTORE_BATCH_LIMIT]:
+                getattr(batch, method)(*args, **kwargs)
+            batch.commit()
+            self._count("history_batches")
+
+    def load_user_docs(self, user_id: str) -> List[str]:
+        from manageDataFirebase.buildDataApp import get_user_data_from_firebase
+        self._count("user_reads")
+        # main.py cache kết quả trong firebaseCache → không cache thêm lần nữa ở đây
+        return get_user_data_from_firebase(user_id, use_cache=False)
@@ -0,0 +1,202 @@
+"""
+SQLite Storage
+Backend nhúng thay Firestore khi chạy local / load test (STORAGE_BACKEND=sqlite hoặc memory).
+
+- Cùng dữ liệu, cùng text user (storage/userDocuments.py) như Firestore
+- latency_ms ± jitter_ms giả lập độ trễ mạng cho mỗi round trip Firestore tương ứng:
+  load_history 2 (document session + query turns), mỗi batch ghi 1,
+  load_user_docs 1-5 (user, người yêu, couples theo user1Id / user2Id, couple_plans)
+- Jitter sinh từ random.Random(seed) → cùng seed, cùng chuỗi độ trễ giữa các lần chạy
+- Thời gian chờ nằm ngoài lock: nhiều request đồng thời chờ song song như với Firestore thật
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List
+
+from sessionHistory import SessionWrites, StoredHistory
+from storage.chatStorage import FIRESTORE_BATCH_LIMIT, ChatStorage
+from storage.userDocuments import build_user_documents
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_session_seq ON turns (session_id, seq);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    summary_seq INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS couples (id TEXT PRIMARY KEY, user1_id TEXT, user2_id TEXT, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS couple_plans (id TEXT PRIMARY KEY, couple_id TEXT, data TEXT NOT NULL);
+"""
+
+
+class SQLiteStorage(ChatStorage):
+    name = "sqlite"
+
+    def __init__(self, path: str = ":memory:", latency_ms: float = 0, jitter_ms: float = 0, seed: int = 0):
+        super().__init__()
+        self.path = path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rng = random.Random(seed)
+        self.round_trips = 0
+        self.waited_ms = 0.0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+        if path == ":memory:":
+            self.name = "memory"
+
+    def _round_trip(self, count: int = 1):
+        """Chờ như `count` lần gọi Firestore nối tiếp nhau"""
+        if not self.latency_ms and not self.jitter_ms:
+            self._count("round_trips", count)
+            return
+        with self.stats_lock:
+            delays = [
+                max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms))
+                for _ in range(count)
+            ]
+            self.round_trips += count
+            self.waited_ms += sum(delays)
+        time.sleep(sum(delays) / 1000)
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, tuple(params)).fetchall()
+
+    def load_history(self, session_id: str, limit: int) -> StoredHistory:
+        self._count("history_reads")
+        self._round_trip(2)
+        try:
+            with self.lock:
+                session = self.conn.execute(
+                    "SELECT summary, summary_seq FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                rows = self.conn.execute(
+                    "SELECT data FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?", (session_id, limit)
+                ).fetchall()
+            turns = [json.loads(data) for (data,) in rows][::-1]
+            summary, summary_seq = session if session else ("", 0)
+            return StoredHistory(turns, summary, summary_seq)
+        except Exception as e:
+            print(f"Error getting history: {e}")
+            return StoredHistory([])
+
+    def save_histories(self, writes: Dict[str, SessionWrites]):
+        """1 transaction; độ trễ tính theo số batch Firestore (500 thao tác) + query khi xóa"""
+        operations = 0
+        clears = 0
+        now = time.time()
+        with self.lock, self.conn:
+            for session_id, session_writes in writes.items():
+                if session_writes.cleared:
+                    clears += 1
+                    operations += self.conn.execute(
+                        "DELETE FROM turns WHERE session_id = ?", (session_id,)
+                    ).rowcount + 1
+                    self.conn.execute(
+                        "UPDATE sessions SET summary = '', summary_seq = 0 WHERE session_id = ?", (session_id,)
+                    )
+                self.conn.executemany(
+                    "INSERT INTO turns (session_id, seq, data) VALUES (?, ?, ?)",
+                    [(session_id, turn["seq"], json.dumps(turn, ensure_ascii=False, default=str))
+                     for turn in session_writes.turns],
+                )
+                self.conn.execute(
+                    "INSERT INTO sessions (session_id, updated_at) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                    (session_id, now),
+                )
+                if session_writes.summary is not None:
+                    self.conn.execute(
+                        "UPDATE sessions SET summary = ?, summary_seq = ? WHERE session_id = ?",
+                        (session_writes.summary, session_writes.summary_seq, session_id),
+                    )
+                operations += len(session_writes.turns) + 1
+        batches = -(-operations // FIRESTORE_BATCH_LIMIT)
+        self._round_trip(clears + batches)
+        self._count("history_batches", batches)
+
+    def load_user_docs(self, user_id: str) -> List[str]:
+        """Cùng thứ tự truy vấn với get_user_data_from_firebase"""
+        self._count("user_reads")
+        self._round_trip()
+        user_data = self._get_user(user_id)
+        if user_data is None:
+            print(f"⚠️ User {user_id} không tồn tại trong SQLite")
+            return []
+
+        partner_data = None
+        plans = []
+        partner_id = user_data.get("partnerId")
+        if partner_id:
+            self._round_trip()
+            partner_data = self._get_user(partner_id)
+            if partner_data is not None:
+                self._round_trip()
+                rows = self._query("SELECT id FROM couples WHERE user1_id = ? LIMIT 1", (user_id,))
+                if not rows:
+                    self._round_trip()
+                    rows = self._query("SELECT id FROM couples WHERE user2_id = ? LIMIT 1", (user_id,))
+                if rows:
+                    self._round_trip()
+                    plans = [
+                        json.loads(data) for (data,) in
+                        self._query("SELECT data FROM couple_plans WHERE couple_id = ? ORDER BY id", (rows[0][0],))
+                    ]
+        return build_user_documents(user_data, partner_data, plans)
+
+    def _get_user(self, user_id: str):
+        rows = self._query("SELECT data FROM users WHERE id = ?", (user_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def seed(self, users: Dict = None, couples: Dict = None, couple_plans: Dict = None):
+        """Ghi dữ liệu user theo đúng cấu trúc 3 collection Firestore ({doc_id: data})"""
+        dump = lambda data: json.dumps(data, ensure_ascii=False, default=str)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users (id, data) VALUES (?, ?)",
+                [(doc_id, dump(data)) for doc_id, data in (users or {}).items()],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO couples (id, user1_id, user2_id, data) VALUES (?, ?, ?, ?)",
+                [(doc_id, data.get("user1Id"), data.get("user2Id"), dump(data))
+                 for doc_id, data in (couples or {}).items()],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO couple_plans (id, couple_id, data) VALUES (?, ?, ?)",
+                [(doc_id, data.get("coupleId"), dump(data)) for doc_id, data in (couple_plans or {}).items()],
+            )
+
+    def load_fixture(self, path: str):
+        """File JSON {"users": {...}, "couples": {...}, "couple_plans": {...}}"""
+        with open(path, "r", encoding="utf-8") as f:
+            fixture = json.load(f)
+        self.seed(fixture.get("users"), fixture.get("couples"), fixture.get("couple_plans"))
+        print(f"✅ Storage fixture: {len(fixture.get('users', {}))} users từ {path}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        with self.stats_lock:
+            stats.update(
+                path=self.path,
+                latency_ms=self.latency_ms,
+                jitter_ms=self.jitter_ms,
+                round_trips=self.round_trips,
+                waited_ms=round(self.waited_ms, 1),
+            )
+        return stats
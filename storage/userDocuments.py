@@ -0,0 +1,67 @@
+"""
+User Documents
+Ghép dữ liệu user / người yêu / kế hoạch thành các đoạn text đưa vào prompt.
+Dùng chung cho mọi storage backend (Firestore, SQLite) để text giống hệt nhau.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import pytz
+
+
+def user_text(user_data: Dict) -> str:
+    return (
+        f"Thông tin của người dùng tên : {user_data.get('name', 'Không rõ')}, "
+        f"ngày sinh nhật : {user_data.get('dateOfBirth', 'Không có')}, "
+        f"Số điện thoại : {user_data.get('phoneNumber', 'Không có')}, "
+        f"Giới tính : {user_data.get('gender', 'Không rõ')}"
+    )
+
+
+def format_start_love_date(start_date_raw) -> str:
+    """startLoveDate (Firestore Timestamp / datetime / chuỗi ISO) → dd/mm/YYYY giờ Việt Nam"""
+    if not start_date_raw:
+        return "không rõ"
+    try:
+        if hasattr(start_date_raw, 'timestamp'):
+            # Firestore Timestamp hoặc datetime
+            dt = datetime.fromtimestamp(start_date_raw.timestamp())
+        else:
+            dt = datetime.fromisoformat(str(start_date_raw))
+        vietnam_tz = pytz.timezone('Asia/Ho_Chi_Minh')
+        return dt.replace(tzinfo=pytz.UTC).astimezone(vietnam_tz).strftime("%d/%m/%Y")
+    except Exception as e:
+        print(f"⚠️ Lỗi convert startLoveDate: {e}")
+        return str(start_date_raw)
+
+
+def plan_text(plan_data: Dict) -> str:
+    return (
+        f"Bạn có 1 kế hoạch: {plan_data.get('title', '')}, vào ngày: {plan_data.get('date', '')} , "
+        f"giờ: {plan_data.get('time', '')} với nội dung: {plan_data.get('details', '')}"
+    )
+
+
+def build_user_documents(
+    user_data: Dict, partner_data: Optional[Dict] = None, plans: Iterable[Dict] = ()
+) -> List[str]:
+    """Thông tin user + (nếu có người yêu) mối quan hệ, chi tiết người yêu và các kế hoạch của couple"""
+    user_docs = [user_text(user_data)]
+    if partner_data is None:
+        return user_docs
+
+    start_date = format_start_love_date(user_data.get("startLoveDate"))
+    partner_name = partner_data.get("name", "Không rõ")
+    user_docs.append(
+        f"Bạn bắt đầu hẹn hò vào thời gian : {start_date}, "
+        f"người yêu bạn tên là : {partner_name}"
+    )
+    user_docs.append(
+        f"Thông tin chi tiết về người yêu của bạn: "
+        f"Tên: {partner_name}, "
+        f"Ngày sinh: {partner_data.get('dateOfBirth', 'Không có')}, "
+        f"Số điện thoại: {partner_data.get('phoneNumber', 'Không có')}, "
+        f"Giới tính: {partner_data.get('gender', 'Không rõ')}"
+    )
+    user_docs.extend(plan_text(plan) for plan in plans)
+    return user_docs
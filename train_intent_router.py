@@ -0,0 +1,102 @@
+"""
+Train model intent cho intentRouter.py (chạy offline, commit file intent_model.npz)
+
+Dữ liệu: intent_data.csv (message,intent) + câu hỏi trong hanoi_testdata.csv (intent "rag").
+In kết quả cross-validation trước khi train trên toàn bộ dữ liệu:
+- accuracy theo intent
+- "trả lời nhầm": câu bị trả lời tại chỗ (vượt ngưỡng tin cậy) với intent sai → cần ~0
+
+Cách chạy:
+    python train_intent_router.py
+    python train_intent_router.py --confidence 0.8 --folds 5
+"""
+
+import argparse
+import csv
+
+import numpy as np
+
+from intentRouter import (
+    DEFAULT_CONFIDENCE, INTENTS, MODEL_FILE, RAG_INTENT, IntentModel, extract_features, keyword_groups,
+    local_answer_blocker,
+)
+
+INTENT_DATA_FILE = "intent_data.csv"
+TEST_DATA_FILE = "hanoi_testdata.csv"
+# Câu trong hanoi_testdata.csv có câu trả lời mẫu là từ chối vì ngoài chủ đề (không cần retrieval);
+# các câu từ chối vì thiếu dữ liệu (Đà Nẵng, quà cho sếp...) vẫn là "rag"
+TEST_DATA_INTENTS = {"TEST_034": "out_of_scope", "TEST_035": "out_of_scope", "TEST_036": "out_of_scope"}
+
+
+def load_examples():
+    with open(INTENT_DATA_FILE, "r", encoding="utf-8") as f:
+        examples = [(row["message"], row["intent"]) for row in csv.DictReader(f)]
+    with open(TEST_DATA_FILE, "r", encoding="utf-8") as f:
+        examples.extend(
+            (row["Question"], TEST_DATA_INTENTS.get(row["ID"], RAG_INTENT)) for row in csv.DictReader(f)
+        )
+    return examples
+
+
+def would_route(model, message, features, groups, confidence):
+    """Cùng luật với IntentRouter.route: (intent dự đoán, có trả lời tại chỗ không)"""
+    probabilities = model.predict_proba(features)
+    best = int(np.argmax(probabilities))
+    intent = model.classes[best]
+    blocked = local_answer_blocker(message, intent, groups) is not None
+    return intent, intent != RAG_INTENT and not blocked and probabilities[best] >= confidence
+
+
+def cross_validate(messages, labels, features, groups, folds, confidence, seed=0):
+    order = np.random.default_rng(seed).permutation(len(labels))
+    correct = {intent: [0, 0] for intent in INTENTS}
+    routed, wrongly_routed, routable = 0, [], 0
+    for fold in range(folds):
+        test = order[fold::folds]
+        train = np.setdiff1d(order, test)
+        model = IntentModel.train(features[train], [labels[i] for i in train])
+        for i in test:
+            intent, route = would_route(model, messages[i], features[i], groups[i], confidence)
+            correct[labels[i]][0] += intent == labels[i]
+            correct[labels[i]][1] += 1
+            routable += labels[i] != RAG_INTENT
+            if route:
+                routed += 1
+                if intent != labels[i]:
+                    wrongly_routed.append((messages[i], labels[i], intent))
+    return correct, routed, routable, wrongly_routed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train intent router")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--output", default=MODEL_FILE)
+    args = parser.parse_args()
+
+    examples = load_examples()
+    messages = [message for message, _ in examples]
+    labels = [intent for _, intent in examples]
+    groups = [keyword_groups(message) for message in messages]
+    features = np.stack([extract_features(message, g) for message, g in zip(messages, groups)])
+    print(f"📚 {len(examples)} câu mẫu, {features.shape[1]} features")
+
+    correct, routed, routable, wrongly_routed = cross_validate(
+        messages, labels, features, groups, args.folds, args.confidence
+    )
+    print(f"\n{args.folds}-fold cross-validation (ngưỡng {args.confidence}):")
+    for intent, (hits, total) in correct.items():
+        if total:
+            print(f"  {intent:<14} accuracy {hits / total:.2%} ({hits}/{total})")
+    print(f"  Trả lời tại chỗ: {routed}/{routable} câu không cần LLM")
+    print(f"  Trả lời nhầm: {len(wrongly_routed)}")
+    for message, label, intent in wrongly_routed:
+        print(f"    ⚠️ '{message}' ({label}) -> {intent}")
+
+    model = IntentModel.train(features, labels)
+    model.save(args.output)
+    print(f"\n✅ Đã lưu model vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
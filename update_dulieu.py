@@ -2,9 +2,13 @@ import os
 import csv
 from pathlib import Path
 
+from ingestion.csvRowDocument import row_to_document
+from retrieval.segmentedIndex import SegmentedIndex
+
 # Đường dẫn đến thư mục notes và file CSV
 notes_folder = Path("notes")
 csv_file = Path("dulieu.csv")
+index_dir = Path("retrieval_index")
 
 # Đọc tất cả các file txt trong thư mục notes
 notes_data = []
@@ -59,3 +63,16 @@ with open(csv_file, 'w', encoding='utf-8', newline='') as f:
 
 print(f"✅ Đã thêm {len(notes_data)} dòng dữ liệu mới từ thư mục notes vào file dulieu.csv")
 print(f"📊 Tổng số dòng dữ liệu hiện tại: {len(existing_data) + len(notes_data)}")
+
+# Thêm thẳng các dòng mới vào retrieval index (segment mới) - không cần chạy lại prepare_data.py
+if index_dir.exists():
+    index = SegmentedIndex.open(str(index_dir))
+    new_docs = [
+        row_to_document(row, str(csv_file), len(existing_data) + i)
+        for i, row in enumerate(notes_data)
+    ]
+    index.add_documents(
+        [doc.page_content for doc in new_docs],
+        [doc.metadata for doc in new_docs],
+    )
+    print(f"🔎 Retrieval index hiện có {index.n_docs} documents")
@@ -0,0 +1,62 @@
+"""
+Cập nhật retrieval index tăng dần (không rebuild toàn bộ, không cần redeploy)
+
+Cách dùng:
+    python update_index.py add notes/gift7.txt notes/plan4.txt   # thêm file text
+    python update_index.py delete 12 13                           # xóa theo doc id
+    python update_index.py compact [--all]                        # gộp segments
+    python update_index.py stats
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+from retrieval.segmentedIndex import SegmentedIndex
+
+RETRIEVAL_INDEX_DIR = "retrieval_index"
+
+
+def add_files(index: SegmentedIndex, paths):
+    """Thêm mỗi file text thành 1 document"""
+    texts, metadatas = [], []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+        metadatas.append({"source": str(Path(path))})
+    doc_ids = index.add_documents(texts, metadatas)
+    for path, doc_id in zip(paths, doc_ids):
+        print(f"   {path} → doc id {doc_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cập nhật retrieval index tăng dần")
+    parser.add_argument("--index-dir", default=RETRIEVAL_INDEX_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Thêm file text vào index")
+    add_parser.add_argument("paths", nargs="+")
+
+    delete_parser = subparsers.add_parser("delete", help="Xóa documents theo doc id")
+    delete_parser.add_argument("doc_ids", nargs="+", type=int)
+
+    compact_parser = subparsers.add_parser("compact", help="Gộp các segment")
+    compact_parser.add_argument("--all", action="store_true", help="Gộp tất cả thành 1 segment")
+
+    subparsers.add_parser("stats", help="Xem thống kê index")
+
+    args = parser.parse_args()
+    index = SegmentedIndex.open(args.index_dir)
+
+    if args.command == "add":
+        add_files(index, args.paths)
+    elif args.command == "delete":
+        index.delete_documents(args.doc_ids)
+    elif args.command == "compact":
+        index.compact(force=args.all)
+
+    print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()